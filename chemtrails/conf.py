@@ -22,8 +22,26 @@ DEFAULTS = {
     'MAX_CONNECTION_DEPTH': 1,
     'NAMED_RELATIONSHIPS': True,
     'CONNECT_META_NODES': False,
+    # Following sync modes are supported:
+    #   - inline:   sync the graph directly from the signal handlers.
+    #   - deferred: queue objects and sync them when the transaction commits.
+    #   - outbox:   write objects to the outbox table, drained by `chemtrails_worker`.
+    'SYNC_MODE': 'inline',
+    'SYNC_CHUNK_SIZE': 500,
+    'CLEAN_NODES_ON_SYNC': True,
+    'CACHE_ALIAS': 'default',
+    'CACHE_REGISTRIES': False,
+    'CACHE_PERMISSIONS': False,
+    # Following rule evaluation modes are supported:
+    #   - sequential: execute one query for each access rule.
+    #   - union:      merge the access rule queries into a single query.
+    #   - parallel:   execute the access rule queries concurrently on a thread pool.
+    'RULE_EVALUATION': 'sequential',
+    'RULE_EVALUATION_WORKERS': 4,
+    'RULE_STATISTICS_INTERVAL': 60,
     'IGNORE_MODELS': [
         'admin.logentry',
+        'chemtrails.*',
         'migrations.migration',
     ],
 }
@@ -15,10 +15,13 @@ from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
 from chemtrails.contrib.permissions.models import AccessRule
+from chemtrails.contrib.permissions.registry import access_rule_registry
+from chemtrails.contrib.permissions.rules import compile_access_rule
+from chemtrails.contrib.permissions.stats import rule_statistics
 from chemtrails.contrib.permissions.views import AccessRuleViewSet, MetaGraphView
 from chemtrails.contrib.permissions.forms import CypherWidget
+from chemtrails.neoutils import bump_graph_version
 from chemtrails.neoutils.query import get_node_relationship_types
-from chemtrails.neoutils import get_node_for_object
 from chemtrails.neoutils.query import validate_cypher
 
 
@@ -43,29 +46,22 @@ class AccessRuleForm(forms.ModelForm):
         if not isinstance(instance, self._meta.model):
             return ''
 
-        # TODO: This should be DRY'ed up!
-        fake_model = instance.ctype_source.model_class()(pk=0)
-        manager = get_node_for_object(fake_model, bind=False).paths
-        if instance.direction is not None:
-            manager.direction = instance.direction
-
         error_message = _('Unable to validate cypher statement.\nError was: "%(error)s".')
 
         query = None
-        for n, rule_definition in enumerate(instance.relation_types_obj):
-            relation_type, target_props = zip(*rule_definition.items())
-            relation_type, target_props = relation_type[0], target_props[0]
+        try:
+            rule = compile_access_rule(instance)
+        except (ValueError, AttributeError, IndexError) as e:
+            return error_message % {'error': e}
 
-            source_props = {}
-            if n == 0 and instance.requires_staff:
-                source_props.update({'is_staff': True})
-            try:
-                manager = manager.add(relation_type, source_props=source_props, target_props=target_props)
-            except (ValueError, AttributeError) as e:
-                return error_message % {'error': e}
+        if rule.statement:
+            query = rule.get_path()
 
-        if manager.statement:
-            query = manager.get_path()
+            # Show the parameter values below the statement.
+            params = rule.params
+            if params:
+                query = '\n'.join([query] + ['// ${key} = {value!r}'.format(key=key, value=params[key])
+                                             for key in sorted(params.keys())])
 
         try:
             if query:
@@ -97,7 +93,7 @@ class AccessRuleAdmin(admin.ModelAdmin):
     form = AccessRuleForm
     actions = ('toggle_active',)
     list_display = ('short_description', 'ctype_target', 'ctype_source',
-                    'requires_staff', 'is_active', 'updated')
+                    'requires_staff', 'is_active', 'evaluation_rank', 'evaluation_statistics', 'updated')
     list_filter = ('requires_staff', 'is_active', TargetContentTypeFilter)
     search_fields = ('description',)
     filter_horizontal = ('permissions',)
@@ -128,6 +124,9 @@ class AccessRuleAdmin(admin.ModelAdmin):
             is_active=models.Case(
                 models.When(is_active=True, then=models.Value(False)),
                 default=models.Value(True)))
+        # ``update()`` does not send any signals.
+        access_rule_registry.invalidate()
+        bump_graph_version()
         self.message_user(request, _('Activated {0} and deactivated {1} '
                                      'access rules.'.format(queryset.filter(is_active=True).count(),
                                                             queryset.filter(is_active=False).count())))
@@ -136,6 +135,24 @@ class AccessRuleAdmin(admin.ModelAdmin):
     def short_description(self, obj):
         return Truncator(obj.description).chars(65)
 
+    def evaluation_rank(self, obj):
+        """
+        Rank of the access rule in this process, lower ranked rules are evaluated first.
+        """
+        return rule_statistics.get_ranking().get(obj.pk, '-')
+    evaluation_rank.short_description = _('rank')
+
+    def evaluation_statistics(self, obj):
+        evaluations, hits, total_time = rule_statistics.get(obj.pk)
+        if not evaluations:
+            return '-'
+        return _('%(evaluations)d evaluations, %(hit_rate).0f%% hits, %(average).1f ms') % {
+            'evaluations': evaluations,
+            'hit_rate': 100.0 * hits / evaluations,
+            'average': 1000.0 * total_time / evaluations
+        }
+    evaluation_statistics.short_description = _('statistics')
+
     def get_urls(self):
 
         router = routers.DefaultRouter()
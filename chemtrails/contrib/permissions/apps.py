@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 from django.apps import AppConfig
+from django.core.checks import register
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
 from django.utils.translation import gettext_lazy as _
 
 
@@ -8,3 +10,34 @@ class ChemtrailsPermissionsConfig(AppConfig):
     name = 'chemtrails.contrib.permissions'
     verbose_name = _('Graph based permissions')
     label = 'chemtrails_permissions'
+
+    def ready(self):
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import Permission
+        from .checks import check_cache_alias
+        from .models import AccessRule
+        from .signals import (
+            access_rule_changed_handler, access_rule_permissions_changed_handler,
+            permissions_changed_handler, user_permissions_changed_handler
+        )
+
+        User = get_user_model()
+
+        post_save.connect(receiver=access_rule_changed_handler, sender=AccessRule,
+                          dispatch_uid='chemtrails.contrib.permissions.signals.access_rule_post_save_handler')
+        post_delete.connect(receiver=access_rule_changed_handler, sender=AccessRule,
+                            dispatch_uid='chemtrails.contrib.permissions.signals.access_rule_post_delete_handler')
+        m2m_changed.connect(receiver=access_rule_permissions_changed_handler, sender=AccessRule.permissions.through,
+                            dispatch_uid='chemtrails.contrib.permissions.signals.access_rule_permissions_changed_handler')
+        for field in filter(lambda field: hasattr(User, field), ('user_permissions', 'groups')):
+            m2m_changed.connect(receiver=user_permissions_changed_handler, sender=getattr(User, field).through,
+                                dispatch_uid='chemtrails.contrib.permissions.signals.user_%s_changed_handler' % field)
+
+        post_save.connect(receiver=permissions_changed_handler, sender=Permission,
+                          dispatch_uid='chemtrails.contrib.permissions.signals.permission_post_save_handler')
+        post_delete.connect(receiver=permissions_changed_handler, sender=Permission,
+                            dispatch_uid='chemtrails.contrib.permissions.signals.permission_post_delete_handler')
+        post_migrate.connect(receiver=permissions_changed_handler,
+                             dispatch_uid='chemtrails.contrib.permissions.signals.permissions_post_migrate_handler')
+
+        register(check_cache_alias)
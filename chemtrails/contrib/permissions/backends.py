@@ -3,7 +3,7 @@
 from django.contrib.auth.backends import ModelBackend
 from django.db import models
 
-from chemtrails.contrib.permissions.utils import GraphPermissionChecker, check_permissions_app_label
+from chemtrails.contrib.permissions.utils import check_permissions_app_label, get_checker
 
 
 def check_user_support(user_obj):
@@ -19,6 +19,9 @@ class ChemoPermissionsBackend(ModelBackend):
     access them. It is done by querying Neo4j for a PATH between
     the ``user_obj`` node and the ``obj`` node. One or more ``AccessRule``
     objects are used to build the PATH query and required permissions.
+
+    The permission checker is attached to ``user_obj``, so permissions and
+    results are reused for all checks during a request.
     """
     def authenticate(self, username=None, password=None, **kwargs):
         """
@@ -40,7 +43,7 @@ class ChemoPermissionsBackend(ModelBackend):
         if '.' in perm:
             check_permissions_app_label(perm)
 
-        checker = GraphPermissionChecker(user_obj)
+        checker = get_checker(user_obj)
         return checker.has_perm(perm, obj)
 
     def get_all_permissions(self, user_obj, obj=None):
@@ -50,5 +53,5 @@ class ChemoPermissionsBackend(ModelBackend):
         if not isinstance(obj, models.Model) or not check_user_support(user_obj):
             return set()
 
-        checker = GraphPermissionChecker(user_obj)
+        checker = get_checker(user_obj)
         return checker.get_perms(obj)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from chemtrails.neoutils.version import get_cache, get_graph_version
+
+__all__ = [
+    'get_decision',
+    'get_decision_cache_key'
+]
+
+
+def get_decision_cache():
+    """
+    :returns: The Django cache used for permission decisions, or None if
+              ``CACHE_PERMISSIONS`` is disabled.
+    """
+    from chemtrails.conf import settings
+    return get_cache() if settings.CACHE_PERMISSIONS else None
+
+
+def get_decision_cache_key(version, *parts):
+    return 'chemtrails:decision:%s:%s' % (version, ':'.join(str(part) for part in parts))
+
+
+def get_decision(parts, func):
+    """
+    Returns the cached permission decision identified by ``parts``, calling
+    ``func`` to calculate it if missing. Decisions are cached for the current
+    graph version, so they are invalidated as soon as the graph or any access
+    rule changes.
+    :param parts: Sequence of values identifying the decision.
+    :param func: Callable returning the decision. Must not return None.
+    :returns: The decision.
+    """
+    cache = get_decision_cache()
+    if cache is None:
+        return func()
+
+    key = get_decision_cache_key(get_graph_version(), *parts)
+    decision = cache.get(key)
+    if decision is None:
+        decision = func()
+        cache.set(key, decision)
+    return decision
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from django.core.checks import Error
+
+
+def check_cache_alias(app_configs, **kwargs):
+    """
+    Make sure the cache holding the version counters is shared between processes
+    when the settings which depends on them are enabled.
+    """
+    from chemtrails.conf import settings
+    from chemtrails.neoutils.version import get_cache, is_shared_cache
+
+    if get_cache() is None or is_shared_cache():
+        return []
+
+    errors = []
+    if settings.CACHE_REGISTRIES:
+        errors.append(Error(
+            'The CACHE_ALIAS cache "%s" is not shared between processes, so the access rule '
+            'and permission registries enabled by CACHE_REGISTRIES are bypassed.' % settings.CACHE_ALIAS,
+            hint='Use a cache shared between processes, such as memcached or redis, '
+                 'or disable CACHE_REGISTRIES.',
+            id='chemtrails_permissions.E001'
+        ))
+    if settings.CACHE_PERMISSIONS:
+        errors.append(Error(
+            'The CACHE_ALIAS cache "%s" is not shared between processes, which makes '
+            'CACHE_PERMISSIONS serve stale permission decisions.' % settings.CACHE_ALIAS,
+            hint='Use a cache shared between processes, such as memcached or redis, '
+                 'or disable CACHE_PERMISSIONS.',
+            id='chemtrails_permissions.E002'
+        ))
+    return errors
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from django.db import transaction
+
+from chemtrails.neoutils.version import bump_version, get_version, is_shared_cache
+
+__all__ = [
+    'AccessRuleRegistry',
+    'PermissionRegistry',
+    'access_rule_registry',
+    'permission_registry'
+]
+
+ACCESS_RULES_VERSION_KEY = 'chemtrails:access_rules_version'
+PERMISSIONS_VERSION_KEY = 'chemtrails:permissions_version'
+
+
+def registries_enabled():
+    """
+    :returns: True if the registries are enabled by the ``CACHE_REGISTRIES`` setting,
+      and the cache holding their version counters is shared between processes.
+    """
+    from chemtrails.conf import settings
+    return settings.CACHE_REGISTRIES and is_shared_cache()
+
+
+class AccessRuleRegistry(object):
+    """
+    Process local registry of all active access rules, indexed by
+    (source content type id, target content type id). Each access rule has its
+    permission codenames available as ``codenames``.
+
+    The registry is loaded lazily and reloaded when the access rules version in
+    the cache has changed, which happens every time an access rule is saved,
+    deleted or has its permissions changed. Other processes can only be notified
+    through a cache shared between processes, so the registry must be enabled by
+    the ``CACHE_REGISTRIES`` setting. Otherwise it is bypassed, and the access
+    rules are read from the database every time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = None
+        self._version = None
+
+    def load(self, ctype_source=None, ctype_target=None):
+        """
+        Load active access rules from the database.
+        :param ctype_source: If given, only load access rules originating from ``ctype_source``.
+        :param ctype_target: If given, only load access rules targeting ``ctype_target``.
+        :returns: Dictionary mapping (source content type id, target content type id)
+                  to a list of access rules.
+        """
+        from chemtrails.contrib.permissions.models import AccessRule
+
+        rules = {}
+        queryset = (AccessRule.objects.filter(is_active=True)
+                    .select_related('ctype_source', 'ctype_target').prefetch_related('permissions'))
+        if ctype_source is not None:
+            queryset = queryset.filter(ctype_source=ctype_source)
+        if ctype_target is not None:
+            queryset = queryset.filter(ctype_target=ctype_target)
+        for access_rule in queryset:
+            access_rule.codenames = frozenset(perm.codename for perm in access_rule.permissions.all())
+            rules.setdefault((access_rule.ctype_source_id, access_rule.ctype_target_id), []).append(access_rule)
+        return rules
+
+    def get_rules(self, ctype_source, ctype_target):
+        """
+        :returns: List of active access rules originating from ``ctype_source``
+                  and targeting ``ctype_target``.
+        """
+        key = (ctype_source.pk, ctype_target.pk)
+        if not registries_enabled():
+            return self.load(ctype_source, ctype_target).get(key, [])
+
+        version = get_version(ACCESS_RULES_VERSION_KEY)
+        rules = self._rules
+        if rules is None or version != self._version:
+            with self._lock:
+                if self._rules is None or version != self._version:
+                    self._rules, self._version = self.load(), version
+                rules = self._rules
+        return rules.get(key, [])
+
+    def invalidate(self):
+        """
+        Reload the registry on next access, in this and all other processes.
+        Other processes are notified when the current transaction commits, so
+        they never reload the registry before the changes are visible to them.
+        """
+        with self._lock:
+            self._rules = None
+        transaction.on_commit(self._invalidate_shared)
+
+    def _invalidate_shared(self):
+        with self._lock:
+            self._rules = None
+        bump_version(ACCESS_RULES_VERSION_KEY)
+
+
+class PermissionRegistry(object):
+    """
+    Process local registry mapping (app label, permission codename) to the
+    ``ContentType`` the permission belongs to, which makes resolving
+    "app_label.codename" permission strings a dictionary lookup.
+
+    The registry is loaded lazily and reloaded when the permissions version in
+    the cache has changed, which happens after migrations and every time a
+    permission is saved or deleted. Permissions which are missing from the
+    registry are looked up in the database. Unless the registry is enabled by
+    the ``CACHE_REGISTRIES`` setting, it is bypassed, and permissions are always
+    looked up in the database.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ctypes = None
+        self._version = None
+
+    def load(self):
+        """
+        Load all permissions from the database.
+        :returns: Dictionary mapping (app label, codename) to content type.
+        """
+        from django.contrib.auth.models import Permission
+
+        ctypes = {}
+        for perm in Permission.objects.select_related('content_type'):
+            key = (perm.content_type.app_label, perm.codename)
+            # Codenames shared by several models in the same app can't be resolved
+            # by app label alone, so they're left for the database to complain about.
+            ctypes[key] = None if key in ctypes else perm.content_type
+        return ctypes
+
+    def get_content_type(self, app_label, codename):
+        """
+        :returns: ``ContentType`` for the permission with ``codename`` in ``app_label``.
+        :raises ContentType.DoesNotExist: If there is no such permission.
+        :raises ContentType.MultipleObjectsReturned: If there are several permissions
+          with ``codename`` in ``app_label``.
+        """
+        from django.contrib.contenttypes.models import ContentType
+
+        if not registries_enabled():
+            return ContentType.objects.get(app_label=app_label, permission__codename=codename)
+
+        version = get_version(PERMISSIONS_VERSION_KEY)
+        ctypes = self._ctypes
+        if ctypes is None or version != self._version:
+            with self._lock:
+                if self._ctypes is None or version != self._version:
+                    self._ctypes, self._version = self.load(), version
+                ctypes = self._ctypes
+
+        ctype = ctypes.get((app_label, codename))
+        if ctype is None:
+            ctype = ContentType.objects.get(app_label=app_label, permission__codename=codename)
+            ctypes[(app_label, codename)] = ctype
+        return ctype
+
+    def invalidate(self):
+        """
+        Reload the registry on next access, in this and all other processes.
+        Other processes are notified when the current transaction commits.
+        """
+        with self._lock:
+            self._ctypes = None
+        transaction.on_commit(self._invalidate_shared)
+
+    def _invalidate_shared(self):
+        with self._lock:
+            self._ctypes = None
+        bump_version(PERMISSIONS_VERSION_KEY)
+
+
+access_rule_registry = AccessRuleRegistry()
+permission_registry = PermissionRegistry()
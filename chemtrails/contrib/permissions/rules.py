@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from neomodel import config, db
+
+from chemtrails.contrib.permissions.stats import rule_statistics
+from chemtrails.neoutils import get_node_class_for_model, get_node_for_object
+from chemtrails.neoutils.version import get_cache
+
+__all__ = [
+    'CompiledRule',
+    'compile_access_rule',
+    'evaluate_rule_exists',
+    'evaluate_rule_queries',
+    'get_compiled_rule',
+    'invalidate_compiled_rule',
+    'union_queries',
+    '__rule_cache__'
+]
+
+# In process cache of compiled access rules, keyed by (access rule pk, bind_source, bind_target).
+__rule_cache__ = {}
+
+SOURCE_ATTRIBUTE = re.compile(r'^{source}\.(\w+)$')  # Matches '{source}.attribute'
+PARAMETER = re.compile(r'\$(\w+)')  # Matches '$parameter'
+
+RULE_EVALUATION_SEQUENTIAL = 'sequential'
+RULE_EVALUATION_UNION = 'union'
+RULE_EVALUATION_PARALLEL = 'parallel'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class CompiledRule(object):
+    """
+    Parameterized Cypher template for an ``AccessRule``. The statement never
+    contains any values, so the same rule always produces an identical
+    statement. Values depending on the evaluated source or target node are
+    kept as parameter slots, which are resolved by ``get_params()``.
+    """
+    def __init__(self, pk, updated, statement, params, result_ident=None, result_label=None,
+                 source_slots=None, target_slots=None):
+        self.pk = pk
+        self.updated = updated
+        self.statement = statement
+        self.params = params
+        self.result_ident = result_ident
+        self.result_label = result_label
+        self.source_slots = source_slots or {}
+        self.target_slots = target_slots or {}
+
+    def __repr__(self):
+        return '<%(class)s: %(pk)s %(statement)s>' % {
+            'class': self.__class__.__name__,
+            'pk': self.pk,
+            'statement': self.statement
+        }
+
+    def get_path(self):
+        """
+        :returns: The compiled statement as MATCH path = (...) RETURN path.
+        :rtype: str
+        """
+        return 'MATCH path = {statement} RETURN path;'.format(statement=self.statement)
+
+    def get_query(self):
+        """
+        :returns: The compiled statement returning the distinct primary keys of the
+                  unbound end of the path, ie. the target nodes for rules bound to a
+                  source node, or the source nodes for rules bound to a target node.
+        :rtype: str
+        """
+        return 'MATCH {statement} WHERE {ident}:{label} RETURN DISTINCT {ident}.pk AS pk;'.format(
+            statement=self.statement, ident=self.result_ident, label=self.result_label)
+
+    def get_batch_query(self):
+        """
+        :returns: The compiled statement evaluated for each target primary key in the
+                  ``$pks`` parameter, returning the reachable primary keys along
+                  with the ``$rule`` parameter. Used for rules bound to a source node.
+        :rtype: str
+        """
+        return ('UNWIND $pks AS pk MATCH {statement} WHERE {ident}:{label} AND {ident}.pk = pk '
+                'RETURN DISTINCT pk, $rule AS rule;').format(statement=self.statement, ident=self.result_ident,
+                                                             label=self.result_label)
+
+    def get_exists_query(self):
+        """
+        :returns: The compiled statement returning a single row if there exists
+                  at least one path, which is used for rules bound to both a
+                  source and target node.
+        :rtype: str
+        """
+        return 'MATCH {statement} WHERE {ident}:{label} RETURN true LIMIT 1;'.format(
+            statement=self.statement, ident=self.result_ident, label=self.result_label)
+
+    def get_params(self, source=None, target=None):
+        """
+        Resolve the parameter slots for the compiled statement. The values are
+        deflated the same way as the node properties are stored in the graph.
+        :param source: Node instance which the path should originate from.
+        :param target: Node instance which the path should end at.
+        :returns: Dictionary with parameters for the statement.
+        :rtype: dict
+        """
+        params = dict(self.params)
+        for slots, node in ((self.source_slots, source), (self.target_slots, target)):
+            if not slots:
+                continue
+            properties = node.defined_properties(aliases=False, rels=False)
+            for name, attr in slots.items():
+                value = getattr(node, attr)
+                params[name] = properties[attr].deflate(value, node) if value is not None else None
+        return params
+
+
+def compile_access_rule(access_rule, bind_source=True, bind_target=False):
+    """
+    Compile ``access_rule`` into a ``CompiledRule``.
+
+    :param access_rule: ``AccessRule`` instance.
+    :param bind_source: If ``True``, the path is bound to the primary key of the
+      source node and "{source}.<attr>" filters are resolved from the source node.
+      If ``False``, "{source}.<attr>" filters are ignored.
+    :param bind_target: If ``True``, the path is bound to the primary key of the
+      target node.
+    :raises AttributeError: If the rule contains an invalid relation type or
+      references an invalid source attribute.
+    :returns: ``CompiledRule`` instance.
+    """
+    model = access_rule.ctype_source.model_class()
+    source_class = get_node_class_for_model(model)
+
+    # We need a fake source model to use as origin.
+    manager = get_node_for_object(model(), bind=False).paths
+    if access_rule.direction is not None:
+        manager.direction = access_rule.direction
+
+    source_slots, target_slots = {}, {}
+    definitions = access_rule.relation_types_obj
+    for n, rule_definition in enumerate(definitions):
+        relation_type, target_props = zip(*rule_definition.items())
+        relation_type, target_props = relation_type[0], dict(target_props[0] or {})
+
+        source_props = {}
+        if n == 0:
+            if access_rule.requires_staff:
+                source_props['is_staff'] = True
+            if bind_source:
+                source_props['pk'] = None
+                source_slots['source0_pk'] = 'pk'
+
+        for key, value in list(target_props.items()):
+            match = SOURCE_ATTRIBUTE.match(value) if isinstance(value, str) else None
+            if not match:
+                continue
+            elif not bind_source:
+                # FIXME: Workaround for https://github.com/inonit/django-chemtrails/issues/46
+                # If using "{source}.<attr>" filters, ignore them!
+                del target_props[key]
+                continue
+
+            attr = match.group(1)
+            if attr not in source_class.defined_properties(aliases=False, rels=False):
+                raise AttributeError("%(node)r has no valid property named '%(key)s'. "
+                                     "Make sure the '%(value)s' targets a valid attribute." % {
+                                         'node': source_class, 'key': attr, 'value': value
+                                     })
+            target_props[key] = None
+            source_slots['target{0}_{1}'.format(n, key)] = attr
+
+        # Make sure the last object in the query is matched to the target.
+        if bind_target and n == len(definitions) - 1:
+            target_props['pk'] = None
+            target_slots['target{0}_pk'.format(n)] = 'pk'
+
+        manager = manager.add(relation_type, source_props=source_props, target_props=target_props)
+
+    statement, params = manager.compile()
+    if not bind_source or not statement:
+        result_ident, result_model = 'source0', model
+    else:
+        # The last node in the path may be a back-reference to a previous node.
+        result_ident = 'target{0}'.format(manager._statements[-1].get('target_index', len(definitions) - 1))
+        result_model = access_rule.ctype_target.model_class()
+
+    return CompiledRule(pk=access_rule.pk, updated=access_rule.updated, statement=statement, params=params,
+                        result_ident=result_ident, result_label=get_node_class_for_model(result_model).__label__,
+                        source_slots=source_slots, target_slots=target_slots)
+
+
+def get_cache_key(pk, bind_source, bind_target):
+    return 'chemtrails:accessrule:%s:%d:%d' % (pk, bind_source, bind_target)
+
+
+def get_compiled_rule(access_rule, bind_source=True, bind_target=False):
+    """
+    Returns the ``CompiledRule`` for ``access_rule``, looking it up in the
+    process cache first, then in the Django cache. Rules which has been updated
+    since they were cached are compiled again.
+    """
+    key = (access_rule.pk, bind_source, bind_target)
+    compiled = __rule_cache__.get(key)
+    if compiled is not None and compiled.updated == access_rule.updated:
+        return compiled
+
+    cache = get_cache()
+    cache_key = get_cache_key(*key)
+    compiled = cache.get(cache_key) if cache else None
+    if compiled is None or compiled.updated != access_rule.updated:
+        compiled = compile_access_rule(access_rule, bind_source=bind_source, bind_target=bind_target)
+        if cache:
+            cache.set(cache_key, compiled)
+
+    __rule_cache__[key] = compiled
+    return compiled
+
+
+def invalidate_compiled_rule(pk):
+    """
+    Remove any compiled versions of the access rule with primary key ``pk``.
+    """
+    keys = [(pk, bind_source, bind_target) for bind_source in (True, False) for bind_target in (False, True)]
+    for key in keys:
+        __rule_cache__.pop(key, None)
+
+    cache = get_cache()
+    if cache:
+        cache.delete_many([get_cache_key(*key) for key in keys])
+
+
+def get_rule_evaluation():
+    """
+    :returns: The currently configured ``RULE_EVALUATION`` setting.
+    """
+    from chemtrails.conf import settings
+    return settings.RULE_EVALUATION
+
+
+def union_queries(queries):
+    """
+    Merge ``queries`` into a single statement, combining the results using UNION.
+    Parameters are prefixed with the query index in order to keep them apart.
+    :param queries: Sequence of (statement, params) tuples. All statements must
+      return the same columns.
+    :returns: Two tuple with the merged statement and parameters.
+    :rtype: tuple(str, dict)
+    """
+    statements, params = [], {}
+    for n, (statement, query_params) in enumerate(queries):
+        prefix = 'q{0}_'.format(n)
+        statements.append(PARAMETER.sub(lambda match: '$' + prefix + match.group(1), statement.rstrip(';')))
+        params.update({prefix + key: value for key, value in query_params.items()})
+    return '{0};'.format(' UNION '.join(statements)), params
+
+
+def get_executor():
+    """
+    :returns: Thread pool used for evaluating rule queries in parallel. The number of
+              threads is bounded by both the ``RULE_EVALUATION_WORKERS`` setting and
+              the Neo4j connection pool size.
+    """
+    from chemtrails.conf import settings
+
+    global _executor
+    max_workers = max(1, min(settings.RULE_EVALUATION_WORKERS, config.MAX_POOL_SIZE))
+    with _executor_lock:
+        if _executor is None or _executor._max_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers)
+        return _executor
+
+
+def run_query(driver, query, params):
+    """
+    Run ``query`` in a new session on ``driver``. The ``db`` object holds its
+    connection in a thread local, so worker threads use the driver of the
+    calling thread, which shares the connection pool between all threads.
+    :returns: The result rows.
+    """
+    session = driver.session()
+    try:
+        return [list(record.values()) for record in session.run(query, params)]
+    finally:
+        session.close()
+
+
+def evaluate_rule_queries(queries):
+    """
+    Execute rule ``queries`` according to the ``RULE_EVALUATION`` setting.
+    'sequential' runs one query for each rule, while 'union' merges all
+    queries into a single statement which is executed in one round trip.
+    'parallel' runs one query for each rule on a bounded thread pool. Queries
+    are always executed sequentially inside an explicit transaction.
+    :param queries: Sequence of (statement, params) tuples.
+    :returns: Iterator yielding the result rows for each executed statement.
+    """
+    mode = get_rule_evaluation()
+    if mode == RULE_EVALUATION_UNION and len(queries) > 1:
+        queries = [union_queries(queries)]
+    elif (mode == RULE_EVALUATION_PARALLEL and len(queries) > 1
+          and db.driver is not None and not db._active_transaction):
+        executor = get_executor()
+        futures = [executor.submit(run_query, db.driver, query, params) for query, params in queries]
+        for future in futures:
+            yield future.result()
+        return
+
+    for query, params in queries:
+        # FIXME: https://github.com/inonit/libcypher-parser-python/issues/1
+        # validate_cypher(query, raise_exception=True)
+        result, _ = db.cypher_query(query, params)
+        yield result
+
+
+def evaluate_rule_exists(rules):
+    """
+    Execute existence queries for ``rules`` one by one, stopping at the first
+    rule which returns a row. The evaluation time and result of each rule is
+    recorded in ``rule_statistics``.
+    :param rules: Iterable of (``CompiledRule``, params) tuples. Evaluated lazily,
+      so the remaining rules are never compiled once a match is found.
+    :returns: True if any of the rules returned a row, else False.
+    """
+    for rule, params in rules:
+        start = time.time()
+        result, _ = db.cypher_query(rule.get_exists_query(), params)
+        rule_statistics.record(rule.pk, time.time() - start, bool(result))
+        if result:
+            return True
+    return False
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from chemtrails.contrib.permissions.registry import access_rule_registry, permission_registry
+from chemtrails.contrib.permissions.rules import invalidate_compiled_rule
+from chemtrails.neoutils import bump_graph_version
+
+
+def access_rule_changed_handler(sender, instance, **kwargs):
+    """
+    Invalidate compiled versions of the access rule, the access rule registry
+    and cached permission decisions after the access rule has been saved or deleted.
+    """
+    invalidate_compiled_rule(instance.pk)
+    access_rule_registry.invalidate()
+    bump_graph_version()
+
+
+def access_rule_permissions_changed_handler(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Invalidate compiled access rules, the access rule registry and cached
+    permission decisions when the access rule permissions are changed.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+
+    if not reverse:
+        invalidate_compiled_rule(instance.pk)
+    elif action == 'pre_clear':
+        # ``pk_set`` is not provided when clearing, so look up the rules before they are removed.
+        for pk in instance.accessrule_permissions.values_list('pk', flat=True):
+            invalidate_compiled_rule(pk)
+    elif pk_set:
+        for pk in pk_set:
+            invalidate_compiled_rule(pk)
+
+    if action != 'pre_clear':
+        access_rule_registry.invalidate()
+    bump_graph_version()
+
+
+def user_permissions_changed_handler(sender, instance, action, reverse, **kwargs):
+    """
+    Remove the permission checker attached to the user object when its
+    permissions or group memberships are changed.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear') and not reverse:
+        instance.__dict__.pop('_graph_permission_checker', None)
+
+
+def permissions_changed_handler(sender, **kwargs):
+    """
+    Reset the permission registry when permissions are added, changed or
+    removed, including after migrations.
+    """
+    permission_registry.invalidate()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from operator import attrgetter
+
+__all__ = [
+    'RuleStatistics',
+    'rule_statistics'
+]
+
+
+class RuleStatistics(object):
+    """
+    In process table of access rule evaluation statistics, keyed by access
+    rule primary key. The statistics are used for ordering access rules by
+    their expected cost, so the cheapest and most frequently granting rules are
+    evaluated first.
+
+    The ranking is a snapshot which is refreshed periodically, so the order
+    of the rules is stable between refreshes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._scores = {}
+        self._refreshed = None
+
+    def record(self, pk, duration, hit):
+        """
+        Record an evaluation of the access rule with primary key ``pk``.
+        :param duration: Evaluation time in seconds.
+        :param hit: True if the access rule granted access.
+        """
+        with self._lock:
+            evaluations, hits, total_time = self._stats.get(pk, (0, 0, 0.0))
+            self._stats[pk] = (evaluations + 1, hits + int(bool(hit)), total_time + duration)
+
+    def get(self, pk):
+        """
+        :returns: Three tuple with number of evaluations, hits and total evaluation time
+                  for the access rule with primary key ``pk``.
+        :rtype: tuple(int, int, float)
+        """
+        with self._lock:
+            return self._stats.get(pk, (0, 0, 0.0))
+
+    @staticmethod
+    def get_score(evaluations, hits, total_time):
+        """
+        Calculate the expected cost of finding a match using an access rule, as
+        the average evaluation time divided by the hit rate. The hit rate is
+        smoothed, so rules with few evaluations are neither favoured nor
+        punished too hard. Rules which has never been evaluated scores 0,
+        so they are tried early.
+        """
+        if not evaluations:
+            return 0.0
+        return (total_time / evaluations) / ((hits + 1.0) / (evaluations + 2.0))
+
+    def get_scores(self):
+        """
+        :returns: Dictionary mapping access rule primary keys to their score, as of
+                  the last refresh.
+        """
+        from chemtrails.conf import settings
+
+        now = time.time()
+        with self._lock:
+            if self._refreshed is None or now - self._refreshed >= settings.RULE_STATISTICS_INTERVAL:
+                self._scores = {pk: self.get_score(*stats) for pk, stats in self._stats.items()}
+                self._refreshed = now
+            return self._scores
+
+    def get_ranking(self):
+        """
+        :returns: Dictionary mapping access rule primary keys to their rank, starting at 1.
+        """
+        scores = self.get_scores()
+        return {pk: n for n, pk in enumerate(sorted(scores, key=lambda pk: (scores[pk], pk)), start=1)}
+
+    def order(self, access_rules, key=attrgetter('pk')):
+        """
+        Sort ``access_rules`` with the lowest expected cost first.
+        :param key: Function returning the access rule primary key for each item.
+        :returns: List of access rules.
+        """
+        scores = self.get_scores()
+        return sorted(access_rules, key=lambda item: scores.get(key(item), 0.0))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._scores = {}
+            self._refreshed = None
+
+
+rule_statistics = RuleStatistics()
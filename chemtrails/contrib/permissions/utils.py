@@ -5,20 +5,20 @@ from itertools import chain
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser, Group, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q, Count
+from django.db.models import Q
 from django.shortcuts import _get_queryset
 from django.utils.encoding import force_text
 from django.utils.translation import ngettext_lazy
 
-from neo4j.v1 import Path
-from neomodel import db
-
+from chemtrails.contrib.permissions.cache import get_decision
 from chemtrails.contrib.permissions.exceptions import MixedContentTypeError
-from chemtrails.neoutils import InflateError, get_node_class_for_model, get_node_for_object
+from chemtrails.contrib.permissions.registry import access_rule_registry, permission_registry
+from chemtrails.contrib.permissions.rules import evaluate_rule_exists, evaluate_rule_queries, get_compiled_rule
+from chemtrails.contrib.permissions.stats import rule_statistics
+from chemtrails.neoutils import get_node_class_for_model, get_node_for_object
+from chemtrails.neoutils.bulk import deflate_pk
 from chemtrails.neoutils.query import validate_cypher
 from chemtrails.contrib.permissions.models import AccessRule
-from chemtrails.utils import flatten
 
 User = get_user_model()
 
@@ -45,12 +45,27 @@ def get_content_type(obj):
     return ContentType.objects.get_for_model(obj)
 
 
+def get_checker(user_or_group):
+    """
+    Returns a ``GraphPermissionChecker`` for given user/group. The checker is
+    attached to the ``user_or_group`` object and reused for as long as the object
+    lives, which for ``request.user`` is the current request. Similar to the
+    permission cache used by ``ModelBackend``, permission changes are not
+    reflected until the object is loaded again.
+    """
+    checker = getattr(user_or_group, '_graph_permission_checker', None)
+    if checker is None:
+        checker = GraphPermissionChecker(user_or_group)
+        user_or_group._graph_permission_checker = checker
+    return checker
+
+
 def get_perms(user_or_group, model):
     """
     Return permissions for given user/group and model pair, as
     a list of strings.
     """
-    checker = GraphPermissionChecker(user_or_group)
+    checker = get_checker(user_or_group)
     return checker.get_perms(model)
 
 
@@ -59,7 +74,7 @@ def get_user_perms(user, model):
     Return permissions for given user and model pair, as a 
     list of strings.
     """
-    checker = GraphPermissionChecker(user)
+    checker = get_checker(user)
     return checker.get_user_perms(model)
 
 
@@ -72,15 +87,12 @@ def get_access_rules(ctype_source, ctype_target, codenames):
     :param ctype_target: Content type target
     :param codenames: Sequence of permission codenames
 
-    :returns: Queryset containing active access rules.
+    :returns: List of active access rules having at least as many permissions as
+      there are ``codenames``, and at least one of ``codenames``.
     """
-    # To reduce search space, first retrieve all access rules with n or greater permissions count.
-    queryset = (AccessRule.objects.prefetch_related('permissions')
-                .annotate(count=Count('permissions')).filter(count__gte=len(codenames)))
-    queryset = queryset.filter(ctype_source=ctype_source,
-                               ctype_target=ctype_target, is_active=True,
-                               permissions__codename__in=codenames)
-    return queryset
+    codenames = set(codenames)
+    return [access_rule for access_rule in access_rule_registry.get_rules(ctype_source, ctype_target)
+            if len(access_rule.codenames) >= len(codenames) and access_rule.codenames & codenames]
 
 
 def check_permissions_app_label(permissions):
@@ -119,8 +131,7 @@ def check_permissions_app_label(permissions):
 
         codenames.add(codename)
         if app_label is not None:
-            _ctype = ContentType.objects.get(app_label=app_label,
-                                             permission__codename=codename)
+            _ctype = permission_registry.get_content_type(app_label, codename)
             if ctype is not None and ctype != _ctype:
                 raise MixedContentTypeError('Calculated content type from permission "%s" %s does '
                                             'not match %r.' % (perm, _ctype, ctype))
@@ -130,6 +141,32 @@ def check_permissions_app_label(permissions):
     return ctype, codenames
 
 
+def get_users_codenames(user_pks, ctype, codenames, with_group_users=True):
+    """
+    Look up which of ``codenames`` each of the users has for ``ctype``, using a
+    single query for user permissions and a single query for group permissions.
+
+    :param user_pks: Sequence of user primary keys.
+    :param ctype: ``ContentType`` instance.
+    :param codenames: Sequence of permission codenames.
+    :param with_group_users: If ``True``, include permissions derived from group memberships.
+    :returns: Dictionary mapping user primary keys to a set of codenames.
+    :rtype: dict
+    """
+    user_related_name = User.user_permissions.field.related_query_name()
+    lookups = [user_related_name]
+    if with_group_users:
+        lookups.append('%s__%s' % (Group.permissions.field.related_query_name(),
+                                   User.groups.field.related_query_name()))
+
+    users_codenames = {}
+    queryset = Permission.objects.filter(content_type=ctype, codename__in=codenames)
+    for lookup in lookups:
+        for pk, codename in queryset.filter(**{'%s__in' % lookup: user_pks}).values_list(lookup, 'codename'):
+            users_codenames.setdefault(pk, set()).add(codename)
+    return users_codenames
+
+
 def get_users_with_perms(obj, permissions, with_superusers=False, with_group_users=True):
     """
     Returns a queryset of all ``User`` objects which there can be calculated a path from
@@ -175,72 +212,26 @@ def get_users_with_perms(obj, permissions, with_superusers=False, with_group_use
             return queryset.filter(is_superuser=True)
         return queryset.none()
 
-    ctype_source = get_content_type(User)
-
-    # We need a fake source content type model to use as origin.
-    fake_model = ctype_source.model_class()()
-    source_node = get_node_for_object(fake_model, bind=False)
-
     queries = []
-    for access_rule in get_access_rules(ctype_source, ctype, codenames):
-        manager = source_node.paths
-        if access_rule.direction is not None:
-            manager.direction = access_rule.direction
+    for access_rule in get_access_rules(get_content_type(User), ctype, codenames):
+        rule = get_compiled_rule(access_rule, bind_source=False, bind_target=True)
+        if rule.statement:
+            queries.append((rule.get_query(), rule.get_params(target=target_node)))
 
-        for n, rule_definition in enumerate(access_rule.relation_types_obj):
-            relation_type, target_props = zip(*rule_definition.items())
-            relation_type, target_props = relation_type[0], target_props[0]
-
-            source_props = {}
-            target_props = target_props or {}
-
-            if n == 0 and access_rule.requires_staff:
-                source_props.update({'is_staff': True})
-
-            # Make sure the last object in the query is matched to ``obj``.
-            if n == len(access_rule.relation_types_obj) - 1:
-                target_props['pk'] = target_node.pk
-
-            # FIXME: Workaround for https://github.com/inonit/django-chemtrails/issues/46
-            # If using "{source}.<attr>" filters, ignore them!
-            target_props = {key: value for key, value in target_props.items()
-                            if isinstance(value, str) and not value.startswith('{source}.')}
-            manager = manager.add(relation_type, source_props=source_props, target_props=target_props)
-
-        if manager.statement:
-            queries.append(manager.get_path())
+    pks = set()
+    for result in evaluate_rule_queries(queries):
+        pks.update(row[0] for row in result)
 
     q_values = Q()
     if with_superusers is True:
         q_values |= Q(is_superuser=True)
 
-    start_node_class = get_node_class_for_model(queryset.model)
-    end_node_class = get_node_class_for_model(obj)
-    for query in queries:
-        # FIXME: https://github.com/inonit/libcypher-parser-python/issues/1
-        # validate_cypher(query, raise_exception=True)
-        result, _ = db.cypher_query(query)
-        if result:
-            values = set()
-            for item in flatten(result):
-                if not isinstance(item, Path):  # pragma: no cover
-                    continue
-                elif (start_node_class.__label__ not in item.start.labels
-                      or end_node_class.__label__ not in item.end.labels):
-                    continue
-                try:
-                    start, end = (start_node_class.inflate(item.start),
-                                  end_node_class.inflate(item.end))
-                    if isinstance(start, start_node_class) and end == target_node:
-                        # Make sure the user object has correct permissions
-                        instance = start.get_object()
-                        global_perms = set(get_perms(instance, obj) if with_group_users
-                                           else get_user_perms(instance, obj))
-                        if all((code in global_perms for code in codenames)):
-                            values.add(item.start.properties['pk'])
-                except (KeyError, InflateError, ObjectDoesNotExist):
-                    continue
-            q_values |= Q(pk__in=values)
+    if pks:
+        # Make sure the user objects has correct permissions. Active superusers
+        # has all permissions.
+        values = [pk for pk, user_codenames in get_users_codenames(pks, ctype, codenames, with_group_users).items()
+                  if codenames <= user_codenames]
+        q_values |= Q(pk__in=values, is_active=True) | Q(pk__in=pks, is_active=True, is_superuser=True)
 
     if not q_values:
         return queryset.none()
@@ -318,11 +309,6 @@ def get_objects_for_user(user, permissions, klass=None, use_groups=True,
     if user.is_anonymous:
         return queryset.none()
 
-    # If there is no node in the graph for the user object, return empty queryset.
-    source_node = get_node_class_for_model(user).nodes.get_or_none(**{'pk': user.pk})
-    if not source_node:
-        return queryset.none()
-
     # Next, get all permissions the user has, either directly set through user permissions
     # or if ``use_groups`` are set, derived from a group membership.
     global_perms = extra_perms | set(get_perms(user, queryset.model) if use_groups
@@ -337,53 +323,98 @@ def get_objects_for_user(user, permissions, klass=None, use_groups=True,
             if code not in global_perms:
                 codenames.remove(code)
 
-    # Calculate a PATH query for each rule
-    queries = []
-    for access_rule in get_access_rules(get_content_type(user), ctype, codenames):
-        manager = source_node.paths
-        for n, rule_definition in enumerate(access_rule.relation_types_obj):
-            relation_type, target_props = zip(*rule_definition.items())
-            relation_type, target_props = relation_type[0], target_props[0]
+    def evaluate():
+        # If there is no node in the graph for the user object, no objects can be reached.
+        source_node = get_node_class_for_model(user).nodes.get_or_none(**{'pk': user.pk})
+        if not source_node:
+            return set()
 
-            source_props = {}
-            if n == 0 and access_rule.requires_staff:
-                source_props.update({'is_staff': True})
-            manager = manager.add(relation_type, source_props=source_props, target_props=target_props)
+        # Calculate a query for each rule
+        queries = []
+        for access_rule in get_access_rules(get_content_type(user), ctype, codenames):
+            rule = get_compiled_rule(access_rule)
+            if rule.statement:
+                queries.append((rule.get_query(), rule.get_params(source=source_node)))
 
-        if manager.statement:
-            queries.append(manager.get_path())
+        pks = set()
+        for result in evaluate_rule_queries(queries):
+            pks.update(row[0] for row in result)
+        return pks
 
-    q_values = Q()
-    start_node_class = get_node_class_for_model(user)
-    end_node_class = get_node_class_for_model(queryset.model)
-    for query in queries:
-        # FIXME: https://github.com/inonit/libcypher-parser-python/issues/1
-        # validate_cypher(query, raise_exception=True)
-        result, _ = db.cypher_query(query)
-        if result:
-            values = set()
-            for item in flatten(result):
-                if not isinstance(item, Path):  # pragma: no cover
-                    continue
-                elif (start_node_class.__label__ not in item.start.labels
-                      or end_node_class.__label__ not in item.end.labels):
-                    continue
-                try:
-                    start, end = (start_node_class(user).inflate(item.start),
-                                  end_node_class.inflate(item.end))
-                    if start == source_node and isinstance(end, end_node_class):
-                        values.add(item.end.properties['pk'])
-                except (KeyError, InflateError):  # pragma: no cover
-                    continue
-            q_values |= Q(pk__in=values)
-
-    # If no values in the Q filter, it means we couldn't get a path from the
+    pks = get_decision(('objects', user.pk, ','.join(sorted(codenames)), ctype.pk), evaluate)
+
+    # If no primary keys was returned, it means we couldn't get a path from the
     # user node to given object in queryset by any evaluated rule.
     # Return an empty queryset.
-    if not q_values:
+    if not pks:
         return queryset.none()
 
-    return queryset.filter(q_values)
+    return queryset.filter(pk__in=pks)
+
+
+def has_access_rule_path(user, perm, obj):
+    """
+    Checks if there can be calculated a path between ``user`` and ``obj`` using
+    any active access rule with ``perm``. Both ends of the path are bound, so
+    each rule is evaluated as a short existence query, stopping at the first
+    rule which matches. Access rules are evaluated in order of their observed
+    cost and hit rate.
+
+    :param user: ``User`` instance.
+    :param perm: Permission string, either "app_label.codename" or codename.
+    :param obj: Model instance.
+    :returns: True if a path exists, else False.
+    """
+    codename, ctype = perm.split('.')[-1], get_content_type(obj)
+
+    def evaluate():
+        source_node = get_node_for_object(user, bind=False)
+        target_node = get_node_for_object(obj, bind=False)
+
+        access_rules = rule_statistics.order(get_access_rules(get_content_type(user), ctype, {codename}))
+        rules = (get_compiled_rule(access_rule, bind_target=True) for access_rule in access_rules)
+        return evaluate_rule_exists((rule, rule.get_params(source=source_node, target=target_node))
+                                    for rule in rules if rule.statement)
+
+    return get_decision(('object', user.pk, codename, ctype.pk, obj.pk), evaluate)
+
+
+def get_authorized_pks(user, codenames, objects):
+    """
+    Batched version of ``has_access_rule_path``, which evaluates all access rules
+    for ``codenames`` against all ``objects`` at once.
+
+    :param user: ``User`` instance.
+    :param codenames: Sequence of permission codenames.
+    :param objects: Sequence of model instances, all of the same type.
+    :returns: Dictionary mapping each codename to a set of deflated primary keys
+      for the objects which ``user`` can reach using an access rule with that permission.
+    :rtype: dict
+    """
+    authorized = {codename: set() for codename in codenames}
+    if not objects or not codenames:
+        return authorized
+
+    model = objects[0]._meta.model
+    klass = get_node_class_for_model(model)
+    pks = [deflate_pk(klass, obj.pk) for obj in objects]
+    source_node = get_node_for_object(user, bind=False)
+
+    queries, rule_codenames = [], {}
+    for access_rule in access_rule_registry.get_rules(get_content_type(user), get_content_type(model)):
+        if not access_rule.codenames & set(codenames):
+            continue
+        rule = get_compiled_rule(access_rule)
+        if rule.statement:
+            queries.append((rule.get_batch_query(), dict(rule.get_params(source=source_node),
+                                                         pks=pks, rule=access_rule.pk)))
+            rule_codenames[access_rule.pk] = access_rule.codenames
+
+    for result in evaluate_rule_queries(queries):
+        for pk, rule in result:
+            for codename in rule_codenames[rule] & set(codenames):
+                authorized[codename].add(pk)
+    return authorized
 
 
 def get_objects_for_group(group, perms, klass=None, any_perm=False, accept_global_perms=True):
@@ -399,6 +430,7 @@ class GraphPermissionChecker(object):
     """
     def __init__(self, user_or_group=None):
         self._obj_perms_cache = {}
+        self._obj_authorized_cache = {}
         self.user, self.group = get_identity(user_or_group)
 
     def has_perm(self, perm, obj):
@@ -419,14 +451,20 @@ class GraphPermissionChecker(object):
         """
         Checks if user/group is authorized to access given object.
         """
-        target_node = get_node_class_for_model(obj).nodes.get_or_none(**{'pk': obj.pk})
-        if not target_node:
-            return False
-
         if self.user:
-            queryset = get_objects_for_user(self.user, perm, klass=obj._meta.default_manager.filter(pk=obj.pk))
-            return obj in queryset
+            if self.user.is_superuser:
+                return True
+            perm = perm.split('.')[-1]
+            cache_key = self.get_local_cache_key(obj) + (perm,)
+            if cache_key not in self._obj_authorized_cache:
+                self._obj_authorized_cache[cache_key] = (perm in self.get_perms(obj) and
+                                                         has_access_rule_path(self.user, perm, obj))
+            return self._obj_authorized_cache[cache_key]
         elif self.group:
+            target_node = get_node_class_for_model(obj).nodes.get_or_none(**{'pk': obj.pk})
+            if not target_node:
+                return False
+
             # TODO: Implement `get_objects_for_group`!
             queryset = get_objects_for_group(self.group, perm, klass=obj._meta.default_manager.filter(pk=obj.pk))
             return obj in queryset
@@ -444,6 +482,32 @@ class GraphPermissionChecker(object):
         ctype = get_content_type(obj)
         return AccessRule.objects.filter(is_active=True, ctype_target=ctype)
 
+    def prefetch_perms(self, objects):
+        """
+        Prefetch permissions for ``objects``, evaluating all access rules for
+        all objects in a single batch, so later calls to ``has_perm`` or
+        ``get_perms`` for any of the objects costs nothing.
+
+        :param objects: Sequence or queryset of model instances, all of the same type.
+        :returns: True
+        """
+        objects = list(objects)
+        if not objects or (self.user and not self.user.is_active):
+            return True
+
+        perms = self.get_perms(objects[0])
+        for obj in objects:
+            self._obj_perms_cache[self.get_local_cache_key(obj)] = perms
+
+        if self.user and not self.user.is_superuser:
+            authorized = get_authorized_pks(self.user, perms, objects)
+            klass = get_node_class_for_model(objects[0])
+            for obj in objects:
+                pk = deflate_pk(klass, obj.pk)
+                for perm in perms:
+                    self._obj_authorized_cache[self.get_local_cache_key(obj) + (perm,)] = pk in authorized[perm]
+        return True
+
     def get_user_filters(self):
         related_name = User.user_permissions.field.related_query_name()
         user_filters = {'%s' % related_name: self.user}
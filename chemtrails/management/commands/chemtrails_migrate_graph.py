@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from neomodel import db
+
+from chemtrails.neoutils import get_meta_node_class_for_model, get_node_class_for_model
+
+
+def get_defined_properties(klass):
+    return set(klass.defined_properties(aliases=False, rels=False).keys())
+
+
+def get_defined_types(klass):
+    return set(relation.definition['relation_type'] for relation in
+               klass.defined_properties(aliases=False, properties=False).values())
+
+
+def check_renames(renames, defined, option):
+    """
+    :raises CommandError: If any rename target in ``renames`` is not in ``defined``,
+      as the stale data would otherwise be removed instead of renamed.
+    """
+    for old, new in renames.items():
+        if new not in defined:
+            raise CommandError('Invalid value "%s=%s" for %s, "%s" is not defined by any node class.'
+                               % (old, new, option, new))
+
+
+def parse_renames(values, option):
+    renames = OrderedDict()
+    for value in values or []:
+        old, sep, new = value.partition('=')
+        if not (old and sep and new):
+            raise CommandError('Invalid value "%s" for %s, expected OLD=NEW.' % (value, option))
+        renames[old] = new
+    return renames
+
+
+class Command(BaseCommand):
+    help = ('Compares the node class definitions with the graph, and removes or renames '
+            'properties and relationship types which are no longer defined.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', '-b',
+            dest='batch_size',
+            default=1000,
+            type=int,
+            help='Maximum number of nodes or relationships to update in each transaction.'
+        )
+        parser.add_argument(
+            '--rename-property',
+            dest='rename_properties',
+            action='append',
+            metavar='OLD=NEW',
+            help='Rename a stale property to a defined property instead of removing it. Properties are '
+                 'left untouched on labels which does not define the new property.'
+        )
+        parser.add_argument(
+            '--rename-relationship',
+            dest='rename_relationships',
+            action='append',
+            metavar='OLD=NEW',
+            help='Rename a stale relationship type to a defined type instead of removing it. Relationships '
+                 'are left untouched on labels which does not define the new type.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            dest='dry_run',
+            action='store_true',
+            default=False,
+            help='Only report the changes which would be made.'
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        if self.batch_size < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+
+        property_renames = parse_renames(options['rename_properties'], '--rename-property')
+        relationship_renames = parse_renames(options['rename_relationships'], '--rename-relationship')
+
+        node_classes = self.get_node_classes()
+        check_renames(property_renames, set().union(*map(get_defined_properties, node_classes.values())),
+                      '--rename-property')
+        check_renames(relationship_renames, set().union(*map(get_defined_types, node_classes.values())),
+                      '--rename-relationship')
+
+        labels = set(self.call_procedure('db.labels()'))
+        relationship_types = set(self.call_procedure('db.relationshipTypes()'))
+
+        for label in sorted(labels - set(node_classes.keys())):
+            if self.verbosity > 1:
+                self.stdout.write('Label %s is not defined by any node class, skipping.' % label)
+
+        self.stats = {'properties': 0, 'relationships': 0, 'nodes': 0}
+        for label, klass in node_classes.items():
+            if label not in labels:
+                continue
+            self.migrate_label(klass, relationship_types, property_renames, relationship_renames)
+
+        self.stdout.write(self.style.SUCCESS(
+            '{action} {properties} properties and {relationships} relationships, '
+            'stamped {nodes} nodes with the current schema.'.format(
+                action='Would update' if self.dry_run else 'Updated', **self.stats)))
+
+    @staticmethod
+    def call_procedure(procedure):
+        results, _ = db.cypher_query('CALL %s' % procedure)
+        return [row[0] for row in results]
+
+    @staticmethod
+    def get_node_classes():
+        """
+        :returns: An ordered dictionary mapping labels to node classes for all installed models.
+        """
+        node_classes = OrderedDict()
+        for model in apps.get_models(include_auto_created=True):
+            for klass in (get_node_class_for_model(model), get_meta_node_class_for_model(model)):
+                if not klass._is_ignored:
+                    node_classes.setdefault(klass.__label__, klass)
+        return node_classes
+
+    def run_batched(self, query, params=None):
+        """
+        Run ``query`` repeatedly until it reports that no more items was affected.
+        The query must limit itself to ``$limit`` items and return the number of
+        affected items, so each batch is committed in a separate transaction.
+        :returns: Total number of affected items.
+        """
+        params = dict(params or {}, limit=self.batch_size)
+        total = 0
+        while True:
+            results, _ = db.cypher_query(query, params)
+            count = results[0][0] if results else 0
+            total += count
+            if count < self.batch_size:
+                return total
+
+    def count(self, query, params=None):
+        results, _ = db.cypher_query(query, params or {})
+        return results[0][0] if results else 0
+
+    def log(self, message):
+        if self.verbosity > 0:
+            self.stdout.write(message)
+
+    def migrate_label(self, klass, relationship_types, property_renames, relationship_renames):
+        label = klass.__label__
+        defined_properties = get_defined_properties(klass)
+        defined_types = get_defined_types(klass)
+
+        results, _ = db.cypher_query('MATCH (n:{label}) UNWIND keys(n) AS key '
+                                     'RETURN DISTINCT key'.format(label=label))
+        stale_properties = set(row[0] for row in results) - defined_properties
+
+        stale_types = set()
+        if relationship_types - defined_types:
+            results, _ = db.cypher_query('MATCH (n:{label})-[r]->() '
+                                         'RETURN DISTINCT type(r)'.format(label=label))
+            stale_types = set(row[0] for row in results) - defined_types
+
+        # Nodes which still has stale properties or relationships must not be stamped,
+        # or they will never be cleaned by ``__update_raw_node__``.
+        untouched = False
+        for prop in sorted(stale_properties):
+            new = property_renames.get(prop)
+            if new is not None and new not in defined_properties:
+                self.log('Property %s is not defined for %s, leaving %s.%s untouched.' % (new, label, label, prop))
+                untouched = True
+                continue
+            elif new is not None:
+                query = ('MATCH (n:{label}) WHERE n.`{old}` IS NOT NULL WITH n LIMIT $limit '
+                         'SET n.`{new}` = coalesce(n.`{new}`, n.`{old}`) REMOVE n.`{old}` '
+                         'RETURN count(n)').format(label=label, old=prop, new=new)
+                action = 'Renamed property %s.%s to %s' % (label, prop, new)
+            else:
+                query = ('MATCH (n:{label}) WHERE n.`{old}` IS NOT NULL WITH n LIMIT $limit '
+                         'REMOVE n.`{old}` RETURN count(n)').format(label=label, old=prop)
+                action = 'Removed property %s.%s' % (label, prop)
+
+            if self.dry_run:
+                count = self.count('MATCH (n:{label}) WHERE n.`{prop}` IS NOT NULL '
+                                   'RETURN count(n)'.format(label=label, prop=prop))
+            else:
+                count = self.run_batched(query)
+            self.stats['properties'] += count
+            self.log('%s on %d node(s).' % (action, count))
+
+        for relation_type in sorted(stale_types):
+            new = relationship_renames.get(relation_type)
+            if new is not None and new not in defined_types:
+                self.log('Relationship type %s is not defined for %s, leaving %s-[%s]-> untouched.'
+                         % (new, label, label, relation_type))
+                untouched = True
+                continue
+            elif new is not None:
+                # Relationships sharing a type are told apart by the field they belong to.
+                query = ('MATCH (n:{label})-[r:`{old}`]->(m) WITH n, r, m LIMIT $limit '
+                         'MERGE (n)-[r2:`{new}` {{remote_field: coalesce(r.remote_field, \'\')}}]->(m) '
+                         'SET r2 = r DELETE r RETURN count(r2)').format(label=label, old=relation_type, new=new)
+                action = 'Renamed relationship %s-[%s]-> to %s' % (label, relation_type, new)
+            else:
+                query = ('MATCH (n:{label})-[r:`{old}`]->() WITH r LIMIT $limit '
+                         'DELETE r RETURN count(*)').format(label=label, old=relation_type)
+                action = 'Removed relationship %s-[%s]->' % (label, relation_type)
+
+            if self.dry_run:
+                count = self.count('MATCH (n:{label})-[r:`{type}`]->() '
+                                   'RETURN count(r)'.format(label=label, type=relation_type))
+            else:
+                count = self.run_batched(query)
+            self.stats['relationships'] += count
+            self.log('%s on %d relationship(s).' % (action, count))
+
+        if untouched:
+            self.log('Not stamping %s nodes with the current schema, since stale data was left untouched.' % label)
+            return
+
+        # Stamp the nodes with the current schema, so they are skipped by ``__update_raw_node__``.
+        params = {'fingerprint': klass.__schema_fingerprint__}
+        if self.dry_run:
+            count = self.count('MATCH (n:{label}) WHERE coalesce(n._schema_fingerprint, \'\') <> $fingerprint '
+                               'RETURN count(n)'.format(label=label), params)
+        else:
+            count = self.run_batched('MATCH (n:{label}) WHERE coalesce(n._schema_fingerprint, \'\') <> $fingerprint '
+                                     'WITH n LIMIT $limit SET n._schema_fingerprint = $fingerprint '
+                                     'RETURN count(n)'.format(label=label), params)
+        self.stats['nodes'] += count
+        if count and self.verbosity > 1:
+            self.stdout.write('Stamped %d %s node(s) with the current schema.' % (count, label))
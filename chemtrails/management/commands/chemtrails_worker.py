@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from chemtrails.models import OutboxEntry
+from chemtrails.signals.queue import sync_objects
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Drains the graph synchronization outbox. Several workers may run in '
+            'parallel, rows are locked using SELECT ... FOR UPDATE SKIP LOCKED.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', '-b',
+            dest='batch_size',
+            default=100,
+            type=int,
+            help='Maximum number of outbox entries to process in each transaction.'
+        )
+        parser.add_argument(
+            '--max-attempts',
+            dest='max_attempts',
+            default=10,
+            type=int,
+            help='Give up on entries which has failed this many times.'
+        )
+        parser.add_argument(
+            '--interval',
+            dest='interval',
+            default=1.0,
+            type=float,
+            help='Seconds to sleep when the outbox is empty.'
+        )
+        parser.add_argument(
+            '--once',
+            dest='once',
+            action='store_true',
+            default=False,
+            help='Exit when the outbox is empty instead of waiting for more entries.'
+        )
+        parser.add_argument(
+            '--database',
+            dest='database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database alias holding the outbox table.'
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        if not getattr(connections[using].features, 'has_select_for_update_skip_locked', False):
+            raise CommandError('Database "%s" does not support SELECT ... FOR UPDATE SKIP LOCKED.' % using)
+
+        self.verbosity = options['verbosity']
+        self.stats = {'processed': 0, 'failed': 0}
+        try:
+            while True:
+                count = self.process_batch(using, options['batch_size'], options['max_attempts'])
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('{processed} outbox entries processed, {failed} failed.'
+                                             .format(**self.stats)))
+
+    def process_batch(self, using, batch_size, max_attempts):
+        """
+        Lock and process a single batch of outbox entries.
+        :returns: Number of entries picked from the outbox.
+        """
+        with transaction.atomic(using=using):
+            now = timezone.now()
+            entries = list(OutboxEntry.objects.using(using)
+                           .select_for_update(skip_locked=True)
+                           .select_related('content_type')
+                           .filter(available__lte=now, attempts__lt=max_attempts)
+                           .order_by('pk')[:batch_size])
+            if not entries:
+                return 0
+
+            # Collapse entries for the same object into a single sync.
+            grouped = OrderedDict()
+            for entry in entries:
+                grouped.setdefault((entry.content_type, entry.object_pk), []).append(entry)
+
+            done, failed = [], []
+            for (content_type, object_pk), items in grouped.items():
+                try:
+                    # A savepoint per object keeps the batch transaction usable
+                    # for the bookkeeping below if the sync fails with a database error.
+                    with transaction.atomic(using=using):
+                        sync_objects(content_type.model_class(), [object_pk], using=using)
+                    done.extend(items)
+                except Exception as e:
+                    logger.exception('Failed to synchronize %(ctype)s object %(pk)s.' % {
+                        'ctype': content_type, 'pk': object_pk
+                    })
+                    for entry in items:
+                        entry.attempts += 1
+                        entry.last_error = str(e)
+                        # Exponential backoff, capped at five minutes.
+                        entry.available = now + timedelta(seconds=min(2 ** entry.attempts, 300))
+                        entry.save(update_fields=('attempts', 'last_error', 'available'))
+                    failed.extend(items)
+
+            OutboxEntry.objects.using(using).filter(pk__in=[entry.pk for entry in done]).delete()
+
+        self.record_metrics(done, failed)
+        return len(entries)
+
+    def record_metrics(self, done, failed):
+        self.stats['processed'] += len(done)
+        self.stats['failed'] += len(failed)
+        if not done:
+            return
+
+        now = timezone.now()
+        lag = [(now - entry.created).total_seconds() for entry in done]
+        message = ('Processed %(count)d outbox entries (%(failed)d failed), '
+                   'lag avg %(avg).3fs max %(max).3fs.' % {
+                       'count': len(done),
+                       'failed': len(failed),
+                       'avg': sum(lag) / len(lag),
+                       'max': max(lag)
+                   })
+        logger.info(message)
+        if self.verbosity > 1:
+            self.stdout.write(message)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chemtrails.management.commands.neo_import import get_models, get_queryset
+from chemtrails.neoutils.export import AdminImportWriter, export_nodes, export_relationships
+from chemtrails.utils import get_model_string
+
+FORMAT_ADMIN_IMPORT = 'admin-import'
+
+
+class Command(BaseCommand):
+    help = ('Exports the current database to files which can be loaded into an empty Neo4j '
+            'database using "neo4j-admin import".')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'directory',
+            help='Directory to write the files to. Must be empty or not exist.'
+        )
+        parser.add_argument(
+            'labels',
+            metavar='app_label[.ModelName]',
+            nargs='*',
+            help='Restrict the export to the specified app_label or app_label.ModelName.'
+        )
+        parser.add_argument(
+            '--format',
+            dest='format',
+            default=FORMAT_ADMIN_IMPORT,
+            choices=[FORMAT_ADMIN_IMPORT],
+            help='Output format. "admin-import" writes header and data CSV files for "neo4j-admin import".'
+        )
+        parser.add_argument(
+            '--compress',
+            dest='compress',
+            action='store_true',
+            default=False,
+            help='Compress the data files using gzip.'
+        )
+        parser.add_argument(
+            '--batch-size', '-b',
+            dest='batch_size',
+            default=None,
+            type=int,
+            help='Number of rows to read at a time. Defaults to the SYNC_CHUNK_SIZE setting.'
+        )
+        parser.add_argument(
+            '--database',
+            dest='database',
+            default='default',
+            help='Nominates a specific database to export from. Defaults to the "default" database.'
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.database = options['database']
+        if self.batch_size is not None and self.batch_size < 1:
+            raise CommandError('--batch-size must be a positive integer.')
+
+        directory = options['directory']
+        if os.path.exists(directory) and (not os.path.isdir(directory) or os.listdir(directory)):
+            raise CommandError('"%s" must be an empty directory.' % directory)
+        os.makedirs(directory, exist_ok=True)
+
+        models = get_models(options['labels'])
+        start = time.time()
+        with AdminImportWriter(directory, compress=options['compress']) as writer:
+            nodes = self.export(models, 'nodes', lambda queryset: export_nodes(
+                writer, queryset, chunk_size=self.batch_size))
+            relationships = self.export(models, 'relationships', lambda queryset: export_relationships(
+                writer, queryset, chunk_size=self.batch_size, exported_models=models))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Exported {nodes} nodes and {relationships} relationships for {models} models '
+            'in {elapsed:.1f}s.'.format(nodes=nodes, relationships=relationships, models=len(models),
+                                        elapsed=time.time() - start)))
+        if self.verbosity > 0:
+            self.stdout.write('Load the files into an empty database using:\n'
+                              'neo4j-admin import --multiline-fields=true --array-delimiter=";" '
+                              + ' '.join(writer.get_import_arguments()))
+
+    def export(self, models, name, exporter):
+        """
+        Run ``exporter`` for each model, reporting progress.
+        :param exporter: Function taking a queryset, returning a generator which
+                         yields the number of written items for each batch.
+        :returns: Total number of written items.
+        """
+        total = 0
+        for model in models:
+            label, count = get_model_string(model), 0
+            for written, _ in exporter(get_queryset(model, self.database)):
+                count += written
+                if self.verbosity > 1:
+                    self.stdout.write('{label}: {count} {name}'.format(
+                        label=label, count=count, name=name), ending='\r')
+                    self.stdout.flush()
+            if self.verbosity > 0 and count:
+                self.stdout.write('{label}: {count} {name}'.format(label=label, count=count, name=name))
+            total += count
+        return total
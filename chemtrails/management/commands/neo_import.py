@@ -1,90 +1,443 @@
-from django.core.management.base import BaseCommand, CommandError
-from chemtrails.neoutils import get_node_class_for_model
+# -*- coding: utf-8 -*-
+
+import datetime
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
 from django.apps import apps
-from chemtrails.conf import settings
-import csv
-import tempfile
-from neomodel import db, exception
+from django.conf import settings as django_settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, models as django_models
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from neo4j.v1 import TransientError
+from neomodel import config, db
+
+from chemtrails.models import ImportCheckpoint, ImportWatermark
+from chemtrails.neoutils import bulk_sync, bump_graph_version, get_node_class_for_model
+from chemtrails.neoutils.bulk import delete_stale_nodes, import_nodes, import_relationships
+from chemtrails.utils import chunked, get_model_string, is_internal_model
+
+PHASE_NODES = ImportCheckpoint.PHASE_NODES
+PHASE_RELATIONSHIPS = ImportCheckpoint.PHASE_RELATIONSHIPS
+
+# Number of times a batch is retried after a transient error, such as a deadlock
+# between worker processes connecting relationships to the same nodes.
+IMPORT_RETRIES = 5
+# Seconds to wait before the first retry, which is doubled for each retry.
+IMPORT_RETRY_DELAY = 0.5
+
+# Process id of the worker process which has been set up by ``setup_worker()``.
+_worker_pid = None
+
+
+def get_models(labels):
+    """
+    :param labels: List of "app_label" or "app_label.ModelName" strings. If empty,
+                   all installed models are returned.
+    :returns: List of models which are not ignored by chemtrails. The internal
+              chemtrails models are never included.
+    """
+    models = []
+    try:
+        for label in labels or [app_config.label for app_config in apps.get_app_configs()]:
+            if '.' in label:
+                models.append(apps.get_model(label))
+            else:
+                models.extend(apps.get_app_config(label).get_models())
+    except (LookupError, ValueError) as e:
+        raise CommandError(str(e))
+
+    return [model for model in sorted(set(models), key=get_model_string)
+            if not is_internal_model(model) and not get_node_class_for_model(model)._is_ignored]
+
+
+def parse_timestamp(value):
+    """
+    Parse ``value`` as an ISO 8601 date or datetime. Naive values are
+    interpreted in the current time zone.
+    :raises CommandError: If ``value`` is not a valid timestamp.
+    """
+    try:
+        timestamp = parse_datetime(value)
+        if timestamp is None:
+            date = parse_date(value)
+            timestamp = date and datetime.datetime.combine(date, datetime.time())
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise CommandError('Invalid timestamp "%s", expected an ISO 8601 date or datetime.' % value)
+
+    if django_settings.USE_TZ and timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def get_modification_field(model):
+    """
+    :returns: The first ``auto_now`` date or datetime field on ``model``, or None.
+    """
+    for field in model._meta.concrete_fields:
+        if isinstance(field, django_models.DateField) and field.auto_now:
+            return field
+    return None
+
+
+def get_changed_queryset(queryset, field, since):
+    """
+    :returns: ``queryset`` filtered to objects where the date or datetime ``field``
+              has been modified at or after ``since``.
+    """
+    if not isinstance(field, django_models.DateTimeField):
+        since = (timezone.localtime(since) if timezone.is_aware(since) else since).date()
+    return queryset.filter(**{'%s__gte' % field.name: since})
+
+
+def get_partitions(queryset, size):
+    """
+    Split ``queryset`` into primary key ranges holding at most ``size`` objects each.
+    :returns: List of (start, end) tuples, where ``start`` is inclusive and ``end``
+              is exclusive. None means the range is unbounded in that direction.
+    """
+    pks = queryset.order_by('pk').values_list('pk', flat=True).iterator()
+    starts = [chunk[0] for chunk in chunked(pks, size)][1:]
+    return list(zip([None] + starts, starts + [None]))
+
+
+def get_queryset(model, database, start=None, end=None):
+    """
+    :returns: Queryset for objects of ``model`` with primary keys in the range [start, end).
+    """
+    queryset = model._base_manager.using(database).all()
+    if start is not None:
+        queryset = queryset.filter(pk__gte=start)
+    if end is not None:
+        queryset = queryset.filter(pk__lt=end)
+    return queryset
+
+
+def get_importer(phase, queryset, batch_size, imported_models):
+    """
+    :returns: A generator writing ``queryset`` to the graph for ``phase``, which
+              yields the number of written items and the last primary key for each batch.
+    """
+    if phase == PHASE_NODES:
+        return import_nodes(queryset, chunk_size=batch_size)
+    return import_relationships(queryset, chunk_size=batch_size, imported_models=imported_models)
+
+
+def get_checkpoints(model, phase, database, partition_size=None):
+    """
+    Returns the unfinished checkpoints for ``model`` and ``phase``. If there are
+    no checkpoints, ``model`` is split into partitions holding at most
+    ``partition_size`` objects, and a checkpoint is created for each of them.
+    :param partition_size: Maximum number of objects in each partition. If None,
+                           a single partition is used.
+    :returns: List of ``ImportCheckpoint`` instances.
+    """
+    ctype = ContentType.objects.get_for_model(model)
+    checkpoints = ImportCheckpoint.objects.filter(content_type=ctype, phase=phase)
+    if not checkpoints.exists():
+        partitions = (get_partitions(get_queryset(model, database), partition_size)
+                      if partition_size else [(None, None)])
+        # Checkpoints are never saved one by one, which would sync them to the graph.
+        ImportCheckpoint.objects.bulk_create([
+            ImportCheckpoint(content_type=ctype, phase=phase,
+                             partition_start=None if start is None else str(start),
+                             partition_end=None if end is None else str(end))
+            for start, end in partitions
+        ])
+    return list(checkpoints.filter(completed=False).select_related('content_type'))
+
+
+def import_checkpoint(checkpoint, database, batch_size, imported_models):
+    """
+    Import the primary key range for ``checkpoint``, continuing after the last
+    imported primary key. The checkpoint is updated after every written batch.
+    Writes are idempotent, so replaying a partially written batch is safe, and
+    batches failing with a transient error are retried with an increasing delay.
+    :returns: A generator yielding the number of written items for each batch.
+    :raises TransientError: If a batch still fails after ``IMPORT_RETRIES`` retries.
+      The checkpoint is left unfinished, so the import can be resumed.
+    """
+    model = checkpoint.content_type.model_class()
+    to_python = model._meta.pk.to_python
+
+    start, end = checkpoint.partition_start, checkpoint.partition_end
+    checkpoints = ImportCheckpoint.objects.filter(pk=checkpoint.pk)
+    last_pk, retries = checkpoint.last_pk, 0
+    while True:
+        queryset = get_queryset(model, database, None if start is None else to_python(start),
+                                None if end is None else to_python(end))
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=to_python(last_pk))
+
+        try:
+            for count, pk in get_importer(checkpoint.phase, queryset, batch_size, imported_models):
+                last_pk, retries = str(pk), 0
+                checkpoints.update(last_pk=last_pk)
+                yield count
+        except TransientError:
+            if retries >= IMPORT_RETRIES:
+                raise
+            retries += 1
+            # Randomize the delay, so deadlocked workers does not retry in lockstep.
+            time.sleep(IMPORT_RETRY_DELAY * 2 ** (retries - 1) * (1 + random.random()))
+            continue
+        break
+    checkpoints.update(completed=True)
+
+
+def setup_worker():
+    """
+    Prepare a worker process for importing. Worker processes inherit the
+    connections of the parent process when forked, so each worker sets up
+    its own Neo4j driver, and Django opens its own database connections.
+    """
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+
+    if not apps.ready:
+        django.setup()
+    db.set_connection(config.DATABASE_URL)
+    _worker_pid = os.getpid()
+
+
+def import_partition(checkpoint_pk, database, batch_size, imported_labels):
+    """
+    Import the partition for a checkpoint in a worker process.
+    :returns: Number of written items.
+    """
+    setup_worker()
+    checkpoint = ImportCheckpoint.objects.select_related('content_type').get(pk=checkpoint_pk)
+    imported_models = [apps.get_model(imported) for imported in imported_labels]
+    return sum(import_checkpoint(checkpoint, database, batch_size, imported_models))
 
 
 class Command(BaseCommand):
-    help = 'imports current database to neo4j'
+    help = ('Imports the current database into Neo4j. Nodes are written for all models '
+            'first, then all relationships are connected.')
 
     def add_arguments(self, parser):
-        pass
+        parser.add_argument(
+            'labels',
+            metavar='app_label[.ModelName]',
+            nargs='*',
+            help='Restrict the import to the specified app_label or app_label.ModelName.'
+        )
+        parser.add_argument(
+            '--batch-size', '-b',
+            dest='batch_size',
+            default=None,
+            type=int,
+            help='Number of rows to write in each statement. Defaults to the SYNC_CHUNK_SIZE setting.'
+        )
+        parser.add_argument(
+            '--database',
+            dest='database',
+            default='default',
+            help='Nominates a specific database to import from. Defaults to the "default" database.'
+        )
+        parser.add_argument(
+            '--workers', '-w',
+            dest='workers',
+            default=1,
+            type=int,
+            help='Number of worker processes to import with. Defaults to 1, which imports in this process.'
+        )
+        parser.add_argument(
+            '--partition-size',
+            dest='partition_size',
+            default=100000,
+            type=int,
+            help='Maximum number of rows in each partition handed to a worker process.'
+        )
+        parser.add_argument(
+            '--resume',
+            dest='resume',
+            action='store_true',
+            default=False,
+            help='Continue an interrupted import from the last checkpoint instead of starting over.'
+        )
+        parser.add_argument(
+            '--incremental',
+            dest='incremental',
+            action='store_true',
+            default=False,
+            help='Only import objects which has been modified since the last incremental import, '
+                 'and delete nodes for objects which no longer exists. Models without an auto_now '
+                 'field are always imported in full.'
+        )
+        parser.add_argument(
+            '--since',
+            dest='since',
+            default=None,
+            metavar='TIMESTAMP',
+            help='Incremental import of objects which has been modified since the ISO 8601 date or '
+                 'datetime TIMESTAMP, instead of since the last incremental import.'
+        )
+        parser.add_argument(
+            '--skip-relationships',
+            dest='skip_relationships',
+            action='store_true',
+            default=False,
+            help='Only write nodes, without connecting any relationships.'
+        )
 
     def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.batch_size = options['batch_size']
+        self.database = options['database']
+        self.workers = options['workers']
+        self.partition_size = options['partition_size']
+        for option in ('batch_size', 'workers', 'partition_size'):
+            if options[option] is not None and options[option] < 1:
+                raise CommandError('--%s must be a positive integer.' % option.replace('_', '-'))
 
-        target_file = tempfile.NamedTemporaryFile(delete=True)
-        BUFFER_COUNT = 100
+        models = get_models(options['labels'])
+        if options['incremental'] or options['since']:
+            if options['resume'] or self.workers > 1:
+                raise CommandError('--resume and --workers can not be combined with an incremental import.')
+            since = parse_timestamp(options['since']) if options['since'] else None
+            self.run_incremental(models, since, options['skip_relationships'])
+            bump_graph_version()
+            return
 
-        try:
-            for app in apps.all_models:
-                self.stdout.write(self.style.SUCCESS('Looking at {}'.format(app)))
-                model_count = 0
-                cntr = 0
-
-                for n, model in enumerate(apps.get_app_config(app_label=app).get_models()):
-                    model_count += 1
-                    cls = get_node_class_for_model(model)
-                    if cls._is_ignored:
-                        continue
-
-                    for item in model.objects.all():
-                        node = cls(instance=item, bind=False)
-                        node.to_csv(cntr=cntr, target_file=target_file)
-                        cntr += 1
-
-            with open(target_file.name, newline='') as csvfile:
-                spamreader = csv.reader(csvfile, delimiter=';', quotechar='|')
-                self.stdout.write(self.style.SUCCESS('Crucifixion party! Wait for it...'))
-                node_count = 0
-                skip_count = 0
-                cypher = ''
-
-                for row in spamreader:
-                    if row[0] == 'n':
-                        try:
-                            cypher += row[1]
-                            node_count += 1
-                        except exception.UniqueProperty:
-                            skip_count += 1
-
-                    if cypher and node_count % BUFFER_COUNT == 0:
-                        db.cypher_query(cypher)
-                        cypher = ''
-                        self.stdout.write('{} nodes processed'.format(node_count), ending='\r')
-                        self.stdout.flush()
+        checkpoints = ImportCheckpoint.objects.filter(
+            content_type__in=[ContentType.objects.get_for_model(model) for model in models])
+        if not options['resume']:
+            checkpoints.delete()
+        elif self.verbosity > 0 and not checkpoints.exists():
+            self.stdout.write('There is no interrupted import to resume, starting over.')
+
+        run_phase = self.run_phase_parallel if self.workers > 1 else self.run_phase
+
+        # All nodes must exist before relationships are connected, so the
+        # relationship phase never starts before every node partition is done.
+        nodes = run_phase(PHASE_NODES, models)
+
+        relationships = 0
+        if not options['skip_relationships']:
+            relationships = run_phase(PHASE_RELATIONSHIPS, models)
+
+        # The import is done, so there is nothing left for a later --resume to continue.
+        checkpoints.delete()
+        bump_graph_version()
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {nodes} nodes and {relationships} relationships for {models} models.'.format(
+                nodes=nodes, relationships=relationships, models=len(models))))
 
-                if cypher:
-                    db.cypher_query(cypher)
+    def run_incremental(self, models, since=None, skip_relationships=False):
+        """
+        Synchronize objects which has been modified since ``since``, or since the
+        high-water mark for the model if ``since`` is None, and delete nodes for
+        objects which no longer exists. The high-water marks are moved to the start
+        of this import once all models are done.
+        """
+        started = timezone.now()
+        ctypes = OrderedDict((model, ContentType.objects.get_for_model(model)) for model in models)
+        watermarks = dict(ImportWatermark.objects.filter(content_type__in=ctypes.values())
+                          .values_list('content_type_id', 'value'))
 
-                self.stdout.write(self.style.SUCCESS(
-                    '{} nodes processed and delivered to Neo... '
-                    'Why oh why, didn\'t I take the blue pill??'.format(node_count)))
-                if skip_count > 0:
-                    self.stdout.write(self.style.SUCCESS(
-                        '{} nodes already existed, and was not updated.... Were you listening to me Neo? Or were you '
-                        'looking at the woman in the red dress?'.format(skip_count)))
+        synced, deleted, tracked = 0, 0, []
+        for model, ctype in ctypes.items():
+            label, model_start = get_model_string(model), time.time()
+            queryset = get_queryset(model, self.database)
 
-            with open(target_file.name, newline='') as csvfile:
-                spamreader = csv.reader(csvfile, delimiter=';', quotechar='|')
-                relation_count = 0
+            field = get_modification_field(model)
+            model_since = since or watermarks.get(ctype.pk)
+            changed = queryset
+            if field is not None:
+                tracked.append(ctype)
+                if model_since is not None:
+                    changed = get_changed_queryset(queryset, field, model_since)
 
-                for row in spamreader:
-                    if row[0] == 'r':
-                        db.cypher_query(row[1])
-                        relation_count += 1
+            count = bulk_sync(changed, max_depth=0 if skip_relationships else 1,
+                              create_empty=True, chunk_size=self.batch_size)
+            removed = delete_stale_nodes(queryset, chunk_size=self.batch_size)
+            if self.verbosity > 0 and (count or removed):
+                self.stdout.write('{label}: {count} synchronized, {removed} deleted in {elapsed:.1f}s'.format(
+                    label=label, count=count, removed=removed, elapsed=time.time() - model_start))
+            synced += count
+            deleted += removed
 
-                    if relation_count % BUFFER_COUNT == 0:
-                        self.stdout.write('{} relations processed'.format(relation_count), ending='\r')
+        # High-water marks are never saved one by one, which would sync them to the graph.
+        ImportWatermark.objects.filter(content_type__in=tracked).update(value=started)
+        ImportWatermark.objects.bulk_create([ImportWatermark(content_type=ctype, value=started)
+                                             for ctype in tracked if ctype.pk not in watermarks])
+
+        self.stdout.write(self.style.SUCCESS(
+            'Synchronized {synced} objects and deleted {deleted} nodes for {models} models.'.format(
+                synced=synced, deleted=deleted, models=len(models))))
+
+    def run_phase(self, phase, models):
+        """
+        Import ``phase`` for each model in this process, reporting progress and throughput.
+        :returns: Total number of written items.
+        """
+        total, start = 0, time.time()
+        for model in models:
+            label, count, model_start = get_model_string(model), 0, time.time()
+            for checkpoint in get_checkpoints(model, phase, self.database):
+                for written in import_checkpoint(checkpoint, self.database, self.batch_size, models):
+                    count += written
+                    if self.verbosity > 1:
+                        self.stdout.write('{label}: {count} {phase}'.format(
+                            label=label, count=count, phase=phase), ending='\r')
                         self.stdout.flush()
 
-                self.stdout.write(self.style.SUCCESS(
-                    '{} relations processed and delivered to Neo... '
-                    'Why oh why, didn\'t I take the blue pill??'.format(relation_count)))
-                self.stdout.write(self.style.SUCCESS('Crucifixion party! By the left! Forward!'))
+            if self.verbosity > 0 and count:
+                self.stdout.write(self.get_rate_message(label, count, phase, time.time() - model_start))
+            total += count
+
+        if self.verbosity > 0:
+            self.stdout.write(self.style.SUCCESS(
+                self.get_rate_message('Total', total, phase, time.time() - start)))
+        return total
+
+    def run_phase_parallel(self, phase, models):
+        """
+        Split each model into primary key partitions, and import ``phase`` for
+        all partitions using a pool of worker processes. Returns when all
+        partitions are done.
+        :returns: Total number of written items.
+        """
+        start = time.time()
+        labels = [get_model_string(model) for model in models]
+        partitions = [(label, checkpoint.pk) for model, label in zip(models, labels)
+                      for checkpoint in get_checkpoints(model, phase, self.database, self.partition_size)]
+
+        # Worker processes must not share database connections with this process.
+        connections.close_all()
+
+        counts = OrderedDict((label, 0) for label in labels)
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(import_partition, checkpoint_pk, self.database, self.batch_size, labels): label
+                       for label, checkpoint_pk in partitions}
+            for n, future in enumerate(as_completed(futures), start=1):
+                counts[futures[future]] += future.result()
+                if self.verbosity > 1:
+                    self.stdout.write('{n}/{total} {phase} partitions done'.format(
+                        n=n, total=len(futures), phase=phase), ending='\r')
+                    self.stdout.flush()
 
-        finally:
-            target_file.close()
+        elapsed = time.time() - start
+        if self.verbosity > 0:
+            for label, count in counts.items():
+                if count:
+                    self.stdout.write('{label}: {count} {phase}'.format(label=label, count=count, phase=phase))
+            self.stdout.write(self.style.SUCCESS(
+                self.get_rate_message('Total', sum(counts.values()), phase, elapsed)))
+        return sum(counts.values())
 
+    @staticmethod
+    def get_rate_message(label, count, phase, elapsed):
+        return '{label}: {count} {phase} in {elapsed:.1f}s ({rate:.0f}/s)'.format(
+            label=label, count=count, phase=phase, elapsed=elapsed, rate=count / elapsed if elapsed else count)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_pk', models.CharField(max_length=255, verbose_name='object primary key')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='last error')),
+                ('available', models.DateTimeField(default=django.utils.timezone.now, help_text='Entry will not be processed before this time.', verbose_name='available')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='created')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_entry_set', to='contenttypes.ContentType', verbose_name='content type')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'verbose_name': 'outbox entry',
+                'verbose_name_plural': 'outbox entries',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxentry',
+            index_together=set([('available', 'attempts')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 14:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('chemtrails', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.CharField(choices=[('nodes', 'nodes'), ('relationships', 'relationships')], max_length=20, verbose_name='phase')),
+                ('partition_start', models.CharField(blank=True, max_length=255, null=True, verbose_name='partition start')),
+                ('partition_end', models.CharField(blank=True, max_length=255, null=True, verbose_name='partition end')),
+                ('last_pk', models.CharField(blank=True, max_length=255, null=True, verbose_name='last imported primary key')),
+                ('completed', models.BooleanField(default=False, verbose_name='completed')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_checkpoint_set', to='contenttypes.ContentType', verbose_name='content type')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'verbose_name': 'import checkpoint',
+                'verbose_name_plural': 'import checkpoints',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='importcheckpoint',
+            index_together=set([('content_type', 'phase')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('chemtrails', '0002_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.DateTimeField(verbose_name='value')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='updated')),
+                ('content_type', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='import_watermark', to='contenttypes.ContentType', verbose_name='content type')),
+            ],
+            options={
+                'ordering': ('pk',),
+                'verbose_name': 'import watermark',
+                'verbose_name_plural': 'import watermarks',
+            },
+        ),
+    ]
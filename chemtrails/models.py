@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+
+class OutboxEntry(models.Model):
+    """
+    An object waiting to be synchronized with the graph. Entries are written
+    by the signal handlers in the same transaction as the change itself, and
+    drained by the ``chemtrails_worker`` management command.
+    """
+    content_type = models.ForeignKey(ContentType, verbose_name=_('content type'),
+                                     related_name='outbox_entry_set')
+    object_pk = models.CharField(_('object primary key'), max_length=255)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True, default='')
+    available = models.DateTimeField(_('available'), default=timezone.now,
+                                     help_text=_('Entry will not be processed before this time.'))
+    created = models.DateTimeField(verbose_name=_('created'), auto_now_add=True)
+
+    class Meta:
+        ordering = ('pk',)
+        verbose_name = _('outbox entry')
+        verbose_name_plural = _('outbox entries')
+        index_together = ('available', 'attempts')
+
+    def __str__(self):
+        return '%(ctype)s: %(pk)s' % {'ctype': self.content_type, 'pk': self.object_pk}
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress of a primary key range imported by the ``neo_import`` management
+    command, which is used for resuming an interrupted import. Checkpoints are
+    removed once the import is done. Ranges are half-open, and unbounded in the
+    direction where ``partition_start`` or ``partition_end`` is null.
+    """
+    PHASE_NODES = 'nodes'
+    PHASE_RELATIONSHIPS = 'relationships'
+    PHASE_CHOICES = (
+        (PHASE_NODES, _('nodes')),
+        (PHASE_RELATIONSHIPS, _('relationships'))
+    )
+
+    content_type = models.ForeignKey(ContentType, verbose_name=_('content type'),
+                                     related_name='import_checkpoint_set')
+    phase = models.CharField(_('phase'), max_length=20, choices=PHASE_CHOICES)
+    partition_start = models.CharField(_('partition start'), max_length=255, null=True, blank=True)
+    partition_end = models.CharField(_('partition end'), max_length=255, null=True, blank=True)
+    last_pk = models.CharField(_('last imported primary key'), max_length=255, null=True, blank=True)
+    completed = models.BooleanField(_('completed'), default=False)
+    updated = models.DateTimeField(verbose_name=_('updated'), auto_now=True)
+
+    class Meta:
+        ordering = ('pk',)
+        verbose_name = _('import checkpoint')
+        verbose_name_plural = _('import checkpoints')
+        index_together = ('content_type', 'phase')
+
+    def __str__(self):
+        return '%(ctype)s: %(phase)s [%(start)s, %(end)s)' % {
+            'ctype': self.content_type, 'phase': self.phase,
+            'start': self.partition_start, 'end': self.partition_end
+        }
+
+
+class ImportWatermark(models.Model):
+    """
+    High-water mark for incremental imports using the ``neo_import`` management
+    command. Objects modified at or after ``value`` are imported on the next
+    incremental import.
+    """
+    content_type = models.OneToOneField(ContentType, verbose_name=_('content type'),
+                                        related_name='import_watermark')
+    value = models.DateTimeField(_('value'))
+    updated = models.DateTimeField(verbose_name=_('updated'), auto_now=True)
+
+    class Meta:
+        ordering = ('pk',)
+        verbose_name = _('import watermark')
+        verbose_name_plural = _('import watermarks')
+
+    def __str__(self):
+        return '%(ctype)s: %(value)s' % {'ctype': self.content_type, 'value': self.value}
@@ -7,21 +7,31 @@ from chemtrails.neoutils.core import (
     ModelNodeMeta, ModelNodeMixin,
     MetaNodeMeta, MetaNodeMixin
 )
+from chemtrails.neoutils.bulk import bulk_sync
+from chemtrails.neoutils.version import bump_graph_version, get_graph_version
 
 __all__ = [
+    'bulk_sync',
+    'bump_graph_version',
     'get_meta_node_class_for_model',
     'get_meta_node_for_model',
     'get_node_class_for_model',
+    'get_graph_version',
     'get_node_for_object',
     'get_nodeset_for_queryset',
     '__meta_cache__',
-    '__node_cache__'
+    '__node_cache__',
+    '__reverse_cache__'
 ]
 
 # Caches to avoid infinity loops
 __meta_cache__ = {}
 __node_cache__ = {}
 
+# Maps (node class, relationship name, related node class) to the
+# name of the reverse relationship on the related node class.
+__reverse_cache__ = {}
+
 
 def get_meta_node_class_for_model(model, for_concrete_model=True):
     """
@@ -96,16 +106,14 @@ def get_nodeset_for_queryset(queryset, sync=False, max_depth=1):
     Get a ``NodeSet`` instance for the current queryset instance.
     :param queryset: Django ``QuerySet`` instance.
     :param sync: Sync all items in the queryset before returning.
+                 Items are synced in bulk, see ``bulk_sync``.
     :param max_depth: Maximum depth of recursive connections to be made
                       while syncing each node in the nodeset.
     :returns: A ``neomodel.match.NodeSet`` instance.
     """
-    klass = get_node_class_for_model(queryset.model)
-    nodeset = klass.nodes.filter(pk__in=list(queryset.values_list('pk', flat=True)))
     if sync:
-        for instance in queryset:
-            get_node_for_object(instance, bind=False).sync(max_depth=max_depth, update_existing=True)
-        nodeset = get_nodeset_for_queryset(queryset, sync=False)
-    return nodeset
+        bulk_sync(queryset, max_depth=max_depth, update_existing=True)
+    klass = get_node_class_for_model(queryset.model)
+    return klass.nodes.filter(pk__in=list(queryset.values_list('pk', flat=True)))
 
 
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk synchronization of querysets with the graph.
+
+Instead of syncing each object on its own, the queryset is streamed in
+chunks. Node properties for a whole chunk are upserted using a single
+``UNWIND`` statement, and relationships are diffed against the graph
+and updated using batched ``UNWIND`` statements per relationship type.
+
+Importing is a cheaper variant used for loading a whole database, where
+nodes are written for all models first, and relationships are connected
+afterwards without comparing them to the graph.
+"""
+
+import logging
+from collections import OrderedDict, defaultdict
+
+from django.apps import apps
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
+
+from neomodel import db
+
+from chemtrails.utils import chunked
+
+logger = logging.getLogger(__name__)
+
+
+def deflate_node_properties(klass, instance):
+    """
+    :param klass: ``ModelNode`` class.
+    :param instance: Django model instance.
+    :returns: A dictionary with deflated node properties for ``instance``.
+    """
+    return klass.deflate({key: getattr(instance, key, None) for key, _ in klass.__all_properties__})
+
+
+def get_node_value_fields(klass):
+    """
+    :param klass: ``ModelNode`` class.
+    :returns: List of field names to pass to ``QuerySet.values()`` in order to
+              read all node properties for ``klass`` without loading model instances.
+    """
+    attnames = set(field.attname for field in klass.Meta.model._meta.concrete_fields)
+    return ['pk'] + [key for key, _ in klass.__all_properties__ if key != 'pk' and key in attnames]
+
+
+def deflate_pk(klass, value):
+    """
+    :returns: ``value`` deflated the same way as the ``pk`` property on ``klass``.
+    """
+    return dict(klass.__all_properties__)['pk'].deflate(value)
+
+
+def get_relationship_properties(relation, target=None):
+    """
+    :param relation: ``RelationshipDefinition`` instance.
+    :param target: ``ModelNode`` class on the other end of a ``GenericForeignKey``.
+    :returns: A dictionary with deflated relationship properties.
+    """
+    properties = relation.definition['model'].deflate({})
+    if target is not None:
+        properties['target_field'] = str(target._pk_field).lower()
+    return properties
+
+
+def get_remote_field(relation):
+    """
+    :param relation: ``RelationshipDefinition`` instance.
+    :returns: The ``remote_field`` relationship property, which tells relationships
+              created for different fields apart when they share the same type.
+    """
+    return relation.definition['model'].remote_field.default
+
+
+def get_related_pks(klass, field, pks, using):
+    """
+    Look up related primary keys for ``field`` for a chunk of objects.
+    :param klass: ``ModelNode`` class.
+    :param field: Django relation field.
+    :param pks: Primary keys for the source objects.
+    :param using: Database alias.
+    :returns: An ordered dictionary mapping ``ModelNode`` classes to lists of
+              (source pk, target pk) pairs.
+    """
+    from chemtrails.neoutils import get_node_class_for_model
+
+    model = klass.Meta.model
+    queryset = model._base_manager.using(using).filter(pk__in=pks)
+    related = OrderedDict()
+
+    if isinstance(field, GenericForeignKey):
+        ct_attname = model._meta.get_field(field.ct_field).attname
+        for pk, ct_id, object_pk in queryset.values_list('pk', ct_attname, field.fk_field):
+            if ct_id is None or object_pk is None:
+                continue
+            related_model = ContentType.objects.db_manager(using).get_for_id(ct_id).model_class()
+            if related_model is None:
+                continue
+            related.setdefault(get_node_class_for_model(related_model), []).append(
+                (pk, related_model._meta.pk.to_python(object_pk)))
+    else:
+        related[get_node_class_for_model(field.related_model)] = [
+            (pk, related_pk) for pk, related_pk in queryset.values_list('pk', '%s__pk' % field.name)
+            if related_pk is not None
+        ]
+    return related
+
+
+def upsert_nodes(klass, rows, update_existing=True):
+    """
+    Create or update nodes for a chunk of rows using a single statement.
+    Only created nodes are stamped with the current schema fingerprint. Existing
+    nodes keep their fingerprint, as no stale relationships are removed here.
+    :param klass: ``ModelNode`` class.
+    :param rows: List of dictionaries with deflated node properties.
+    :param update_existing: If False, leave properties for existing nodes untouched.
+    """
+    query = [
+        'UNWIND $rows AS row',
+        'MERGE (n:{label} {{pk: row.pk}})'.format(label=klass.__label__),
+        'ON CREATE SET n = row, n._schema_fingerprint = $fingerprint'
+    ]
+    if update_existing:
+        query.append('WITH n, row, n._schema_fingerprint AS fingerprint')
+        query.append('SET n = row, n._schema_fingerprint = fingerprint')
+
+    rows = [{key: value for key, value in row.items() if key != '_schema_fingerprint'} for row in rows]
+    db.cypher_query(' '.join(query), {'rows': rows, 'fingerprint': klass.__schema_fingerprint__})
+
+
+def delete_nodes(klass, pks):
+    """
+    Delete nodes with primary keys in ``pks``.
+    :param klass: ``ModelNode`` class.
+    :param pks: Deflated primary keys.
+    """
+    query = 'MATCH (n:{label}) WHERE n.pk IN $pks DETACH DELETE n'.format(label=klass.__label__)
+    db.cypher_query(query, {'pks': pks})
+
+
+def get_connected_pks(klass, relation, pks, target=None):
+    """
+    Fetch the currently connected nodes for a chunk of nodes using a single query.
+    Only relationships created for the field ``relation`` represents are considered.
+    :param klass: ``ModelNode`` class.
+    :param relation: ``RelationshipDefinition`` on ``klass``.
+    :param pks: Deflated primary keys for the source nodes.
+    :param target: ``ModelNode`` class on the other end of the relationship. If None,
+                   the node class is resolved from the connected node.
+    :returns: A set of (source pk, target class, target pk) tuples.
+    """
+    from chemtrails.neoutils import get_node_class_for_model
+
+    query = ' '.join((
+        'UNWIND $pks AS pk',
+        'MATCH (n:{label} {{pk: pk}})-[:{type} {{remote_field: $remote_field}}]->({target})'.format(
+            label=klass.__label__, type=relation.definition['relation_type'],
+            target='m:%s' % target.__label__ if target else 'm'),
+        'RETURN n.pk, m._app_label, m._model_name, m.pk'
+    ))
+    results, _ = db.cypher_query(query, {'pks': pks, 'remote_field': get_remote_field(relation)})
+
+    connected = set()
+    for pk, app_label, model_name, related_pk in results:
+        related = target
+        if related is None:
+            try:
+                related = get_node_class_for_model(apps.get_model(app_label, model_name))
+            except (LookupError, TypeError):
+                continue
+        connected.add((pk, related, related_pk))
+    return connected
+
+
+def get_reverse_connected_pks(klass, reverse, target, pks):
+    """
+    Fetch the currently connected reverse relationships for a chunk of nodes
+    using a single query.
+    :param klass: ``ModelNode`` class.
+    :param reverse: ``RelationshipDefinition`` on ``target`` for the reverse side.
+    :param target: ``ModelNode`` class on the other end of the relationship.
+    :param pks: Deflated primary keys for the nodes the reverse relationships ends at.
+    :returns: A set of (pk, target pk) tuples.
+    """
+    query = ' '.join((
+        'UNWIND $pks AS pk',
+        'MATCH (n:{label} {{pk: pk}})<-[:{type} {{remote_field: $remote_field}}]-(m:{target})'.format(
+            label=klass.__label__, type=reverse.definition['relation_type'], target=target.__label__),
+        'RETURN n.pk, m.pk'
+    ))
+    results, _ = db.cypher_query(query, {'pks': pks, 'remote_field': get_remote_field(reverse)})
+    return set((pk, related_pk) for pk, related_pk in results)
+
+
+def connect_nodes(klass, relation, target, pairs, reverse=None, generic=False, chunk_size=None):
+    """
+    Create relationships, and their reverse relationships, using batched statements.
+    Relationships are merged on their ``remote_field`` property, so relationships of
+    the same type created for other fields are left alone.
+    :param klass: ``ModelNode`` class.
+    :param relation: ``RelationshipDefinition`` on ``klass``.
+    :param target: ``ModelNode`` class on the other end of the relationship.
+    :param pairs: Iterable of deflated (source pk, target pk) pairs.
+    :param reverse: ``RelationshipDefinition`` on ``target`` for the reverse side.
+    :param generic: True if ``relation`` represents a ``GenericForeignKey``.
+    :param chunk_size: Maximum number of relationships in each statement.
+    """
+    query = [
+        'UNWIND $pairs AS pair',
+        'MATCH (n:{label} {{pk: pair[0]}}), (m:{target} {{pk: pair[1]}})'.format(
+            label=klass.__label__, target=target.__label__),
+        'MERGE (n)-[r:{type} {{remote_field: $remote_field}}]->(m) ON CREATE SET r = $props'.format(
+            type=relation.definition['relation_type'])
+    ]
+    params = {'props': get_relationship_properties(relation, target if generic else None),
+              'remote_field': get_remote_field(relation)}
+    if reverse is not None:
+        query.append('MERGE (m)-[r2:{type} {{remote_field: $reverse_remote_field}}]->(n) '
+                     'ON CREATE SET r2 = $reverse_props'.format(type=reverse.definition['relation_type']))
+        params['reverse_props'] = get_relationship_properties(reverse)
+        params['reverse_remote_field'] = get_remote_field(reverse)
+
+    for chunk in chunked(pairs, chunk_size):
+        db.cypher_query(' '.join(query), dict(params, pairs=[list(pair) for pair in chunk]))
+
+
+def disconnect_nodes(klass, relation, target, pairs, reverse=None, chunk_size=None):
+    """
+    Delete relationships, and their reverse relationships, using batched statements.
+    Either side is deleted even if the other side is missing.
+    :param klass: ``ModelNode`` class.
+    :param relation: ``RelationshipDefinition`` on ``klass``.
+    :param target: ``ModelNode`` class on the other end of the relationship.
+    :param pairs: Iterable of deflated (source pk, target pk) pairs.
+    :param reverse: ``RelationshipDefinition`` on ``target`` for the reverse side.
+    :param chunk_size: Maximum number of relationships in each statement.
+    """
+    query = [
+        'UNWIND $pairs AS pair',
+        'MATCH (n:{label} {{pk: pair[0]}}), (m:{target} {{pk: pair[1]}})'.format(
+            label=klass.__label__, target=target.__label__),
+        'OPTIONAL MATCH (n)-[r:{type} {{remote_field: $remote_field}}]->(m)'.format(
+            type=relation.definition['relation_type'])
+    ]
+    params = {'remote_field': get_remote_field(relation)}
+    if reverse is not None:
+        query.append('OPTIONAL MATCH (m)-[r2:{type} {{remote_field: $reverse_remote_field}}]->(n)'.format(
+            type=reverse.definition['relation_type']))
+        query.append('DELETE r, r2')
+        params['reverse_remote_field'] = get_remote_field(reverse)
+    else:
+        query.append('DELETE r')
+
+    for chunk in chunked(pairs, chunk_size):
+        db.cypher_query(' '.join(query), dict(params, pairs=[list(pair) for pair in chunk]))
+
+
+def connect_relationships(klass, pks, max_depth, using=None, chunk_size=None):
+    """
+    Synchronize all relationships for a chunk of objects. For each relationship,
+    the currently connected nodes are fetched in a single query for each direction
+    and compared to the related objects in the database. Additions and removals,
+    including missing or stale reverse relationships, are then applied using
+    batched statements.
+    :param klass: ``ModelNode`` class.
+    :param pks: Primary keys for the source objects.
+    :param max_depth: Maximum depth of recursive connections to be made.
+    :param using: Database alias.
+    :param chunk_size: Maximum number of items in each statement.
+                       Defaults to ``settings.SYNC_CHUNK_SIZE``.
+    """
+    from chemtrails.conf import settings
+    from chemtrails.neoutils import get_node_class_for_model
+
+    chunk_size = chunk_size or settings.SYNC_CHUNK_SIZE
+    deflated = [deflate_pk(klass, pk) for pk in pks]
+
+    for attr, field in klass.__relationship_fields__.items():
+        relation = getattr(klass, attr)
+        relation_type = relation.definition['relation_type']
+
+        related = defaultdict(set)
+        for target, pairs in get_related_pks(klass, field, pks, using).items():
+            if target._is_ignored or not pairs:
+                continue
+
+            # Make sure the related nodes exists before connecting them.
+            for chunk in chunked(set(related_pk for _, related_pk in pairs), chunk_size):
+                bulk_sync(target.Meta.model._base_manager.using(using).filter(pk__in=chunk),
+                          max_depth=max_depth - 1, update_existing=False, create_empty=True,
+                          chunk_size=chunk_size)
+
+            related[target].update((deflate_pk(klass, pk), deflate_pk(target, related_pk))
+                                   for pk, related_pk in pairs)
+
+        generic = isinstance(field, GenericForeignKey)
+        connected = defaultdict(set)
+        for pk, target, related_pk in get_connected_pks(
+                klass, relation, deflated,
+                target=None if generic else get_node_class_for_model(field.related_model)):
+            connected[target].add((pk, related_pk))
+
+        for target in set(related.keys()) | set(connected.keys()):
+            reverse = klass.get_reverse_relationship(attr, target)
+            removed = connected[target] - related[target]
+            added = related[target] - connected[target]
+            if reverse is not None:
+                reverse_connected = get_reverse_connected_pks(klass, reverse, target, deflated)
+                removed |= reverse_connected - related[target]
+                added |= related[target] - reverse_connected
+            if removed:
+                disconnect_nodes(klass, relation, target, removed, reverse=reverse, chunk_size=chunk_size)
+            if added:
+                connect_nodes(klass, relation, target, added, reverse=reverse, generic=generic,
+                              chunk_size=chunk_size)
+
+            logger.info('Connected %(added)d and disconnected %(removed)d %(type)s '
+                        'relationship(s) between %(klass)s and %(target)s' % {
+                            'added': len(added),
+                            'removed': len(removed),
+                            'type': relation_type,
+                            'klass': klass.__name__,
+                            'target': target.__name__
+                        })
+
+
+def bulk_sync(queryset, max_depth=None, update_existing=True, create_empty=False, chunk_size=None):
+    """
+    Synchronize all objects in ``queryset`` with the graph and connect all
+    directly related nodes. The queryset is streamed in chunks, so memory
+    usage stays flat regardless of the size of the queryset.
+    :param queryset: Django ``QuerySet`` instance.
+    :param max_depth: Maximum depth of recursive connections to be made.
+                      Defaults to ``settings.MAX_CONNECTION_DEPTH``.
+    :param update_existing: If True, save data from the django model to graph node.
+    :param create_empty: If the Node has no relational fields, don't create it.
+    :param chunk_size: Number of objects to process in each chunk.
+                       Defaults to ``settings.SYNC_CHUNK_SIZE``.
+    :returns: Number of synchronized objects.
+    """
+    from chemtrails.conf import settings
+    from chemtrails.neoutils import get_node_class_for_model
+
+    if max_depth is None:
+        max_depth = settings.MAX_CONNECTION_DEPTH
+    chunk_size = chunk_size or settings.SYNC_CHUNK_SIZE
+    klass = get_node_class_for_model(queryset.model)
+
+    if klass._is_ignored:
+        for pks in chunked(queryset.values_list('pk', flat=True).iterator(), chunk_size):
+            delete_nodes(klass, [deflate_pk(klass, pk) for pk in pks])
+        return 0
+
+    if not klass.has_relations and not create_empty:
+        return 0
+
+    count = 0
+    for instances in chunked(queryset.iterator(), chunk_size):
+        upsert_nodes(klass, [deflate_node_properties(klass, instance) for instance in instances],
+                     update_existing=update_existing)
+        if max_depth > 0:
+            connect_relationships(klass, [instance.pk for instance in instances],
+                                  max_depth=max_depth, using=queryset.db, chunk_size=chunk_size)
+        count += len(instances)
+
+    logger.debug('Synchronized %(count)d %(klass)s node(s)' % {'count': count, 'klass': klass.__name__})
+    return count
+
+
+def import_nodes(queryset, chunk_size=None):
+    """
+    Write nodes for all objects in ``queryset`` to the graph. Rows are streamed
+    in primary key order using ``QuerySet.values()``, so no model instances are
+    created, and each chunk is written using a single ``UNWIND`` statement.
+    :param queryset: Django ``QuerySet`` instance.
+    :param chunk_size: Number of nodes to write in each statement.
+                       Defaults to ``settings.SYNC_CHUNK_SIZE``.
+    :returns: A generator yielding the number of written nodes and the last
+              primary key for each chunk.
+    """
+    from chemtrails.conf import settings
+    from chemtrails.neoutils import get_node_class_for_model
+
+    chunk_size = chunk_size or settings.SYNC_CHUNK_SIZE
+    klass = get_node_class_for_model(queryset.model)
+
+    rows = queryset.order_by('pk').values(*get_node_value_fields(klass)).iterator()
+    for chunk in chunked(rows, chunk_size):
+        upsert_nodes(klass, [klass.deflate(row) for row in chunk])
+        yield len(chunk), chunk[-1]['pk']
+
+
+def get_import_relationships(klass, pks, using=None, imported_models=()):
+    """
+    Look up relationships to import for a chunk of objects.
+    :param klass: ``ModelNode`` class.
+    :param pks: Primary keys for the source objects.
+    :param using: Database alias.
+    :param imported_models: Models which relationships are imported as well.
+                            Reverse relations to these models are skipped, since
+                            they are written along with the forward relationships.
+    :returns: A generator yielding (relation, target, pairs, reverse, generic) tuples,
+              one for each relationship type and target node class, where ``pairs``
+              is a list of deflated (source pk, target pk) pairs, ``reverse`` is the
+              relationship on ``target`` for the reverse side and ``generic`` is True
+              if ``relation`` represents a ``GenericForeignKey``.
+    """
+    for attr, field in klass.__relationship_fields__.items():
+        is_reverse = (field.auto_created and not field.concrete) or isinstance(field, GenericRelation)
+        if is_reverse and field.related_model in imported_models:
+            continue
+
+        relation = getattr(klass, attr)
+        for target, pairs in get_related_pks(klass, field, pks, using).items():
+            if target._is_ignored or not pairs:
+                continue
+            yield (relation, target,
+                   [(deflate_pk(klass, pk), deflate_pk(target, related_pk)) for pk, related_pk in pairs],
+                   klass.get_reverse_relationship(attr, target), isinstance(field, GenericForeignKey))
+
+
+def import_relationships(queryset, chunk_size=None, imported_models=()):
+    """
+    Write relationships for all objects in ``queryset`` to the graph. Related
+    primary keys are looked up for a chunk of objects at a time, and written
+    using one ``UNWIND`` statement per relationship type. The related nodes must
+    already exist, and existing relationships are left untouched.
+    :param queryset: Django ``QuerySet`` instance.
+    :param chunk_size: Number of objects to process in each chunk.
+                       Defaults to ``settings.SYNC_CHUNK_SIZE``.
+    :param imported_models: Models which relationships are imported as well.
+                            See ``get_import_relationships()``.
+    :returns: A generator yielding the number of written relationships and the
+              last primary key for each chunk.
+    """
+    from chemtrails.conf import settings
+    from chemtrails.neoutils import get_node_class_for_model
+
+    chunk_size = chunk_size or settings.SYNC_CHUNK_SIZE
+    klass = get_node_class_for_model(queryset.model)
+
+    for pks in chunked(queryset.order_by('pk').values_list('pk', flat=True).iterator(), chunk_size):
+        count = 0
+        for relation, target, pairs, reverse, generic in get_import_relationships(
+                klass, pks, using=queryset.db, imported_models=imported_models):
+            connect_nodes(klass, relation, target, pairs, reverse=reverse, generic=generic, chunk_size=chunk_size)
+            count += len(pairs)
+        yield count, pks[-1]
+
+
+def get_graph_pks(klass, chunk_size):
+    """
+    Stream the primary keys of all ``klass`` nodes in the graph in primary key order.
+    :param klass: ``ModelNode`` class.
+    :param chunk_size: Number of primary keys to fetch in each query.
+    :returns: A generator yielding lists of deflated primary keys.
+    """
+    last = None
+    while True:
+        query = ' '.join((
+            'MATCH (n:{label}) WHERE n.pk IS NOT NULL'.format(label=klass.__label__),
+            'AND n.pk > $last' if last is not None else '',
+            'RETURN n.pk ORDER BY n.pk LIMIT $limit'
+        ))
+        results, _ = db.cypher_query(query, {'last': last, 'limit': chunk_size})
+        pks = [row[0] for row in results]
+        if pks:
+            yield pks
+        if len(pks) < chunk_size:
+            return
+        last = pks[-1]
+
+
+def delete_stale_nodes(queryset, chunk_size=None):
+    """
+    Delete nodes for objects which no longer exists in ``queryset``. Primary keys
+    are read from the graph in chunks, and compared to the primary keys in the
+    database one chunk at a time.
+    :param queryset: Django ``QuerySet`` instance.
+    :param chunk_size: Number of primary keys to compare at a time.
+                       Defaults to ``settings.SYNC_CHUNK_SIZE``.
+    :returns: Number of deleted nodes.
+    """
+    from chemtrails.conf import settings
+    from chemtrails.neoutils import get_node_class_for_model
+
+    chunk_size = chunk_size or settings.SYNC_CHUNK_SIZE
+    klass = get_node_class_for_model(queryset.model)
+    to_python = queryset.model._meta.pk.to_python
+
+    count = 0
+    for pks in get_graph_pks(klass, chunk_size):
+        existing = set(deflate_pk(klass, pk) for pk in queryset.filter(
+            pk__in=[to_python(pk) for pk in pks]).values_list('pk', flat=True))
+        stale = [pk for pk in pks if pk not in existing]
+        if stale:
+            delete_nodes(klass, stale)
+            count += len(stale)
+
+    logger.debug('Deleted %(count)d stale %(klass)s node(s)' % {'count': count, 'klass': klass.__name__})
+    return count
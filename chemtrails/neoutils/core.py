@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
 import itertools
 import logging
 import operator
@@ -16,7 +17,7 @@ from django.utils.translation import ungettext
 
 from neomodel import *
 from chemtrails.conf import settings
-from chemtrails.utils import get_model_string, flatten, timeit
+from chemtrails.utils import get_model_string, flatten, is_internal_model, timeit
 
 logger = logging.getLogger(__name__)
 
@@ -181,6 +182,9 @@ class ModelNodeMeta(NodeBase):
         if cls.Meta.model not in __node_cache__:
             __node_cache__.update({cls.Meta.model: cls})
 
+        # Keep track of which Django field each relationship attribute represents.
+        cls.__relationship_fields__ = {}
+
         for field in cls.Meta.model._meta.get_fields():
 
             if field.__class__ not in field_property_map:
@@ -191,6 +195,7 @@ class ModelNodeMeta(NodeBase):
                 relation = cls.get_related_node_property_for_field(field)
                 if relation:
                     cls.add_to_class(field.name, relation)
+                    cls.__relationship_fields__[field.name] = field
                     if isinstance(field, models.ForeignKey):
                         cls.add_to_class(field.attname,
                                          cls.get_property_class_for_field(field.target_field.__class__)())
@@ -199,20 +204,52 @@ class ModelNodeMeta(NodeBase):
             elif field in reverse_relations:
                 relation = cls.get_related_node_property_for_field(field)
                 if relation:
-                    cls.add_to_class(field.related_name or '%s_set' % field.name, relation)
+                    related_name = field.related_name or '%s_set' % field.name
+                    cls.add_to_class(related_name, relation)
+                    cls.__relationship_fields__[related_name] = field
 
             # Add concrete fields
             else:
                 if field is not cls._pk_field:
                     cls.add_to_class(field.name, cls.get_property_class_for_field(field.__class__)())
 
+        cls.__schema_fingerprint__ = cls.get_schema_fingerprint()
+        cls._schema_fingerprint = StringProperty(default=cls.__schema_fingerprint__)
+
         # Recalculate definitions
         cls.__all_properties__ = tuple(cls.defined_properties(aliases=False, rels=False).items())
         cls.__all_aliases__ = tuple(cls.defined_properties(properties=False, rels=False).items())
         cls.__all_relationships__ = tuple(cls.defined_properties(aliases=False, properties=False).items())
 
+        cls.register_reverse_relationships()
+
         return cls
 
+    def register_reverse_relationships(cls):
+        """
+        Add the reverse side of each relationship on ``cls`` to the reverse
+        relationship index. Related node classes which are created later on
+        will register the pair when they are complete.
+        """
+        from chemtrails.neoutils import __node_cache__, __reverse_cache__
+
+        for attr, field in cls.__relationship_fields__.items():
+            if isinstance(field, GenericForeignKey):
+                # The related model is unknown until we have an object instance,
+                # so look through all node classes.
+                targets = list(__node_cache__.values())
+            else:
+                targets = [__node_cache__.get(field.related_model._meta.concrete_model)]
+
+            for target in targets:
+                if target is None or '__relationship_fields__' not in target.__dict__:
+                    continue
+                for other_attr, other in target.__relationship_fields__.items():
+                    if cls._is_reverse_field(field, other):
+                        __reverse_cache__[(cls, attr, target)] = other_attr
+                        __reverse_cache__[(target, other_attr, cls)] = attr
+                        break
+
 
 class ModelNodeMixinBase:
     """
@@ -223,6 +260,7 @@ class ModelNodeMixinBase:
         Compares the node class attributes to raw node attributes and removes
         any artifacts from the raw node. We want the defined node class 
         attributes to be the source of truth at all times.
+        Nodes which are stamped with the current schema fingerprint are skipped.
         :returns None
         """
         # We can only operate on bound nodes
@@ -230,10 +268,12 @@ class ModelNodeMixinBase:
             return
 
         query = ' '.join((
-            'MATCH (n:{label}) WHERE ID(n) = {id}'.format(label=self.__label__, id=self.id),
+            'MATCH (n:{label}) WHERE ID(n) = $id'.format(label=self.__label__),
+            'AND coalesce(n._schema_fingerprint, \'\') <> $fingerprint',
             'OPTIONAL MATCH (n)-[r]->() RETURN n, r'
         ))
-        results, _ = db.cypher_query(query)
+        results, _ = db.cypher_query(query, {'id': self.id, 'fingerprint': self.__schema_fingerprint__})
+        self._schema_fingerprint = self.__schema_fingerprint__
 
         # Identify all properties and relationships which exists on the raw node,
         # but which are not defined on the class model.
@@ -250,12 +290,9 @@ class ModelNodeMixinBase:
             relationships = [r.definition['relation_type'] for r in
                              self.defined_properties(aliases=False, properties=False).values()]
             if relation is not None and relation.type not in relationships:
-                query = 'MATCH (n:{label})-[r]-() WHERE ID(n) = {id} AND ID(r) = {rid} DELETE r'.format(**{
-                    'label': self.__label__,
-                    'id': node.id,
-                    'rid': relation.id
-                })
-                db.cypher_query(query)
+                query = 'MATCH (n:{label})-[r]-() WHERE ID(n) = $id AND ID(r) = $rid DELETE r'.format(
+                    label=self.__label__)
+                db.cypher_query(query, {'id': node.id, 'rid': relation.id})
                 logger.info('Relationship type %(type)s is not defined on %(klass)s. '
                             'Removed relationship from raw node.' % {
                                 'type': relation.type,
@@ -264,10 +301,10 @@ class ModelNodeMixinBase:
 
             if node.id in to_remove:
                 query = ' '.join((
-                    'MATCH (n:{label}) WHERE ID(n) = {id} REMOVE'.format(label=self.__label__, id=node.id),
-                    ', '.join(['n.%s' % prop for prop in to_remove[node.id]])
+                    'MATCH (n:{label}) WHERE ID(n) = $id REMOVE'.format(label=self.__label__),
+                    ', '.join(['n.%s' % prop for prop in sorted(to_remove[node.id])])
                 ))
-                db.cypher_query(query)
+                db.cypher_query(query, {'id': node.id})
                 logger.info('The following %(text)s %(props)s is not defined on %(klass)s. '
                             'Removed %(props)s from raw node.' % {
                                 'text': ungettext('property', 'properties', len(to_remove[node.id])),
@@ -275,6 +312,30 @@ class ModelNodeMixinBase:
                                 'klass': self.__class__.__name__
                             })
 
+    def get_raw_schema_fingerprint(self):
+        """
+        :returns: The schema fingerprint stored on the raw node, or an empty
+                  string if the node has not been stamped.
+        """
+        if not self._is_bound:
+            return ''
+        results, _ = db.cypher_query('MATCH (n:{label}) WHERE ID(n) = $id '
+                                     'RETURN n._schema_fingerprint'.format(label=self.__label__), {'id': self.id})
+        return (results[0][0] if results else None) or ''
+
+    @classmethod
+    def get_schema_fingerprint(cls):
+        """
+        Calculate a fingerprint for the node class schema, which is stored on
+        each node in order to detect nodes written using an older schema.
+        :returns: A hash of the property names and relationship types defined on the class.
+        """
+        properties = sorted(key for key in cls.defined_properties(aliases=False, rels=False).keys()
+                            if key != '_schema_fingerprint')
+        relationships = sorted(set(relation.definition['relation_type'] for relation in
+                                   cls.defined_properties(aliases=False, properties=False).values()))
+        return hashlib.sha1(' '.join(properties + ['|'] + relationships).encode('utf-8')).hexdigest()
+
     @classproperty
     def _pk_field(cls):
         model = cls.Meta.model
@@ -284,6 +345,10 @@ class ModelNodeMixinBase:
 
     @classproperty
     def _is_ignored(cls):
+        # The internal models are ignored regardless of ``IGNORE_MODELS``, since
+        # mirroring the outbox would make it feed itself.
+        if is_internal_model(cls.Meta.model):
+            return True
         lookups = (
             cls.Meta.app_label,
             '{app_label}.*'.format(app_label=cls.Meta.app_label),
@@ -330,6 +395,37 @@ class ModelNodeMixinBase:
                    else field.remote_field.field if not isinstance(field, GenericForeignKey)
                    else str(field)).lower()
 
+    @staticmethod
+    def _is_reverse_field(field, other):
+        """
+        :returns: True if ``other`` is the reverse side of the relation ``field``.
+        """
+        if isinstance(field, GenericRelation):
+            field, other = other, field
+        if isinstance(field, GenericForeignKey):
+            return (isinstance(other, GenericRelation)
+                    and other.related_model is field.model
+                    and other.object_id_field_name == field.fk_field
+                    and other.content_type_field_name == field.ct_field)
+        if other is field:
+            # Symmetrical many to many relations to self has no reverse field.
+            return (isinstance(field, models.ManyToManyField)
+                    and field.remote_field.symmetrical and field.related_model is field.model)
+        return field.remote_field is other
+
+    @classmethod
+    def get_reverse_relationship(cls, attr, target):
+        """
+        Look up the relationship on ``target`` which represents the reverse
+        side of the relationship ``attr``.
+        :param attr: Relationship attribute name on this class.
+        :param target: ``ModelNode`` class on the other end of the relationship.
+        :returns: A ``RelationshipDefinition`` instance, or None if not found.
+        """
+        from chemtrails.neoutils import __reverse_cache__
+        name = __reverse_cache__.get((cls, attr, target), None)
+        return getattr(target, name) if name else None
+
     @staticmethod
     def get_property_class_for_field(klass):
         """
@@ -402,6 +498,7 @@ class ModelNodeMixinBase:
         is True, pick the relationship type from the field. If not,
         use a pre-defined set of generic types.
         """
+        from chemtrails.conf import settings
         generic_types = {
             Relationship: 'MUTUAL_RELATION',
             RelationshipTo: 'RELATES_TO',
@@ -458,6 +555,10 @@ class ModelNodeMixinBase:
     @classmethod
     def inflate(cls, node):
         inflated = super(ModelNodeMixinBase, cls).inflate(node)
+        if not isinstance(node, int):
+            # Nodes without a fingerprint has been written using an unknown schema,
+            # so don't let them pick up the current fingerprint as a default value.
+            inflated._schema_fingerprint = node.properties.get('_schema_fingerprint', '')
 
         model = cls.Meta.model
         app_label = (getattr(inflated._app_label, 'default') if isinstance(inflated._app_label, Property)
@@ -509,7 +610,9 @@ class ModelNodeMixin(ModelNodeMixinBase):
             required = {key: prop for key, prop in self.defined_properties(aliases=False, rels=False).items()
                         if prop.required or prop.unique_index}
             if all(getattr(self, attr) for attr in required.keys()):
-                node_id = self._get_id_from_database(self.deflate(self.__properties__))
+                params = self.deflate(self.__properties__)
+                del params['_schema_fingerprint']
+                node_id = self._get_id_from_database(params)
                 if node_id:
                     self.id = node_id
 
@@ -697,7 +800,7 @@ class ModelNodeMixin(ModelNodeMixinBase):
         :returns: Node id if found, else None
         """
         query = ' '.join(('MATCH (n:{label}) WHERE'.format(label=self.__label__),
-                          ' AND '.join(['n.{} = {{{}}}'.format(key, key) for key in params.keys()]),
+                          ' AND '.join(['n.{0} = ${0}'.format(key) for key in sorted(params.keys())]),
                           'RETURN id(n) LIMIT 1'))
         result, _ = db.cypher_query(query, params)
         return list(flatten(result))[0] if result else None
@@ -744,82 +847,13 @@ class ModelNodeMixin(ModelNodeMixinBase):
     @timeit
     def recursive_connect(self, max_depth=settings.MAX_CONNECTION_DEPTH):
         """
-        Recursively connect a node branch.
+        Recursively connect a node branch. For each relationship, the set of
+        connected nodes is compared to the related objects in the database, and
+        the difference is applied using batched statements.
         :param max_depth: Go n nodes deep originating from the current node.
         :returns: None
         """
-        from chemtrails.neoutils import get_node_for_object
-
-        def connect(node, prop):
-            """
-            Connect both sides of the relationship.
-            """
-            if not prop.is_connected(node) and isinstance(node, prop.definition['node_class']):
-                prop.connect(node)
-                self._log_relationship_definition('Connected', node, prop)
-                for p, r in node.defined_properties(aliases=False, properties=False).items():
-                    # Iterate all relationship properties for node and connect the
-                    # "reverse" side of the relationship back.
-                    # NOTE: Simplify this anyone?
-                    p = getattr(node, p)
-                    if issubclass(p.definition['node_class'], self.__class__):
-                        remote_field = p.definition['model'].remote_field
-                        target_field = p.definition['model'].target_field
-
-                        reverse_fields = p.source_class.get_reverse_relation_fields()
-                        forward_fields = p.source_class.get_forward_relation_fields()
-
-                        for f in itertools.chain(reverse_fields, forward_fields):
-                            if f.__class__ not in field_property_map:
-                                continue
-                            if (remote_field.default == p.source_class._get_remote_field_name(f)
-                                    and target_field.default == str(getattr(f, 'target_field', '')).lower()):
-
-                                instance = self.get_object(self.pk)
-                                source = getattr(node.get_object(node.pk), p.name, None)
-
-                                # If `source` is a manager, query for existence of `instance`
-                                if ((isinstance(source, Manager) and source.filter(pk=instance.pk).exists())
-
-                                    # Or, if `source` is a model instance, check if it has an attribute
-                                    # `p.name` which is the `instance`
-                                    or (isinstance(source, models.Model)
-                                        and getattr(source, p.name, None) == instance)
-
-                                    # Or, if field `f` is a OneToOneField or OneToOneRel and
-                                    # `source` equals the `instance`
-                                    or (isinstance(source, models.Model)
-                                        and isinstance(f, (models.OneToOneField, models.OneToOneRel))
-                                        and source == instance)):
-
-                                    if not p.is_connected(self):
-                                        p.connect(self)
-                                        self._log_relationship_definition('Connected', self, p)
-
-        def disconnect(node, prop):
-            """
-            Disconnect both sides of the relationship.
-            """
-            prop.disconnect(node)
-            self._log_relationship_definition('Disconnected', node, prop)
-            for p, r in node.defined_properties(aliases=False, properties=False).items():
-                p = getattr(node, p)
-                if issubclass(p.definition['node_class'], self.__class__):
-                    # Iterate all relationship properties for node and disconnect the
-                    # "reverse" side of the relationship.
-                    remote_field = p.definition['model'].remote_field
-                    target_field = p.definition['model'].target_field
-
-                    reverse_fields = p.source_class.get_reverse_relation_fields()
-                    forward_fields = p.source_class.get_forward_relation_fields()
-
-                    for f in itertools.chain(reverse_fields, forward_fields):
-                        if f.__class__ not in field_property_map:
-                            continue
-                        if (remote_field.default == p.source_class._get_remote_field_name(f)
-                                and target_field.default == str(getattr(f, 'target_field', '')).lower()):
-                            p.disconnect(self)
-                            self._log_relationship_definition('Disconnected', self, p)
+        from chemtrails.neoutils.bulk import connect_relationships
 
         if max_depth <= 0:
             logger.debug('Reached MAX DEPTH for %(node)r, returning...' % {'node': self})
@@ -831,61 +865,7 @@ class ModelNodeMixin(ModelNodeMixinBase):
             return
 
         logger.info('Mapping relationships for object %(instance)r' % {'instance': instance})
-        for attr, relation in self.defined_properties(aliases=False, properties=False).items():
-            prop = getattr(self, attr)
-            klass = relation.definition['node_class']
-
-            # Never connect ignored models
-            if klass._is_ignored:
-                continue
-
-            source = getattr(instance, prop.name, None)
-            if not source:
-                for node in prop.all():
-                    disconnect(node, prop)
-                continue
-
-            if isinstance(source, models.Model):
-                node = klass.nodes.get_or_none(pk=source.pk)
-                if not node:
-                    node = get_node_for_object(source, bind=False).save()
-                    logger.info('Created missing node %(node)r while synchronizing %(instance)r' % {
-                        'node': node,
-                        'instance': instance
-                    })
-                if isinstance(prop, ZeroOrOne):
-                    # Disconnect previously related node if any
-                    to_disconnect = prop.filter(pk__ne=source.pk)
-                    for n in to_disconnect:
-                        disconnect(n, prop)
-                connect(node, prop)
-                node.recursive_connect(max_depth=max_depth - 1)
-
-            elif isinstance(source, Manager):
-                if not source.exists():
-                    to_disconnect = prop.filter(
-                        pk__in=list(source.model._meta.default_manager.exclude(pk__in=source.values('pk'))
-                                    .values_list('pk', flat=True)))
-                    for n in to_disconnect:
-                        disconnect(n, prop)
-                    continue
-
-                nodeset = klass.nodes.filter(pk__in=list(source.values_list('pk', flat=True)))
-                if len(nodeset) != source.count():
-                    existing = [n.pk for n in nodeset]
-                    for obj in source.exclude(pk__in=existing):
-                        node = get_node_for_object(obj, bind=False)
-                        if not node._is_ignored:
-                            node.save()
-                            logger.info('Created missing node %(node)r while synchronizing %(instance)r' % {
-                                'node': node,
-                                'instance': instance
-                            })
-                    nodeset = klass.nodes.filter(pk__in=list(source.values_list('pk', flat=True)))
-
-                for node in nodeset:
-                    connect(node, prop)
-                    node.recursive_connect(max_depth=max_depth - 1)
+        connect_relationships(self.__class__, [instance.pk], max_depth=max_depth, using=instance._state.db)
 
     def sync(self, max_depth=settings.MAX_CONNECTION_DEPTH, update_existing=True, create_empty=False):
         """
@@ -912,6 +892,7 @@ class ModelNodeMixin(ModelNodeMixinBase):
         self.full_clean(validate_unique=not update_existing)
 
         if update_existing:
+            node = None
             if not self._is_bound:
                 node = cls.nodes.get_or_none(**{'pk': self.pk})
                 if node:
@@ -925,8 +906,16 @@ class ModelNodeMixin(ModelNodeMixinBase):
                     setattr(self, key, value)
 
             # Make sure the neo4j node properties and relationships matches
-            # the class definition.
-            self.__update_raw_node__()
+            # the class definition, unless the node already has the current schema.
+            from chemtrails.conf import settings
+            if settings.CLEAN_NODES_ON_SYNC and (
+                    node is None or node._schema_fingerprint != cls.__schema_fingerprint__):
+                self.__update_raw_node__()
+            elif node is not None:
+                # The raw node has not been cleaned, so it keeps its fingerprint.
+                self._schema_fingerprint = node._schema_fingerprint
+            elif self._is_bound:
+                self._schema_fingerprint = self.get_raw_schema_fingerprint()
 
             # Finally save the node.
             self.save()
@@ -994,6 +983,9 @@ class MetaNodeMeta(NodeBase):
                     if relation:
                         cls.add_to_class('_%s' % related_name, relation)
 
+        cls.__schema_fingerprint__ = cls.get_schema_fingerprint()
+        cls._schema_fingerprint = StringProperty(default=cls.__schema_fingerprint__)
+
         # Recalculate definitions
         cls.__all_properties__ = tuple(cls.defined_properties(aliases=False, rels=False).items())
         cls.__all_aliases__ = tuple(cls.defined_properties(properties=False, rels=False).items())
@@ -1022,7 +1014,7 @@ class MetaNodeMixin(ModelNodeMixin):
             params = self.deflate(self.__properties__)
 
             # Remove any attributes we don't want to include in the MATCH query.
-            exclude = ('model_permisssions', 'is_intermediary')
+            exclude = ('model_permisssions', 'is_intermediary', '_schema_fingerprint')
             for attr in exclude:
                 if attr in params:
                     del params[attr]
@@ -1091,6 +1083,7 @@ class MetaNodeMixin(ModelNodeMixin):
             return None
 
         if update_existing:
+            node = None
             if not self._is_bound:
                 node = cls.nodes.get_or_none(**{'_app_label': self._app_label,
                                                 '_model_name': self._model_name})
@@ -1098,8 +1091,16 @@ class MetaNodeMixin(ModelNodeMixin):
                     self.id = node.id
 
             # Make sure the neo4j node properties and relationships matches
-            # the class definition.
-            self.__update_raw_node__()
+            # the class definition, unless the node already has the current schema.
+            from chemtrails.conf import settings
+            if settings.CLEAN_NODES_ON_SYNC and (
+                    node is None or node._schema_fingerprint != cls.__schema_fingerprint__):
+                self.__update_raw_node__()
+            elif node is not None:
+                # The raw node has not been cleaned, so it keeps its fingerprint.
+                self._schema_fingerprint = node._schema_fingerprint
+            elif self._is_bound:
+                self._schema_fingerprint = self.get_raw_schema_fingerprint()
 
             # Finally save the node
             self.save()
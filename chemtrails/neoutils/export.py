@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Export of querysets to CSV files for the offline ``neo4j-admin import`` tool.
+
+Nodes are written to one file per label, and relationships to one file per
+relationship type and pair of labels. Each file has a separate header file,
+so the data files can be compressed. Node properties and relationships are
+deflated the same way as when importing into a running server, so the
+resulting graph is identical.
+"""
+
+import csv
+import gzip
+import os
+from collections import OrderedDict
+
+from neomodel import ArrayProperty, BooleanProperty, DateTimeProperty, FloatProperty, IntegerProperty
+
+from chemtrails.neoutils.bulk import (
+    get_import_relationships, get_node_value_fields, get_relationship_properties
+)
+from chemtrails.utils import chunked
+
+ARRAY_DELIMITER = ';'
+
+PROPERTY_TYPES = (
+    (BooleanProperty, 'boolean'),
+    (IntegerProperty, 'long'),
+    (FloatProperty, 'double'),
+    (DateTimeProperty, 'double')
+)
+
+
+def get_csv_type(prop):
+    """
+    :param prop: ``Property`` instance.
+    :returns: The ``neo4j-admin import`` header type for values deflated by ``prop``.
+    """
+    if isinstance(prop, ArrayProperty):
+        return '%s[]' % (get_csv_type(prop.base_property) if prop.base_property else 'string')
+    for klass, csv_type in PROPERTY_TYPES:
+        if isinstance(prop, klass):
+            return csv_type
+    return 'string'
+
+
+def get_csv_value(value):
+    """
+    :returns: ``value`` formatted for ``neo4j-admin import``.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (list, tuple)):
+        return ARRAY_DELIMITER.join(str(get_csv_value(item)) for item in value if item is not None)
+    return value
+
+
+def format_csv_row(values):
+    """
+    Format a data row for ``neo4j-admin import``. Strings are always quoted, so an
+    empty string is written as ``""``, while None is written as an empty unquoted
+    field, which means the property is not set.
+    :param values: List of values returned by ``get_csv_value()``.
+    :returns: A line of comma separated fields.
+    """
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append('')
+        elif isinstance(value, (int, float)):
+            fields.append(repr(value))
+        else:
+            fields.append('"%s"' % str(value).replace('"', '""'))
+    return ','.join(fields) + '\n'
+
+
+def get_property_columns(properties):
+    """
+    :param properties: Dictionary mapping property names to ``Property`` instances.
+    :returns: List of (deflated property name, header) tuples.
+    """
+    columns = []
+    for key, prop in sorted(properties.items()):
+        name = prop.db_property or key
+        columns.append((name, '{name}:{type}'.format(name=name, type=get_csv_type(prop))))
+    return columns
+
+
+class AdminImportWriter(object):
+    """
+    Writes nodes and relationships to CSV files in ``directory``. Files are
+    opened when the first row is written to them, and must be closed by
+    calling ``close()``.
+    """
+    def __init__(self, directory, compress=False):
+        self.directory = directory
+        self.compress = compress
+        self.nodes = []
+        self.relationships = []
+        self._files = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_file(self, name, header, files):
+        """
+        :returns: The open data file ``name``, writing the header file and
+                  adding (header path, data path) to ``files`` the first time.
+        """
+        if name not in self._files:
+            header_path = os.path.join(self.directory, '%s_header.csv' % name)
+            data_path = os.path.join(self.directory, '%s.csv%s' % (name, '.gz' if self.compress else ''))
+
+            with open(header_path, 'w', newline='') as f:
+                csv.writer(f).writerow(header)
+
+            f = gzip.open(data_path, 'wt', newline='') if self.compress else open(data_path, 'w', newline='')
+            self._files[name] = f
+            files.append((header_path, data_path))
+        return self._files[name]
+
+    def write_nodes(self, klass, rows):
+        """
+        :param klass: ``ModelNode`` class.
+        :param rows: List of dictionaries with deflated node properties.
+        """
+        columns = get_property_columns(klass.defined_properties(aliases=False, rels=False))
+        header = [':ID({label})'.format(label=klass.__label__)] + [header for _, header in columns] + [':LABEL']
+        f = self.get_file('nodes_%s' % klass.__label__, header, self.nodes)
+
+        labels = ARRAY_DELIMITER.join(OrderedDict.fromkeys(klass.inherited_labels()))
+        for row in rows:
+            f.write(format_csv_row([row['pk']] + [get_csv_value(row.get(name)) for name, _ in columns] + [labels]))
+
+    def write_relationships(self, klass, relation, target, pairs, generic=False):
+        """
+        :param klass: ``ModelNode`` class.
+        :param relation: ``RelationshipDefinition`` on ``klass``.
+        :param target: ``ModelNode`` class on the other end of the relationship.
+        :param pairs: Iterable of deflated (source pk, target pk) pairs.
+        :param generic: True if ``relation`` represents a ``GenericForeignKey``.
+        """
+        relation_type = relation.definition['relation_type']
+        columns = get_property_columns(relation.definition['model'].defined_properties(aliases=False, rels=False))
+        header = ([':START_ID({label})'.format(label=klass.__label__), ':END_ID({label})'.format(label=target.__label__)]
+                  + [header for _, header in columns] + [':TYPE'])
+        f = self.get_file('relationships_%s_%s_%s' % (relation_type, klass.__label__, target.__label__),
+                          header, self.relationships)
+
+        properties = get_relationship_properties(relation, target if generic else None)
+        values = [get_csv_value(properties.get(name)) for name, _ in columns] + [relation_type]
+        for pk, related_pk in pairs:
+            f.write(format_csv_row([pk, related_pk] + values))
+
+    def get_import_arguments(self):
+        """
+        :returns: List of ``--nodes`` and ``--relationships`` arguments for ``neo4j-admin import``.
+        """
+        return (['--nodes=%s' % ','.join(files) for files in self.nodes] +
+                ['--relationships=%s' % ','.join(files) for files in self.relationships])
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+
+def export_nodes(writer, queryset, chunk_size=None):
+    """
+    Write nodes for all objects in ``queryset`` using ``writer``. Rows are
+    streamed in primary key order using ``QuerySet.values()``.
+    :param writer: ``AdminImportWriter`` instance.
+    :param queryset: Django ``QuerySet`` instance.
+    :param chunk_size: Number of rows to read at a time.
+                       Defaults to ``settings.SYNC_CHUNK_SIZE``.
+    :returns: A generator yielding the number of written nodes and the last
+              primary key for each chunk.
+    """
+    from chemtrails.conf import settings
+    from chemtrails.neoutils import get_node_class_for_model
+
+    chunk_size = chunk_size or settings.SYNC_CHUNK_SIZE
+    klass = get_node_class_for_model(queryset.model)
+
+    rows = queryset.order_by('pk').values(*get_node_value_fields(klass)).iterator()
+    for chunk in chunked(rows, chunk_size):
+        writer.write_nodes(klass, [klass.deflate(row) for row in chunk])
+        yield len(chunk), chunk[-1]['pk']
+
+
+def export_relationships(writer, queryset, chunk_size=None, exported_models=()):
+    """
+    Write relationships, and their reverse relationships, for all objects in
+    ``queryset`` using ``writer``. The relationships are the same as the ones
+    written by ``chemtrails.neoutils.bulk.import_relationships()``, except that
+    relationships to models which are not exported are left out, since
+    ``neo4j-admin import`` rejects relationships to nodes it does not know of.
+    :param writer: ``AdminImportWriter`` instance.
+    :param queryset: Django ``QuerySet`` instance.
+    :param chunk_size: Number of objects to process in each chunk.
+                       Defaults to ``settings.SYNC_CHUNK_SIZE``.
+    :param exported_models: Models which relationships are exported as well.
+    :returns: A generator yielding the number of written relationships and the
+              last primary key for each chunk.
+    """
+    from chemtrails.conf import settings
+    from chemtrails.neoutils import get_node_class_for_model
+
+    chunk_size = chunk_size or settings.SYNC_CHUNK_SIZE
+    klass = get_node_class_for_model(queryset.model)
+    concrete_models = set(model._meta.concrete_model for model in exported_models)
+
+    for pks in chunked(queryset.order_by('pk').values_list('pk', flat=True).iterator(), chunk_size):
+        count = 0
+        for relation, target, pairs, reverse, generic in get_import_relationships(
+                klass, pks, using=queryset.db, imported_models=exported_models):
+            if target.Meta.model not in concrete_models:
+                continue
+            writer.write_relationships(klass, relation, target, pairs, generic=generic)
+            count += len(pairs)
+            if reverse is not None:
+                writer.write_relationships(target, reverse, klass, [(b, a) for a, b in pairs])
+                count += len(pairs)
+        yield count, pks[-1]
@@ -2,6 +2,7 @@
 
 import re
 import inspect
+from collections import OrderedDict
 
 from django.contrib.contenttypes.fields import GenericForeignKey
 from neomodel.match import Traversal
@@ -95,79 +96,97 @@ class PathManager:
     def statement(self):
         """
         :returns: The final calculated relationship statement or None if no
-                  relation types has been added.
+                  relation types has been added. All filter values are referenced
+                  as parameters, which can be found in ``params``.
         :rtype: None or str
         """
+        statement, _ = self.compile()
+        return statement
+
+    @property
+    def params(self):
+        """
+        :returns: Parameters for the calculated relationship statement.
+        :rtype: dict
+        """
+        _, params = self.compile()
+        return params
+
+    def compile(self):
+        """
+        Calculate the relationship statement and its parameters. Parameter names
+        only depends on the position and property key, so paths with the same
+        shape always produces identical statements, which allows Neo4j to reuse
+        the query plan.
+        :returns: Two tuple with the statement, or None if no relation types has
+                  been added, and a dictionary of parameters.
+        :rtype: tuple(str or None, dict)
+        """
+        params = {}
         if not self._statements:
-            return None
+            return None, params
 
-        def format_node(ident, label, **filters):
+        def format_node(ident, label, prefix, filters):
             separator = ': ' if label else ''
             if not label and not filters:
                 return '{0}'.format(ident)
             elif not filters:
                 return '{0}: {1}'.format(ident, label)
             else:
+                params.update({'{0}_{1}'.format(prefix, key): value for key, value in filters.items()})
                 label = '{0} {{{1}}}'.format(
-                    label if label else '', ', '.join(['{}: {}'.format(
-                        key, '"%s"' % value if isinstance(value, str) else value)
-                        for key, value in filters.items()])
+                    label if label else '', ', '.join(['{0}: ${1}_{0}'.format(key, prefix)
+                                                       for key in sorted(filters.keys())])
                 )
                 return '{0}{1}{2}'.format(ident, separator, label)
 
-        # Matches ie. (source1: UserNode {...}) as long as it's followed
-        # by a "-[" or "<-[" which indicates the beginning of a relationship.
-        pattern = re.compile(r'^(\(source\d+:.\w+(.{\w+:.[A-Za-z0-9\'"_]+})?\)(?=<?-\[))')
-
         statements = []
         for n, config in enumerate(self._statements):
-            # Replace placeholders with actual values.
-            defaults = config['relation_props'].copy()
-
             # Check if we should override direction
             if self.direction is not None:
                 assert self.direction in (INCOMING, EITHER, OUTGOING), (
                     'Direction must be one of %s.' % ', '.join((INCOMING, EITHER, OUTGOING)))
                 config['traversal'].definition['direction'] = self.direction
 
+            relation_props = config['relation_props']
+            params.update({'rel{0}_{1}'.format(n, key): value for key, value in relation_props.items()})
             atom = build_relation_string(lhs='{source}', rhs='{target}',
-                                         props={key: '{{{0}}}'.format(key) for key in defaults.keys()},
+                                         props=OrderedDict((key, '$rel{0}_{1}'.format(n, key))
+                                                           for key in sorted(relation_props.keys())),
                                          **config['traversal'].definition)
 
+            target = 'target{0}'.format(format_node(
+                ident=config.get('target_index', n),
+                label=(config['target_class'].__label__
+                       if config['target_class'] else None),
+                prefix='target{0}'.format(n),
+                # Add any user specified filters to target node.
+                filters=self.resolve_filters(config['target_props'])
+            ))
+
+            if n > 0:
+                # Leave out the source node definition from the string.
+                # It's already specified in the previous element.
+                source = 'source{0}'.format(n)
+                statements.append(atom.format(source=source, target=target)[len(source) + 2:])
+                continue
+
             source_props = self.resolve_filters(config['source_props'])
             if not inspect.isclass(config['source_class']):
                 # If we have a node instance, always match its primary key!
                 if getattr(config['source_class'], 'pk', None):
                     source_props['pk'] = config['source_class'].pk
 
-            target_props = self.resolve_filters(config['target_props'])
-
-            defaults.update({
-                'source': 'source{0}'.format(format_node(
-                    ident=n,
-                    label=(config['source_class'].__label__
-                           if config['source_class'] else None),
-                    **source_props
-                )),
-                'target': 'target{0}'.format(format_node(
-                    ident=config.get('target_index', n),
-                    label=(config['target_class'].__label__
-                           if config['target_class'] else None),
-                    # Add any user specified filters to target node.
-                    **target_props
-                ))
-            })
-
-            relation_str = atom.format(**defaults)
-            if n == 0:
-                statements.append(relation_str)
-                continue
-
-            # Remove the source node definition from string.
-            # It's already specified in the previous element.
-            statements.append(pattern.sub('', relation_str))
+            source = 'source{0}'.format(format_node(
+                ident=n,
+                label=(config['source_class'].__label__
+                       if config['source_class'] else None),
+                prefix='source{0}'.format(n),
+                filters=source_props
+            ))
+            statements.append(atom.format(source=source, target=target))
 
-        return ''.join(statements)
+        return ''.join(statements), params
 
     def add(self, relation_type=None, relation_props=None, source_props=None, target_props=None):
         """
@@ -214,8 +233,7 @@ class PathManager:
         # Instantiate a fake relationship model in order
         # to pick attributes for the relationship.
         fake = model(**relation_props)
-        relation_props = {prop: '"%s"' % value if isinstance(value, str) else value
-                          for prop, value in model.deflate(fake.__properties__).items()}
+        relation_props = model.deflate(fake.__properties__)
 
         # At this point we have no idea of what object the GenericForeignKey
         # relationship is really pointing at.
@@ -248,7 +266,8 @@ class PathManager:
     
     def get_path(self):
         """
-        :returns: The calculated statement as MATCH path = (...) RETURN path
+        :returns: The calculated statement as MATCH path = (...) RETURN path.
+                  Parameters for the statement can be found in ``params``.
         :rtype str
         """
         if not self.statement:
@@ -287,10 +306,7 @@ class PathManager:
                                              "Make sure the '%(value)s' targets a valid attribute." % {
                                                  'node': self.source, 'key': key, 'value': value
                                              })
-                    value = getattr(self.source, key)
-                    if value is None:
-                        value = 'null'
-                    filters[attr] = value
+                    filters[attr] = getattr(self.source, key)
             except TypeError:
                 # This can happen if trying to re-process an already processed filter.
                 continue
@@ -40,7 +40,7 @@ def get_node_relationship_types(params=None):
     mapping = defaultdict(list)
     query = ' '.join(('MATCH (n)-[r]-()',
                       'WHERE' if params else '',
-                      ' AND '.join(['n.{} = {{{}}}'.format(key, key) for key in params.keys()]) if params else '',
+                      ' AND '.join(['n.{0} = ${0}'.format(key) for key in sorted(params.keys())]) if params else '',
                       'RETURN DISTINCT labels(n), type(r)'))
     validate_cypher(query, raise_exception=True)
     result, _ = db.cypher_query(query, params)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+__all__ = [
+    'bump_graph_version',
+    'bump_version',
+    'get_cache',
+    'get_graph_version',
+    'get_version',
+    'is_shared_cache'
+]
+
+GRAPH_VERSION_KEY = 'chemtrails:graph_version'
+
+
+def get_cache():
+    """
+    :returns: The Django cache configured by the ``CACHE_ALIAS`` setting, or None.
+    """
+    from chemtrails.conf import settings
+    return caches[settings.CACHE_ALIAS] if settings.CACHE_ALIAS else None
+
+
+def is_shared_cache():
+    """
+    :returns: True if the cache configured by the ``CACHE_ALIAS`` setting is shared
+      between processes. Version counters stored in a process local cache, like the
+      local-memory cache, never see changes made by other processes.
+    """
+    cache = get_cache()
+    return cache is not None and not isinstance(cache, (DummyCache, LocMemCache))
+
+
+def get_initial_version():
+    # Start at the current time, so a version counter which has been evicted
+    # from the cache never restarts at a previously used version.
+    return int(time.time() * 1000000)
+
+
+def get_version(key):
+    """
+    :returns: The current value of the version counter stored at ``key``, or None
+      if no cache is configured.
+    :rtype: int or None
+    """
+    cache = get_cache()
+    if cache is None:
+        return None
+
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, get_initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key):
+    """
+    Increment the version counter stored at ``key``.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, get_initial_version(), timeout=None)
+
+
+def get_graph_version():
+    """
+    :returns: The current graph version, or None if no cache is configured.
+      The version changes every time the graph is written to by chemtrails,
+      which makes it suitable for versioning cached values derived from the graph.
+    :rtype: int or None
+    """
+    return get_version(GRAPH_VERSION_KEY)
+
+
+def bump_graph_version():
+    """
+    Increment the graph version, invalidating all values cached for previous versions.
+    The graph version is only used for caching permission decisions, so nothing
+    is written to the cache unless ``CACHE_PERMISSIONS`` is enabled.
+    """
+    from chemtrails.conf import settings
+    if settings.CACHE_PERMISSIONS:
+        bump_version(GRAPH_VERSION_KEY)
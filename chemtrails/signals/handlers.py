@@ -5,9 +5,10 @@ from neomodel import install_labels
 
 from chemtrails.conf import settings
 from chemtrails.neoutils import (
-    get_meta_node_for_model, get_meta_node_class_for_model,
+    bump_graph_version, get_meta_node_for_model, get_meta_node_class_for_model,
     get_node_for_object, get_node_class_for_model, get_nodeset_for_queryset
 )
+from chemtrails.signals.queue import queue_objects
 
 
 def post_migrate_handler(sender, **kwargs):
@@ -27,7 +28,11 @@ def post_save_handler(sender, instance, **kwargs):
     Sync the node instance after it has been saved.
     """
     if settings.ENABLED:
+        if queue_objects(instance._meta.model, instance.pk, using=kwargs.get('using')):
+            return
+
         get_node_for_object(instance, bind=False).sync(max_depth=settings.MAX_CONNECTION_DEPTH, update_existing=True)
+        bump_graph_version()
 
 
 def pre_delete_handler(sender, instance, **kwargs):
@@ -35,10 +40,16 @@ def pre_delete_handler(sender, instance, **kwargs):
     Delete the node from the graph before it is removed from the database.
     """
     if settings.ENABLED:
+        # The object is gone from the database once the transaction
+        # commits, which will cause the queued node to be deleted.
+        if queue_objects(instance._meta.model, instance.pk, using=kwargs.get('using')):
+            return
+
         klass = get_node_class_for_model(instance._meta.model)
         node = klass.nodes.get_or_none(**{'pk': instance.pk})
         if node:
             node.delete()
+            bump_graph_version()
 
 
 def m2m_changed_handler(sender, instance, action, reverse, model, pk_set, **kwargs):
@@ -49,6 +60,12 @@ def m2m_changed_handler(sender, instance, action, reverse, model, pk_set, **kwar
         if action not in ('post_add', 'post_remove', 'post_clear'):
             return
 
+        if action == 'post_clear':
+            if queue_objects(instance._meta.model, instance.pk, using=kwargs.get('using')):
+                return
+        elif queue_objects(model, *pk_set, using=kwargs.get('using')):
+            return
+
         if action == 'post_add':
             get_nodeset_for_queryset(model.objects.filter(pk__in=pk_set), sync=True,
                                      max_depth=settings.MAX_CONNECTION_DEPTH)
@@ -57,3 +74,4 @@ def m2m_changed_handler(sender, instance, action, reverse, model, pk_set, **kwar
                                      max_depth=settings.MAX_CONNECTION_DEPTH)
         elif action == 'post_clear':
             get_node_for_object(instance, bind=False).sync(max_depth=settings.MAX_CONNECTION_DEPTH, update_existing=True)
+        bump_graph_version()
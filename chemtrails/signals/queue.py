@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import logging
+import threading
+from collections import OrderedDict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from chemtrails.neoutils import bulk_sync, bump_graph_version, get_node_class_for_model
+from chemtrails.utils import is_internal_model
+
+logger = logging.getLogger(__name__)
+
+SYNC_MODE_INLINE = 'inline'
+SYNC_MODE_DEFERRED = 'deferred'
+SYNC_MODE_OUTBOX = 'outbox'
+
+
+def get_sync_mode():
+    """
+    :returns: The currently configured ``SYNC_MODE`` setting.
+    """
+    from chemtrails.conf import settings
+    return settings.SYNC_MODE
+
+
+def queue_objects(model, *pks, using=None):
+    """
+    Queue ``model`` objects for synchronization according to the
+    ``SYNC_MODE`` setting.
+    :param model: Django model class.
+    :param pks: Primary keys for the objects to synchronize.
+    :param using: Database alias.
+    :returns: False if the objects should be synchronized inline, else True.
+    """
+    if is_internal_model(model):
+        return True
+
+    mode = get_sync_mode()
+    if mode == SYNC_MODE_DEFERRED:
+        sync_queue.enqueue(model, *pks, using=using)
+        return True
+    elif mode == SYNC_MODE_OUTBOX:
+        write_outbox(model, *pks, using=using)
+        return True
+    return False
+
+
+def write_outbox(model, *pks, using=None):
+    """
+    Write ``model`` objects to the outbox table using the same database
+    connection, and thereby the same transaction, as the change itself.
+    :param model: Django model class.
+    :param pks: Primary keys for the objects to synchronize.
+    :param using: Database alias.
+    """
+    from chemtrails.models import OutboxEntry
+
+    using = using or DEFAULT_DB_ALIAS
+    model = model._meta.concrete_model
+    if get_node_class_for_model(model)._is_ignored:
+        return
+
+    content_type = ContentType.objects.db_manager(using).get_for_model(model)
+    OutboxEntry.objects.using(using).bulk_create([
+        OutboxEntry(content_type=content_type, object_pk=str(pk)) for pk in pks
+    ])
+
+
+def sync_objects(model, pks, using=DEFAULT_DB_ALIAS, max_depth=None):
+    """
+    Synchronize nodes for ``model`` objects with data from the database.
+    Nodes for objects which no longer exists in the database are removed
+    from the graph.
+    :param model: Django model class.
+    :param pks: Sequence of primary keys to synchronize.
+    :param using: Database alias to read objects from.
+    :param max_depth: Maximum depth of recursive connections to be made.
+                      Defaults to ``settings.MAX_CONNECTION_DEPTH``.
+    :returns: None
+    """
+    from chemtrails.conf import settings
+    if max_depth is None:
+        max_depth = settings.MAX_CONNECTION_DEPTH
+
+    pks = set(model._meta.pk.to_python(pk) for pk in pks)
+    queryset = model._base_manager.using(using).filter(pk__in=pks)
+    pks.difference_update(queryset.values_list('pk', flat=True))
+    bulk_sync(queryset, max_depth=max_depth, update_existing=True)
+
+    if pks:
+        for node in get_node_class_for_model(model).nodes.filter(pk__in=list(pks)):
+            node.delete()
+    bump_graph_version()
+
+
+class SyncQueue:
+    """
+    Transaction aware queue which collects (model, pk) pairs and synchronizes
+    them with the graph when the surrounding transaction commits.
+
+    Objects queued several times within the same transaction are only synced
+    once, and objects queued in a transaction which is rolled back never
+    reaches the graph.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    def _get_state(self, using):
+        if not hasattr(self._local, 'states'):
+            self._local.states = {}
+        if using not in self._local.states:
+            self._local.states[using] = {'pending': OrderedDict(), 'callback': None}
+        return self._local.states[using]
+
+    def enqueue(self, model, *pks, using=None):
+        """
+        Queue ``model`` objects for synchronization on transaction commit.
+        If not inside an atomic block, the objects are synced immediately.
+        :param model: Django model class.
+        :param pks: Primary keys for the objects to synchronize.
+        :param using: Database alias.
+        """
+        using = using or DEFAULT_DB_ALIAS
+        state = self._get_state(using)
+
+        # If the registered callback is gone from the connection, the transaction
+        # which queued the pending objects has been rolled back.
+        callback = state['callback']
+        if callback is not None and not any(func is callback for _, func in connections[using].run_on_commit):
+            state['pending'].clear()
+            state['callback'] = None
+
+        model = model._meta.concrete_model
+        for pk in pks:
+            state['pending'][(model, pk)] = None
+
+        if state['callback'] is None:
+            state['callback'] = functools.partial(self.flush, using=using)
+            transaction.on_commit(state['callback'], using=using)
+
+    def flush(self, using=None):
+        """
+        Synchronize all pending objects with the graph.
+        :param using: Database alias.
+        """
+        using = using or DEFAULT_DB_ALIAS
+        state = self._get_state(using)
+        pending = state['pending']
+        state['pending'], state['callback'] = OrderedDict(), None
+
+        grouped = OrderedDict()
+        for model, pk in pending.keys():
+            grouped.setdefault(model, []).append(pk)
+
+        for model, pks in grouped.items():
+            try:
+                sync_objects(model, pks, using=using)
+            except Exception:
+                logger.exception('Failed to synchronize %(count)d %(model)s object(s) with the graph.' % {
+                    'count': len(pks),
+                    'model': model._meta.label
+                })
+
+    def pending(self, using=None):
+        """
+        :returns: A list of (model, pk) pairs waiting to be synchronized.
+        """
+        return list(self._get_state(using or DEFAULT_DB_ALIAS)['pending'].keys())
+
+    def clear(self, using=None):
+        """
+        Discard all pending objects without synchronizing them.
+        :param using: Database alias.
+        """
+        state = self._get_state(using or DEFAULT_DB_ALIAS)
+        state['pending'].clear()
+        state['callback'] = None
+
+
+sync_queue = SyncQueue()
@@ -2,6 +2,7 @@
 
 import ast
 import functools
+import itertools
 import logging
 import os
 import time
@@ -18,6 +19,15 @@ def get_model_string(model):
     return "{app_label}.{model_name}".format(app_label=model._meta.app_label, model_name=model._meta.model_name)
 
 
+def is_internal_model(model):
+    """
+    :param model: model
+    :returns: True if ``model`` is one of the bookkeeping models of chemtrails
+              itself, which are never mirrored to the graph.
+    """
+    return model._meta.app_label == 'chemtrails'
+
+
 def flatten(sequence):
     """
     Flatten an arbitrary nested sequence.
@@ -33,6 +43,23 @@ def flatten(sequence):
             yield i
 
 
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most ``size`` items.
+    Example usage:
+      >> for chunk in chunked(queryset.iterator(), 500):
+    :param iterable: Any iterable, such as a generator.
+    :param size: Maximum number of items in each chunk.
+    :returns: A generator yielding lists of items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def timeit(func):
     """
     Decorator which logs the timing of executing a function
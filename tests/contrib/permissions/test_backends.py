@@ -195,3 +195,17 @@ class ChemoPermissionsBackendTestCase(TestCase):
         self.assertTrue(user.has_perm('testapp.add_store', store))
         self.assertTrue(user.has_perm('testapp.change_store', store))
         self.assertFalse(user.has_perm('testapp.delete_store', store))
+
+    def test_checker_is_reused_for_user_object(self):
+        user = User.objects.create_user(username='testuser', password='test123.')
+        group = Group.objects.create(name='group')
+        user.user_permissions.add(Permission.objects.get(content_type__app_label='auth', codename='add_group'))
+
+        backend = ChemoPermissionsBackend()
+        self.assertEqual({'add_group'}, set(backend.get_all_permissions(user, group)))
+        with self.assertNumQueries(0):
+            self.assertEqual({'add_group'}, set(backend.get_all_permissions(user, group)))
+
+        # Changing the user permissions removes the attached checker.
+        user.user_permissions.add(Permission.objects.get(content_type__app_label='auth', codename='change_group'))
+        self.assertEqual({'add_group', 'change_group'}, set(backend.get_all_permissions(user, group)))
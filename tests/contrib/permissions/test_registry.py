@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase, override_settings
+
+from chemtrails.contrib.permissions.checks import check_cache_alias
+
+from chemtrails.contrib.permissions.models import AccessRule
+from chemtrails.contrib.permissions.registry import access_rule_registry, permission_registry
+from chemtrails.contrib.permissions.utils import check_permissions_app_label, get_access_rules, get_content_type
+
+User = get_user_model()
+
+
+class SharedCacheMixin:
+    """
+    Enable the registries, using a cache which is shared between processes,
+    which the registries requires in order to keep access rules between calls.
+    """
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        override = self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory
+        }}, CHEMTRAILS={'CACHE_REGISTRIES': True})
+        override.enable()
+        self.addCleanup(override.disable)
+        super(SharedCacheMixin, self).setUp()
+
+
+class AccessRuleRegistryTestCase(SharedCacheMixin, TestCase):
+    """
+    Testing ``chemtrails.contrib.permissions.registry.AccessRuleRegistry``.
+    """
+    def setUp(self):
+        super(AccessRuleRegistryTestCase, self).setUp()
+        access_rule_registry.invalidate()
+        self.user_ctype, self.group_ctype = get_content_type(User), get_content_type(Group)
+        self.perm_add = Permission.objects.get(content_type__app_label='auth', codename='add_group')
+        self.perm_change = Permission.objects.get(content_type__app_label='auth', codename='change_group')
+
+        self.access_rule = AccessRule.objects.create(ctype_source=self.user_ctype, ctype_target=self.group_ctype,
+                                                     relation_types=[{'GROUPS': None}])
+        self.access_rule.permissions.add(self.perm_add)
+
+    def test_get_rules(self):
+        rules = access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+        self.assertEqual([rule.pk for rule in rules], [self.access_rule.pk])
+        self.assertEqual(rules[0].codenames, {'add_group'})
+        self.assertEqual(access_rule_registry.get_rules(self.group_ctype, self.user_ctype), [])
+
+    def test_get_rules_is_cached(self):
+        access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+        with self.assertNumQueries(0):
+            access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+            get_access_rules(self.user_ctype, self.group_ctype, ['add_group'])
+
+    def test_reload_on_save(self):
+        access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+        self.access_rule.is_active = False
+        self.access_rule.save()
+        self.assertEqual(access_rule_registry.get_rules(self.user_ctype, self.group_ctype), [])
+
+    def test_reload_on_delete(self):
+        access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+        self.access_rule.delete()
+        self.assertEqual(access_rule_registry.get_rules(self.user_ctype, self.group_ctype), [])
+
+    def test_reload_on_permissions_changed(self):
+        access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+        self.access_rule.permissions.add(self.perm_change)
+        rules = access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+        self.assertEqual(rules[0].codenames, {'add_group', 'change_group'})
+
+        self.perm_add.accessrule_permissions.clear()
+        rules = access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+        self.assertEqual(rules[0].codenames, {'change_group'})
+
+    def test_get_access_rules(self):
+        self.access_rule.permissions.add(self.perm_change)
+        other = AccessRule.objects.create(ctype_source=self.user_ctype, ctype_target=self.group_ctype,
+                                          relation_types=[{'GROUPS': None}])
+        other.permissions.add(self.perm_add)
+
+        pks = lambda codenames: {rule.pk for rule in get_access_rules(self.user_ctype, self.group_ctype, codenames)}
+        self.assertEqual(pks(['add_group']), {self.access_rule.pk, other.pk})
+        self.assertEqual(pks(['change_group']), {self.access_rule.pk})
+        # Rules having fewer permissions than requested are not considered.
+        self.assertEqual(pks(['add_group', 'change_group']), {self.access_rule.pk})
+        self.assertEqual(pks(['delete_group']), set())
+
+    def test_process_local_cache(self):
+        access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+
+        # Without a shared cache, changes made by other processes must be picked up
+        # as well, so the access rules are read from the database every time.
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            AccessRule.objects.filter(pk=self.access_rule.pk).update(is_active=False)
+            self.assertEqual(access_rule_registry.get_rules(self.user_ctype, self.group_ctype), [])
+
+    def test_registry_disabled(self):
+        access_rule_registry.get_rules(self.user_ctype, self.group_ctype)
+        with self.settings(CHEMTRAILS={'CACHE_REGISTRIES': False}):
+            AccessRule.objects.filter(pk=self.access_rule.pk).update(is_active=False)
+            self.assertEqual(access_rule_registry.get_rules(self.user_ctype, self.group_ctype), [])
+
+
+class PermissionRegistryTestCase(SharedCacheMixin, TestCase):
+    """
+    Testing ``chemtrails.contrib.permissions.registry.PermissionRegistry``.
+    """
+    def setUp(self):
+        super(PermissionRegistryTestCase, self).setUp()
+        permission_registry.invalidate()
+
+    def test_get_content_type(self):
+        self.assertEqual(permission_registry.get_content_type('auth', 'add_group'), get_content_type(Group))
+        self.assertRaises(ContentType.DoesNotExist, permission_registry.get_content_type, 'auth', 'invalid')
+
+    def test_get_content_type_is_cached(self):
+        permission_registry.get_content_type('auth', 'add_group')
+        with self.assertNumQueries(0):
+            result = check_permissions_app_label(['auth.add_user', 'auth.change_user'])
+        self.assertEqual(result, (get_content_type(User), {'add_user', 'change_user'}))
+
+    def test_reload_on_permission_changed(self):
+        permission_registry.get_content_type('auth', 'add_group')
+        self.assertIsNotNone(permission_registry._ctypes)
+
+        perm = Permission.objects.create(content_type=get_content_type(Group), codename='archive_group',
+                                         name='Can archive group')
+        self.assertIsNone(permission_registry._ctypes)
+        self.assertEqual(permission_registry.get_content_type('auth', 'archive_group'), get_content_type(Group))
+
+        perm.delete()
+        self.assertIsNone(permission_registry._ctypes)
+
+    def test_process_local_cache(self):
+        permission_registry.get_content_type('auth', 'add_group')
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with self.assertNumQueries(1):
+                permission_registry.get_content_type('auth', 'add_group')
+
+    def test_registry_disabled(self):
+        permission_registry.get_content_type('auth', 'add_group')
+        with self.settings(CHEMTRAILS={'CACHE_REGISTRIES': False}):
+            with self.assertNumQueries(1):
+                permission_registry.get_content_type('auth', 'add_group')
+
+
+class CacheAliasCheckTestCase(TestCase):
+    """
+    Testing ``chemtrails.contrib.permissions.checks.check_cache_alias``.
+    """
+    SHARED_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                 'LOCATION': os.path.join(tempfile.gettempdir(), 'chemtrails')}}
+
+    def test_default_settings(self):
+        self.assertEqual(check_cache_alias(None), [])
+
+    def test_process_local_cache(self):
+        with self.settings(CHEMTRAILS={'CACHE_REGISTRIES': True}):
+            self.assertEqual([error.id for error in check_cache_alias(None)], ['chemtrails_permissions.E001'])
+        with self.settings(CHEMTRAILS={'CACHE_PERMISSIONS': True}):
+            self.assertEqual([error.id for error in check_cache_alias(None)], ['chemtrails_permissions.E002'])
+
+    @override_settings(CHEMTRAILS={'CACHE_ALIAS': None, 'CACHE_REGISTRIES': True})
+    def test_no_cache(self):
+        self.assertEqual(check_cache_alias(None), [])
+
+    @override_settings(CACHES=SHARED_CACHES, CHEMTRAILS={'CACHE_REGISTRIES': True, 'CACHE_PERMISSIONS': True})
+    def test_shared_cache(self):
+        self.assertEqual(check_cache_alias(None), [])
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.test import TestCase, override_settings
+
+from chemtrails.contrib.permissions import rules
+from chemtrails.contrib.permissions.models import AccessRule
+from chemtrails.contrib.permissions.utils import get_content_type
+from chemtrails.neoutils import get_node_for_object
+from tests.utils import flush_nodes
+
+User = get_user_model()
+
+
+class CompiledRuleTestCase(TestCase):
+    """
+    Testing ``chemtrails.contrib.permissions.rules``.
+    """
+    def setUp(self):
+        rules.__rule_cache__.clear()
+        access_rule = AccessRule.objects.create(ctype_source=get_content_type(User),
+                                                ctype_target=get_content_type(Group),
+                                                requires_staff=True,
+                                                relation_types=[{'GROUPS': {'name': '{source}.username'}}])
+        self.access_rule = AccessRule.objects.get(pk=access_rule.pk)
+
+    def update_access_rule(self, relation_types):
+        self.access_rule.relation_types = relation_types
+        self.access_rule.save()
+        self.access_rule = AccessRule.objects.get(pk=self.access_rule.pk)
+
+    def test_compile_access_rule_bind_source(self):
+        rule = rules.compile_access_rule(self.access_rule)
+        self.assertTrue(rule.statement.startswith('(source0: UserNode {is_staff: $source0_is_staff, pk: $source0_pk})'))
+        self.assertTrue(rule.statement.endswith('(target0: GroupNode {name: $target0_name})'))
+        self.assertEqual(rule.source_slots, {'source0_pk': 'pk', 'target0_name': 'username'})
+        self.assertEqual(rule.target_slots, {})
+
+    def test_compile_access_rule_bind_target(self):
+        rule = rules.compile_access_rule(self.access_rule, bind_source=False, bind_target=True)
+        self.assertTrue(rule.statement.startswith('(source0: UserNode {is_staff: $source0_is_staff})'))
+        self.assertTrue(rule.statement.endswith('(target0: GroupNode {pk: $target0_pk})'))
+        self.assertEqual(rule.source_slots, {})
+        self.assertEqual(rule.target_slots, {'target0_pk': 'pk'})
+
+    def test_get_query(self):
+        rule = rules.compile_access_rule(self.access_rule)
+        self.assertTrue(rule.get_query().endswith('WHERE target0:GroupNode RETURN DISTINCT target0.pk AS pk;'))
+
+        rule = rules.compile_access_rule(self.access_rule, bind_source=False, bind_target=True)
+        self.assertTrue(rule.get_query().endswith('WHERE source0:UserNode RETURN DISTINCT source0.pk AS pk;'))
+
+    def test_get_exists_query(self):
+        rule = rules.compile_access_rule(self.access_rule, bind_target=True)
+        self.assertIn('{is_staff: $source0_is_staff, pk: $source0_pk}', rule.statement)
+        self.assertTrue(rule.get_exists_query().endswith('(target0: GroupNode {name: $target0_name, pk: $target0_pk}) '
+                                                         'WHERE target0:GroupNode RETURN true LIMIT 1;'))
+        self.assertEqual(rule.source_slots, {'source0_pk': 'pk', 'target0_name': 'username'})
+        self.assertEqual(rule.target_slots, {'target0_pk': 'pk'})
+
+    def test_compile_access_rule_invalid_source_attribute(self):
+        self.update_access_rule([{'GROUPS': {'name': '{source}.invalid'}}])
+        self.assertRaises(AttributeError, rules.compile_access_rule, self.access_rule)
+
+    @flush_nodes()
+    def test_get_params(self):
+        user = User.objects.create_user(username='testuser', password='test123.')
+        group = Group.objects.create(name='testuser')
+
+        rule = rules.compile_access_rule(self.access_rule)
+        params = rule.get_params(source=get_node_for_object(user))
+        self.assertEqual(params['source0_pk'], user.pk)
+        self.assertEqual(params['source0_is_staff'], True)
+        self.assertEqual(params['target0_name'], 'testuser')
+
+        rule = rules.compile_access_rule(self.access_rule, bind_source=False, bind_target=True)
+        self.assertEqual(rule.get_params(target=get_node_for_object(group))['target0_pk'], group.pk)
+
+    def test_get_compiled_rule_is_cached(self):
+        rule = rules.get_compiled_rule(self.access_rule)
+        self.assertIs(rules.get_compiled_rule(self.access_rule), rule)
+        self.assertIsNot(rules.get_compiled_rule(self.access_rule, bind_source=False, bind_target=True), rule)
+
+        # The shared cache is used when the process cache is empty.
+        rules.__rule_cache__.clear()
+        self.assertEqual(rules.get_compiled_rule(self.access_rule).statement, rule.statement)
+
+    @override_settings(CHEMTRAILS={'CACHE_ALIAS': None})
+    def test_get_compiled_rule_without_shared_cache(self):
+        rule = rules.get_compiled_rule(self.access_rule)
+        self.assertIs(rules.get_compiled_rule(self.access_rule), rule)
+
+    def test_invalidate_on_save(self):
+        rule = rules.get_compiled_rule(self.access_rule)
+
+        self.update_access_rule([{'GROUPS': None}])
+        self.assertNotIn((self.access_rule.pk, True, False), rules.__rule_cache__)
+        self.assertNotEqual(rules.get_compiled_rule(self.access_rule).statement, rule.statement)
+
+    def test_invalidate_on_delete(self):
+        pk = self.access_rule.pk
+        rules.get_compiled_rule(self.access_rule)
+        self.access_rule.delete()
+        self.assertNotIn((pk, True, False), rules.__rule_cache__)
+
+    def test_invalidate_on_permissions_changed(self):
+        perm = Permission.objects.get(content_type__app_label='auth', codename='add_group')
+        rules.get_compiled_rule(self.access_rule)
+        self.access_rule.permissions.add(perm)
+        self.assertNotIn((self.access_rule.pk, True, False), rules.__rule_cache__)
+
+        rules.get_compiled_rule(self.access_rule)
+        perm.accessrule_permissions.clear()
+        self.assertNotIn((self.access_rule.pk, True, False), rules.__rule_cache__)
+
+
+class UnionQueriesTestCase(TestCase):
+    """
+    Testing ``chemtrails.contrib.permissions.rules.union_queries()``.
+    """
+    def test_union_queries(self):
+        statement, params = rules.union_queries([
+            ('MATCH path = (source0 {pk: $source0_pk}) RETURN path;', {'source0_pk': 1}),
+            ('MATCH path = (source0 {pk: $source0_pk, name: $source0_name}) RETURN path;',
+             {'source0_pk': 1, 'source0_name': 'name'})
+        ])
+        self.assertEqual(statement, 'MATCH path = (source0 {pk: $q0_source0_pk}) RETURN path UNION '
+                                    'MATCH path = (source0 {pk: $q1_source0_pk, name: $q1_source0_name}) '
+                                    'RETURN path;')
+        self.assertEqual(params, {'q0_source0_pk': 1, 'q1_source0_pk': 1, 'q1_source0_name': 'name'})
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+from django.test import TestCase, override_settings
+
+from chemtrails.contrib.permissions.stats import RuleStatistics
+
+Rule = namedtuple('Rule', 'pk')
+
+
+class RuleStatisticsTestCase(TestCase):
+    """
+    Testing ``chemtrails.contrib.permissions.stats.RuleStatistics``.
+    """
+    def setUp(self):
+        self.stats = RuleStatistics()
+
+    def test_record(self):
+        self.stats.record(1, 0.5, hit=True)
+        self.stats.record(1, 0.25, hit=False)
+        self.assertEqual(self.stats.get(1), (2, 1, 0.75))
+        self.assertEqual(self.stats.get(2), (0, 0, 0.0))
+
+    def test_get_score(self):
+        self.assertEqual(RuleStatistics.get_score(0, 0, 0.0), 0.0)
+        # Frequently granting rules are cheaper than rules which rarely grants access.
+        self.assertLess(RuleStatistics.get_score(10, 9, 1.0), RuleStatistics.get_score(10, 1, 1.0))
+        # Fast rules are cheaper than slow rules.
+        self.assertLess(RuleStatistics.get_score(10, 5, 1.0), RuleStatistics.get_score(10, 5, 2.0))
+
+    @override_settings(CHEMTRAILS={'RULE_STATISTICS_INTERVAL': 0})
+    def test_order(self):
+        self.stats.record(1, 1.0, hit=False)
+        self.stats.record(2, 0.1, hit=True)
+
+        rules = [Rule(1), Rule(2), Rule(3)]
+        self.assertEqual(self.stats.order(rules), [Rule(3), Rule(2), Rule(1)])
+        self.assertEqual(self.stats.get_ranking(), {2: 1, 1: 2})
+
+    @override_settings(CHEMTRAILS={'RULE_STATISTICS_INTERVAL': 3600})
+    def test_order_is_refreshed_periodically(self):
+        self.stats.record(1, 1.0, hit=False)
+        self.assertEqual(self.stats.order([Rule(1), Rule(2)]), [Rule(2), Rule(1)])
+
+        # The ranking is not updated before the interval has passed.
+        self.stats.record(2, 10.0, hit=False)
+        self.assertEqual(self.stats.order([Rule(1), Rule(2)]), [Rule(2), Rule(1)])
+
+        self.stats._refreshed -= 3600
+        self.assertEqual(self.stats.order([Rule(1), Rule(2)]), [Rule(1), Rule(2)])
+
+    def test_reset(self):
+        self.stats.record(1, 1.0, hit=True)
+        self.stats.reset()
+        self.assertEqual(self.stats.get(1), (0, 0, 0.0))
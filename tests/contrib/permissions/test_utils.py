@@ -4,13 +4,16 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser, Group, Permission
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import QuerySet
-from django.test import TestCase
+from django.test import TestCase, override_settings
+
+from neomodel import db
 
 from chemtrails.contrib.permissions import utils
 from chemtrails.contrib.permissions.exceptions import MixedContentTypeError
 from chemtrails.contrib.permissions.models import AccessRule
-from chemtrails.neoutils import get_node_for_object, get_nodeset_for_queryset
+from chemtrails.neoutils import bump_graph_version, get_node_for_object, get_nodeset_for_queryset
 from tests.testapp.autofixtures import Author, AuthorFixture, Book, BookFixture, Store, StoreFixture
+from tests.testapp.models import Award
 from tests.utils import flush_nodes, clear_neo4j_model_nodes
 
 User = get_user_model()
@@ -165,6 +168,51 @@ class GetUsersWithPermsTestCase(TestCase):
         users = utils.get_users_with_perms(obj=self.book, permissions=['change_book', 'view_book'])
         self.assertEqual(set(users), {self.user1})
 
+    def test_get_users_codenames(self):
+        perms = Permission.objects.filter(content_type__app_label='testapp', codename__in=['view_book', 'change_book'])
+        self.user1.user_permissions.add(perms.get(codename='view_book'))
+        self.group.permissions.add(perms.get(codename='change_book'))
+        self.user1.groups.add(self.group)
+        self.user2.groups.add(self.group)
+
+        ctype = utils.get_content_type(Book)
+        with self.assertNumQueries(2):
+            self.assertEqual(utils.get_users_codenames([self.user1.pk, self.user2.pk], ctype,
+                                                       {'view_book', 'change_book'}),
+                             {self.user1.pk: {'view_book', 'change_book'}, self.user2.pk: {'change_book'}})
+        with self.assertNumQueries(1):
+            self.assertEqual(utils.get_users_codenames([self.user1.pk, self.user2.pk], ctype,
+                                                       {'view_book', 'change_book'}, with_group_users=False),
+                             {self.user1.pk: {'view_book'}})
+
+    def test_with_group_users(self):
+        access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(User),
+                                                ctype_target=utils.get_content_type(Book),
+                                                relation_types=[{'AUTHOR': None},
+                                                                {'BOOK': None}])
+        perm = Permission.objects.get(content_type__app_label='testapp', codename='view_book')
+        access_rule.permissions.add(perm)
+        self.group.permissions.add(perm)
+        self.user1.groups.add(self.group)
+
+        self.assertEqual(set(utils.get_users_with_perms(obj=self.book, permissions='view_book')), {self.user1})
+        self.assertEqual(set(utils.get_users_with_perms(obj=self.book, permissions='view_book',
+                                                        with_group_users=False)), set())
+
+    @override_settings(CHEMTRAILS={'RULE_EVALUATION': 'union'})
+    def test_union_evaluation(self):
+        perm = Permission.objects.get(content_type__app_label='testapp', codename='view_book')
+        for requires_staff in (False, True):
+            access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(User),
+                                                    ctype_target=utils.get_content_type(Book),
+                                                    requires_staff=requires_staff,
+                                                    relation_types=[{'AUTHOR': None}, {'BOOK': None}])
+            access_rule.permissions.add(perm)
+        self.user1.user_permissions.add(perm)
+
+        users = utils.get_users_with_perms(obj=self.book, permissions='view_book')
+        self.assertEqual(set(users), {self.user1})
+
     def test_get_relation_types_definition_index_variable(self):
         book = BookFixture(Book, generate_m2m={'authors': (2, 2)}).create_one()
         get_nodeset_for_queryset(Store.objects.filter(pk=book.pk), sync=True)
@@ -388,6 +436,36 @@ class GetObjectsForUserTestCase(TestCase):
         self.assertEqual(len(groups), len(objects))
         self.assertEqual(set(groups), set(objects))
 
+    @override_settings(CHEMTRAILS={'RULE_EVALUATION': 'union'})
+    def test_union_evaluation(self):
+        groups = Group.objects.bulk_create([Group(name=name) for name in ['group1', 'group2', 'group3']])
+        perm = Permission.objects.get(content_type__app_label='auth', codename='change_group')
+        for name in ('group1', 'group2'):
+            access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(User),
+                                                    ctype_target=utils.get_content_type(Group),
+                                                    relation_types=[{'GROUPS': {'name': name}}])
+            access_rule.permissions.add(perm)
+        self.user1.user_permissions.add(perm)
+        self.user1.groups.add(*groups)
+
+        objects = utils.get_objects_for_user(self.user1, 'auth.change_group')
+        self.assertEqual(set(Group.objects.filter(name__in=['group1', 'group2'])), set(objects))
+
+    @override_settings(CHEMTRAILS={'RULE_EVALUATION': 'parallel', 'RULE_EVALUATION_WORKERS': 2})
+    def test_parallel_evaluation(self):
+        groups = Group.objects.bulk_create([Group(name=name) for name in ['group1', 'group2', 'group3']])
+        perm = Permission.objects.get(content_type__app_label='auth', codename='change_group')
+        for name in ('group1', 'group2', 'group3'):
+            access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(User),
+                                                    ctype_target=utils.get_content_type(Group),
+                                                    relation_types=[{'GROUPS': {'name': name}}])
+            access_rule.permissions.add(perm)
+        self.user1.user_permissions.add(perm)
+        self.user1.groups.add(*groups[:2])
+
+        objects = utils.get_objects_for_user(self.user1, 'auth.change_group')
+        self.assertEqual(set(Group.objects.filter(name__in=['group1', 'group2'])), set(objects))
+
     def test_multiple_permissions_to_check_requires_staff(self):
         groups = Group.objects.bulk_create([Group(name=name) for name in ['group1', 'group2', 'group3']])
         access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(User),
@@ -555,6 +633,95 @@ class GetObjectsForUserTestCase(TestCase):
         self.assertNotEqual(User.objects.count(), objects.count())
 
 
+class HasAccessRulePathTestCase(TestCase):
+    """
+    Testing ``chemtrails.contrib.permissions.utils.has_access_rule_path()``.
+    """
+    @flush_nodes()
+    def test_has_access_rule_path(self):
+        author = AuthorFixture(Author).create_one()
+        other = AuthorFixture(Author).create_one()
+        perm = Permission.objects.get(content_type=utils.get_content_type(author), codename='change_author')
+
+        self.assertFalse(utils.has_access_rule_path(author.user, 'testapp.change_author', author))
+
+        for relation_types in ([{'GROUPS': None}], [{'AUTHOR': None}]):
+            access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(author.user),
+                                                    ctype_target=utils.get_content_type(author),
+                                                    relation_types=relation_types)
+            access_rule.permissions.add(perm)
+
+        self.assertTrue(utils.has_access_rule_path(author.user, 'testapp.change_author', author))
+        self.assertTrue(utils.has_access_rule_path(author.user, 'change_author', author))
+        self.assertFalse(utils.has_access_rule_path(author.user, 'change_author', other))
+        self.assertFalse(utils.has_access_rule_path(author.user, 'delete_author', author))
+
+    @flush_nodes()
+    def test_has_access_rule_path_uuid_primary_key(self):
+        author, other = AuthorFixture(Author).create(count=2, commit=True)
+        award = Award.objects.create(name='award', author=author)
+        other_award = Award.objects.create(name='other award', author=other)
+        access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(author.user),
+                                                ctype_target=utils.get_content_type(award),
+                                                relation_types=[{'AUTHOR': None}, {'AWARDS': None}])
+        access_rule.permissions.add(Permission.objects.get(content_type=utils.get_content_type(award),
+                                                           codename='change_award'))
+
+        self.assertTrue(utils.has_access_rule_path(author.user, 'change_award', award))
+        self.assertFalse(utils.has_access_rule_path(author.user, 'change_award', other_award))
+
+
+class PermissionDecisionCacheTestCase(TestCase):
+    """
+    Testing cached permission decisions with ``CACHE_PERMISSIONS`` enabled.
+    """
+    def setUp(self):
+        self.author = AuthorFixture(Author).create_one()
+        self.perm = Permission.objects.get(content_type=utils.get_content_type(self.author), codename='change_author')
+        access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(self.author.user),
+                                                ctype_target=utils.get_content_type(self.author),
+                                                relation_types=[{'AUTHOR': None}])
+        access_rule.permissions.add(self.perm)
+        self.author.user.user_permissions.add(self.perm)
+
+    def tearDown(self):
+        clear_neo4j_model_nodes()
+
+    def remove_relationships(self):
+        # Writing directly to the graph does not change the graph version.
+        db.cypher_query('MATCH (n:UserNode {pk: $pk})-[r]-() DELETE r', {'pk': self.author.user.pk})
+
+    @override_settings(CHEMTRAILS={'CACHE_PERMISSIONS': True})
+    def test_has_access_rule_path_cached(self):
+        self.assertTrue(utils.has_access_rule_path(self.author.user, 'change_author', self.author))
+
+        self.remove_relationships()
+        self.assertTrue(utils.has_access_rule_path(self.author.user, 'change_author', self.author))
+
+        bump_graph_version()
+        self.assertFalse(utils.has_access_rule_path(self.author.user, 'change_author', self.author))
+
+    @override_settings(CHEMTRAILS={'CACHE_PERMISSIONS': True})
+    def test_get_objects_for_user_cached(self):
+        objects = utils.get_objects_for_user(self.author.user, 'testapp.change_author')
+        self.assertEqual({self.author}, set(objects))
+
+        self.remove_relationships()
+        objects = utils.get_objects_for_user(self.author.user, 'testapp.change_author')
+        self.assertEqual({self.author}, set(objects))
+
+        # Changing an access rule invalidates cached decisions.
+        AccessRule.objects.get(permissions=self.perm).save()
+        objects = utils.get_objects_for_user(self.author.user, 'testapp.change_author')
+        self.assertEqual(set(), set(objects))
+
+    def test_not_cached_by_default(self):
+        self.assertTrue(utils.has_access_rule_path(self.author.user, 'change_author', self.author))
+
+        self.remove_relationships()
+        self.assertFalse(utils.has_access_rule_path(self.author.user, 'change_author', self.author))
+
+
 class GetObjectsForGroupTestCase(TestCase):
     """
     Testing ``chemtrails.contrib.permissions.utils.get_objects_for_group()``.
@@ -676,6 +843,49 @@ class GraphPermissionCheckerTestCase(TestCase):
         checker = utils.GraphPermissionChecker(user)
         self.assertTrue(checker.has_perm(perm.codename, author))
 
+    @flush_nodes()
+    def test_checker_prefetch_perms(self):
+        author, other = AuthorFixture(Author).create(count=2, commit=True)
+        user = author.user
+        perm = Permission.objects.get(content_type=utils.get_content_type(author), codename='change_author')
+        access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(user),
+                                                ctype_target=utils.get_content_type(author),
+                                                relation_types=[{'AUTHOR': None}])
+        user.user_permissions.add(perm)
+        access_rule.permissions.add(perm)
+
+        checker = utils.GraphPermissionChecker(user)
+        self.assertTrue(checker.prefetch_perms(Author.objects.filter(pk__in=[author.pk, other.pk])))
+        with self.assertNumQueries(0):
+            self.assertTrue(checker.has_perm(perm.codename, author))
+            self.assertFalse(checker.has_perm(perm.codename, other))
+            self.assertFalse(checker.has_perm('delete_author', author))
+
+    @flush_nodes()
+    def test_get_authorized_pks(self):
+        author, other = AuthorFixture(Author).create(count=2, commit=True)
+        access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(author.user),
+                                                ctype_target=utils.get_content_type(author),
+                                                relation_types=[{'AUTHOR': None}])
+        access_rule.permissions.add(*Permission.objects.filter(content_type=utils.get_content_type(author),
+                                                               codename__in=['add_author', 'change_author']))
+
+        authorized = utils.get_authorized_pks(author.user, ['change_author', 'delete_author'], [author, other])
+        self.assertEqual(authorized, {'change_author': {author.pk}, 'delete_author': set()})
+
+    @flush_nodes()
+    def test_get_authorized_pks_uuid_primary_key(self):
+        author, other = AuthorFixture(Author).create(count=2, commit=True)
+        award = Award.objects.create(name='award', author=author)
+        access_rule = AccessRule.objects.create(ctype_source=utils.get_content_type(award),
+                                                ctype_target=utils.get_content_type(author),
+                                                relation_types=[{'AUTHOR': None}])
+        access_rule.permissions.add(Permission.objects.get(content_type=utils.get_content_type(author),
+                                                           codename='change_author'))
+
+        authorized = utils.get_authorized_pks(award, ['change_author'], [author, other])
+        self.assertEqual(authorized, {'change_author': {author.pk}})
+
     @flush_nodes()
     def test_checker_has_perm_authorized_group(self):
         group = Group.objects.create(name='test group')
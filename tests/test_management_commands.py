@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import gzip
+import os
+import shutil
+import tempfile
+
+import datetime
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
+
+from neo4j.v1 import TransientError
+from neomodel import db
+
+from chemtrails.contrib.permissions.models import AccessRule
+from chemtrails.neoutils import get_node_class_for_model, get_node_for_object
+from chemtrails.utils import flatten
+
+from chemtrails.management.commands import neo_import
+from chemtrails.management.commands.neo_import import get_models, get_partitions
+from chemtrails.models import ImportCheckpoint, ImportWatermark
+from tests.utils import clear_neo4j_model_nodes, flush_nodes
+from tests.testapp.autofixtures import Author, Book, BookFixture, Store
+
+
+class MigrateGraphCommandTestCase(TestCase):
+
+    def get_raw_node(self, node):
+        result, _ = list(flatten(db.cypher_query('MATCH (n) WHERE ID(n) = $id RETURN n', {'id': node.id})))
+        return result
+
+    @flush_nodes()
+    def test_remove_stale_property(self):
+        node = get_node_for_object(Group.objects.create(name='group'))
+        db.cypher_query('MATCH (n) WHERE ID(n) = $id SET n.foo = "bar", n._schema_fingerprint = "stale"',
+                        {'id': node.id})
+
+        call_command('chemtrails_migrate_graph', batch_size=1, stdout=StringIO())
+
+        result = self.get_raw_node(node)
+        self.assertNotIn('foo', result.properties)
+        self.assertEqual(result.properties['_schema_fingerprint'], node.__schema_fingerprint__)
+
+    @flush_nodes()
+    def test_rename_stale_property(self):
+        node = get_node_for_object(Group.objects.create(name='group'))
+        db.cypher_query('MATCH (n) WHERE ID(n) = $id SET n.title = n.name REMOVE n.name', {'id': node.id})
+
+        call_command('chemtrails_migrate_graph', rename_properties=['title=name'], stdout=StringIO())
+
+        result = self.get_raw_node(node)
+        self.assertNotIn('title', result.properties)
+        self.assertEqual(result.properties['name'], 'group')
+
+    @flush_nodes()
+    def test_remove_stale_relationship(self):
+        group1, group2 = Group.objects.create(name='group1'), Group.objects.create(name='group2')
+        node1, node2 = get_node_for_object(group1), get_node_for_object(group2)
+        db.cypher_query('MATCH (a), (b) WHERE ID(a) = $a AND ID(b) = $b CREATE (a)-[:RELATION]->(b)',
+                        {'a': node1.id, 'b': node2.id})
+
+        call_command('chemtrails_migrate_graph', stdout=StringIO())
+
+        results, _ = db.cypher_query('MATCH ()-[r:RELATION]->() RETURN r')
+        self.assertEqual(len(results), 0)
+
+    @flush_nodes()
+    def test_dry_run(self):
+        node = get_node_for_object(Group.objects.create(name='group'))
+        db.cypher_query('MATCH (n) WHERE ID(n) = $id SET n.foo = "bar"', {'id': node.id})
+
+        out = StringIO()
+        call_command('chemtrails_migrate_graph', dry_run=True, stdout=out)
+
+        self.assertEqual(self.get_raw_node(node).properties['foo'], 'bar')
+        self.assertIn('Would update', out.getvalue())
+
+    def test_invalid_rename(self):
+        self.assertRaises(CommandError, call_command, 'chemtrails_migrate_graph',
+                          rename_properties=['title'], stdout=StringIO())
+
+    @flush_nodes()
+    def test_rename_to_undefined_target(self):
+        node = get_node_for_object(Group.objects.create(name='group'))
+        db.cypher_query('MATCH (n) WHERE ID(n) = $id SET n.title = "title"', {'id': node.id})
+
+        self.assertRaises(CommandError, call_command, 'chemtrails_migrate_graph',
+                          rename_properties=['title=nmae'], stdout=StringIO())
+        self.assertRaises(CommandError, call_command, 'chemtrails_migrate_graph',
+                          rename_relationships=['RELATION=UNDEFINED_TYPE'], stdout=StringIO())
+        self.assertEqual(self.get_raw_node(node).properties['title'], 'title')
+
+    @flush_nodes()
+    def test_rename_target_not_defined_for_label(self):
+        node = get_node_for_object(Group.objects.create(name='group'))
+        db.cypher_query('MATCH (n) WHERE ID(n) = $id SET n.title = "title", n._schema_fingerprint = "stale"',
+                        {'id': node.id})
+
+        # "pages" is defined for books, but not for groups.
+        call_command('chemtrails_migrate_graph', rename_properties=['title=pages'], stdout=StringIO())
+        result = self.get_raw_node(node)
+        self.assertEqual(result.properties['title'], 'title')
+        self.assertEqual(result.properties['_schema_fingerprint'], 'stale')
+
+    @flush_nodes()
+    def test_rename_relationships_sharing_type(self):
+        group1, group2 = Group.objects.create(name='group1'), Group.objects.create(name='group2')
+        node1, node2 = get_node_for_object(group1), get_node_for_object(group2)
+        db.cypher_query('MATCH (a), (b) WHERE ID(a) = $a AND ID(b) = $b '
+                        'CREATE (a)-[:RELATION {remote_field: "first"}]->(b), '
+                        '(a)-[:RELATION {remote_field: "second"}]->(b)',
+                        {'a': node1.id, 'b': node2.id})
+
+        call_command('chemtrails_migrate_graph', rename_relationships=['RELATION=PERMISSIONS'], stdout=StringIO())
+
+        results, _ = db.cypher_query('MATCH (a)-[r:PERMISSIONS]->(b) WHERE ID(a) = $a AND ID(b) = $b '
+                                     'RETURN r.remote_field', {'a': node1.id, 'b': node2.id})
+        self.assertEqual(sorted(row[0] for row in results), ['first', 'second'])
+
+
+class ImportCommandTestCase(TestCase):
+
+    @flush_nodes()
+    def test_import(self):
+        book = BookFixture(Book, generate_m2m={'authors': (1, 1)}).create_one()
+        clear_neo4j_model_nodes()
+
+        out = StringIO()
+        call_command('neo_import', 'testapp', batch_size=1, stdout=out)
+
+        node = get_node_class_for_model(Book).nodes.get(pk=book.pk)
+        self.assertEqual(node.name, book.name)
+        self.assertEqual([n.pk for n in node.authors.all()], [book.authors.get().pk])
+        self.assertIn('Imported', out.getvalue())
+
+    @flush_nodes()
+    def test_import_skip_relationships(self):
+        book = BookFixture(Book).create_one()
+        clear_neo4j_model_nodes()
+
+        call_command('neo_import', 'testapp.Book', skip_relationships=True, stdout=StringIO())
+        results, _ = db.cypher_query('MATCH (n:BookNode {pk: $pk})-[r]-() RETURN r', {'pk': book.pk})
+        self.assertEqual(len(results), 0)
+
+    @flush_nodes()
+    def test_import_resume(self):
+        books = sorted(BookFixture(Book).create(count=3, commit=True), key=lambda book: book.pk)
+        clear_neo4j_model_nodes()
+
+        # Pretend the import was interrupted after the first book.
+        ImportCheckpoint.objects.create(content_type=ContentType.objects.get_for_model(Book),
+                                        phase=ImportCheckpoint.PHASE_NODES, last_pk=str(books[0].pk))
+
+        call_command('neo_import', 'testapp.Book', resume=True, skip_relationships=True, stdout=StringIO())
+        klass = get_node_class_for_model(Book)
+        self.assertIsNone(klass.nodes.get_or_none(pk=books[0].pk))
+        self.assertEqual(set(node.pk for node in klass.nodes.all()), set(book.pk for book in books[1:]))
+
+        # Checkpoints are removed once the import is done, so the next --resume starts over.
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        out = StringIO()
+        call_command('neo_import', 'testapp.Book', resume=True, skip_relationships=True, stdout=out)
+        self.assertIsNotNone(klass.nodes.get_or_none(pk=books[0].pk))
+        self.assertIn('no interrupted import', out.getvalue())
+
+    def patch_importer(self, failures):
+        """
+        Make the importer raise a deadlock ``failures`` times in a row after the first batch.
+        """
+        get_importer, state = neo_import.get_importer, {'failures': failures, 'written': 0}
+
+        def importer(*args, **kwargs):
+            for result in get_importer(*args, **kwargs):
+                if state['written'] and state['failures']:
+                    state['failures'] -= 1
+                    raise TransientError('Deadlock detected')
+                state['written'] += 1
+                yield result
+
+        return mock.patch.multiple(neo_import, get_importer=importer, IMPORT_RETRY_DELAY=0)
+
+    @flush_nodes()
+    def test_import_retries_transient_errors(self):
+        books = BookFixture(Book).create(count=3, commit=True)
+        clear_neo4j_model_nodes()
+
+        with self.patch_importer(failures=neo_import.IMPORT_RETRIES):
+            call_command('neo_import', 'testapp.Book', batch_size=1, skip_relationships=True, stdout=StringIO())
+
+        klass = get_node_class_for_model(Book)
+        self.assertEqual(set(node.pk for node in klass.nodes.all()), set(book.pk for book in books))
+
+    @flush_nodes()
+    def test_import_failed_partition_is_resumable(self):
+        books = sorted(BookFixture(Book).create(count=3, commit=True), key=lambda book: book.pk)
+        clear_neo4j_model_nodes()
+
+        with self.patch_importer(failures=neo_import.IMPORT_RETRIES + 1):
+            self.assertRaises(TransientError, call_command, 'neo_import', 'testapp.Book', batch_size=1,
+                              skip_relationships=True, stdout=StringIO())
+
+        checkpoint = ImportCheckpoint.objects.get(phase=ImportCheckpoint.PHASE_NODES)
+        self.assertFalse(checkpoint.completed)
+        self.assertEqual(checkpoint.last_pk, str(books[0].pk))
+
+        call_command('neo_import', 'testapp.Book', resume=True, batch_size=1, skip_relationships=True,
+                     stdout=StringIO())
+        klass = get_node_class_for_model(Book)
+        self.assertEqual(set(node.pk for node in klass.nodes.all()), set(book.pk for book in books))
+
+    @flush_nodes()
+    def test_import_incremental(self):
+        ctype = ContentType.objects.get_for_model(Group)
+        old = AccessRule.objects.create(ctype_source=ctype, ctype_target=ctype)
+        call_command('neo_import', 'chemtrails_permissions', incremental=True, stdout=StringIO())
+        watermark = ImportWatermark.objects.get(content_type=ContentType.objects.get_for_model(AccessRule))
+
+        # Pretend the first rule was modified before the last import.
+        AccessRule.objects.filter(pk=old.pk).update(updated=watermark.value - datetime.timedelta(days=1))
+        new = AccessRule.objects.create(ctype_source=ctype, ctype_target=ctype)
+        clear_neo4j_model_nodes()
+
+        klass = get_node_class_for_model(AccessRule)
+        db.cypher_query('CREATE (:{label} {{pk: 999999}})'.format(label=klass.__label__))
+
+        call_command('neo_import', 'chemtrails_permissions', incremental=True, stdout=StringIO())
+        self.assertEqual([node.pk for node in klass.nodes.all()], [new.pk])
+        self.assertGreater(ImportWatermark.objects.get(pk=watermark.pk).value, watermark.value)
+
+        call_command('neo_import', 'chemtrails_permissions', since='2000-01-01', stdout=StringIO())
+        self.assertEqual(set(node.pk for node in klass.nodes.all()), {old.pk, new.pk})
+
+    def test_import_incremental_invalid(self):
+        self.assertRaises(CommandError, call_command, 'neo_import', since='yesterday', stdout=StringIO())
+        self.assertRaises(CommandError, call_command, 'neo_import', incremental=True, workers=2, stdout=StringIO())
+        self.assertRaises(CommandError, call_command, 'neo_import', incremental=True, resume=True, stdout=StringIO())
+
+    def test_invalid_label(self):
+        self.assertRaises(CommandError, call_command, 'neo_import', 'invalid_app', stdout=StringIO())
+
+    def test_invalid_workers(self):
+        self.assertRaises(CommandError, call_command, 'neo_import', workers=0, stdout=StringIO())
+
+    @override_settings(CHEMTRAILS={'IGNORE_MODELS': []})
+    def test_get_models_excludes_internal_models(self):
+        models = get_models([])
+        self.assertIn(Book, models)
+        self.assertNotIn(ImportCheckpoint, models)
+        self.assertEqual(get_models(['chemtrails']), [])
+
+    def test_get_partitions(self):
+        groups = [Group.objects.create(name='group%d' % n) for n in range(5)]
+        self.assertEqual(get_partitions(Group.objects.all(), 2),
+                         [(None, groups[2].pk), (groups[2].pk, groups[4].pk), (groups[4].pk, None)])
+        self.assertEqual(get_partitions(Group.objects.none(), 2), [(None, None)])
+
+
+class ExportCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read_csv(self, name):
+        path = os.path.join(self.directory, name)
+        with (gzip.open(path, 'rt', newline='') if path.endswith('.gz') else open(path, newline='')) as f:
+            return list(csv.reader(f))
+
+    @flush_nodes()
+    def test_export_admin_import(self):
+        book = BookFixture(Book, generate_m2m={'authors': (1, 1)}).create_one()
+        call_command('neo_export', self.directory, 'testapp', format='admin-import', stdout=StringIO())
+
+        header = self.read_csv('nodes_BookNode_header.csv')[0]
+        self.assertEqual(header[0], ':ID(BookNode)')
+        self.assertEqual(header[-1], ':LABEL')
+        self.assertIn('pages:long', header)
+        self.assertIn('rating:double', header)
+
+        rows = self.read_csv('nodes_BookNode.csv')
+        self.assertEqual(len(rows), 1)
+        row = dict(zip(header, rows[0]))
+        self.assertEqual(row[':ID(BookNode)'], str(book.pk))
+        self.assertEqual(row['name:string'], book.name)
+
+        klass = get_node_class_for_model(Book)
+        relation_type = klass.authors.definition['relation_type']
+        reverse_type = klass.get_reverse_relationship(
+            'authors', get_node_class_for_model(Author)).definition['relation_type']
+        name = 'relationships_%s_BookNode_AuthorNode' % relation_type
+        self.assertEqual(self.read_csv('%s_header.csv' % name)[0][:2], [':START_ID(BookNode)', ':END_ID(AuthorNode)'])
+        self.assertEqual([row[:2] for row in self.read_csv('%s.csv' % name)], [[str(book.pk), str(book.authors.get().pk)]])
+        self.assertEqual(len(self.read_csv('relationships_%s_AuthorNode_BookNode.csv' % reverse_type)), 1)
+
+        # neo4j-admin import rejects relationships to ID spaces without any nodes.
+        for name in os.listdir(self.directory):
+            if name.startswith('relationships_') and name.endswith('_header.csv'):
+                for column in self.read_csv(name)[0][:2]:
+                    label = column[column.index('(') + 1:-1]
+                    self.assertTrue(os.path.exists(os.path.join(self.directory, 'nodes_%s_header.csv' % label)),
+                                    msg='%s has no node file for %s' % (name, column))
+
+    @flush_nodes()
+    def test_export_null_value(self):
+        Store.objects.create(name='Store', registered_users=0, bestseller=None)
+        call_command('neo_export', self.directory, 'testapp.Store', stdout=StringIO())
+
+        header = self.read_csv('nodes_StoreNode_header.csv')[0]
+        index = header.index('bestseller_id:long')
+        with open(os.path.join(self.directory, 'nodes_StoreNode.csv')) as f:
+            data = f.read()
+        self.assertNotIn('""', data)
+        self.assertEqual(self.read_csv('nodes_StoreNode.csv')[0][index], '')
+        self.assertIn('"Store"', data)
+
+    @flush_nodes()
+    def test_export_compress(self):
+        BookFixture(Book).create_one()
+        call_command('neo_export', self.directory, 'testapp.Book', compress=True, stdout=StringIO())
+        self.assertEqual(len(self.read_csv('nodes_BookNode.csv.gz')), 1)
+
+    def test_export_directory_not_empty(self):
+        open(os.path.join(self.directory, 'file'), 'w').close()
+        self.assertRaises(CommandError, call_command, 'neo_export', self.directory, stdout=StringIO())
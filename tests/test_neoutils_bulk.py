@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth.models import Group
+from django.test import TestCase, override_settings
+
+from neomodel import db
+
+from chemtrails.neoutils import (
+    __meta_cache__, __node_cache__, __reverse_cache__,
+    bulk_sync, get_node_class_for_model, get_nodeset_for_queryset, get_node_for_object
+)
+from chemtrails.neoutils.bulk import (
+    deflate_node_properties, delete_stale_nodes, get_remote_field, import_nodes, import_relationships
+)
+
+from tests.utils import flush_nodes, clear_neo4j_model_nodes
+from tests.testapp.autofixtures import (
+    Author, AuthorFixture, Book, BookFixture, Publisher, Store, StoreFixture
+)
+from tests.testapp.models import Guild
+
+
+class BulkSyncTestCase(TestCase):
+
+    @flush_nodes()
+    def test_bulk_sync_creates_nodes(self):
+        books = BookFixture(Book).create(count=3, commit=True)
+        clear_neo4j_model_nodes()
+
+        count = bulk_sync(Book.objects.all(), chunk_size=2)
+        self.assertEqual(count, 3)
+
+        klass = get_node_class_for_model(Book)
+        for book in books:
+            node = klass.nodes.get(pk=book.pk)
+            self.assertEqual(node.name, book.name)
+            self.assertEqual(node.publisher_id, book.publisher_id)
+
+    @flush_nodes()
+    def test_bulk_sync_connects_both_sides(self):
+        book = BookFixture(Book, generate_m2m={'authors': (2, 2)}).create_one()
+        clear_neo4j_model_nodes()
+
+        bulk_sync(Book.objects.filter(pk=book.pk), max_depth=1)
+
+        node = get_node_class_for_model(Book).nodes.get(pk=book.pk)
+        self.assertEqual(set(n.pk for n in node.authors.all()),
+                         set(book.authors.values_list('pk', flat=True)))
+        self.assertEqual([n.pk for n in node.publisher.all()], [book.publisher.pk])
+
+        publisher = get_node_class_for_model(Publisher).nodes.get(pk=book.publisher.pk)
+        self.assertEqual([n.pk for n in publisher.book_set.all()], [book.pk])
+        for author in get_node_class_for_model(Author).nodes.filter(pk__in=[a.pk for a in book.authors.all()]):
+            self.assertEqual([n.pk for n in author.book_set.all()], [book.pk])
+
+    @flush_nodes()
+    def test_bulk_sync_removes_stale_relationships(self):
+        book = BookFixture(Book, generate_m2m={'authors': (2, 2)}).create_one()
+        bulk_sync(Book.objects.filter(pk=book.pk))
+
+        removed = book.authors.first()
+        book.authors.remove(removed)
+        bulk_sync(Book.objects.filter(pk=book.pk))
+
+        node = get_node_class_for_model(Book).nodes.get(pk=book.pk)
+        self.assertEqual(set(n.pk for n in node.authors.all()),
+                         set(book.authors.values_list('pk', flat=True)))
+        author = get_node_class_for_model(Author).nodes.get(pk=removed.pk)
+        self.assertEqual(len(author.book_set.all()), 0)
+
+    @flush_nodes()
+    def test_bulk_sync_repairs_reverse_relationships(self):
+        book = BookFixture(Book, generate_m2m={'authors': (2, 2)}).create_one()
+        bulk_sync(Book.objects.filter(pk=book.pk))
+
+        klass = get_node_class_for_model(Book)
+        reverse = klass.get_reverse_relationship('authors', get_node_class_for_model(Author))
+        params = {'type': reverse.definition['relation_type'], 'remote_field': get_remote_field(reverse)}
+        author, other = book.authors.all()
+        db.cypher_query('MATCH (:AuthorNode {{pk: $pk}})-[r:{type}]->(:BookNode) DELETE r'.format(**params),
+                        {'pk': author.pk})
+        book.authors.remove(other)
+        db.cypher_query('MATCH (a:AuthorNode {{pk: $author}}), (b:BookNode {{pk: $book}}) '
+                        'MERGE (a)-[:{type} {{remote_field: $remote_field}}]->(b)'.format(**params),
+                        {'author': other.pk, 'book': book.pk, 'remote_field': params['remote_field']})
+
+        bulk_sync(Book.objects.filter(pk=book.pk))
+
+        author_class = get_node_class_for_model(Author)
+        self.assertEqual([n.pk for n in author_class.nodes.get(pk=author.pk).book_set.all()], [book.pk])
+        self.assertEqual(len(author_class.nodes.get(pk=other.pk).book_set.all()), 0)
+
+    @flush_nodes()
+    def test_bulk_sync_keeps_schema_fingerprint(self):
+        book = BookFixture(Book).create_one()
+        clear_neo4j_model_nodes()
+        klass = get_node_class_for_model(Book)
+
+        # Created nodes have the current schema.
+        bulk_sync(Book.objects.filter(pk=book.pk))
+        self.assertEqual(klass.nodes.get(pk=book.pk)._schema_fingerprint, klass.__schema_fingerprint__)
+
+        # Stale relationships are never removed in bulk, so existing nodes keep their fingerprint.
+        db.cypher_query('MATCH (n:{label} {{pk: $pk}}) SET n._schema_fingerprint = "stale"'.format(
+            label=klass.__label__), {'pk': book.pk})
+        bulk_sync(Book.objects.filter(pk=book.pk))
+        self.assertEqual(klass.nodes.get(pk=book.pk)._schema_fingerprint, 'stale')
+
+    @flush_nodes()
+    def test_bulk_sync_max_depth_zero(self):
+        book = BookFixture(Book).create_one()
+        clear_neo4j_model_nodes()
+
+        bulk_sync(Book.objects.filter(pk=book.pk), max_depth=0)
+        results, _ = db.cypher_query('MATCH (n:BookNode {pk: $pk})-[r]-() RETURN r', {'pk': book.pk})
+        self.assertEqual(len(results), 0)
+
+    @flush_nodes()
+    @override_settings(CHEMTRAILS={
+        'IGNORE_MODELS': ['auth.group']
+    })
+    def test_bulk_sync_ignored_model(self):
+        group = Group.objects.create(name='group')
+        bulk_sync(Group.objects.filter(pk=group.pk))
+        self.assertIsNone(get_node_class_for_model(Group).nodes.get_or_none(pk=group.pk))
+
+    @flush_nodes()
+    def test_get_nodeset_for_queryset_sync(self):
+        stores = StoreFixture(Store).create(count=2, commit=True)
+        clear_neo4j_model_nodes()
+
+        queryset = Store.objects.filter(pk__in=[store.pk for store in stores])
+        nodeset = get_nodeset_for_queryset(queryset, sync=True)
+        self.assertEqual(set(n.pk for n in nodeset), set(store.pk for store in stores))
+
+
+class BulkImportTestCase(TestCase):
+
+    @flush_nodes()
+    def test_import_nodes(self):
+        books = BookFixture(Book).create(count=3, commit=True)
+        clear_neo4j_model_nodes()
+
+        batches = list(import_nodes(Book.objects.all(), chunk_size=2))
+        self.assertEqual([count for count, _ in batches], [2, 1])
+        self.assertEqual(batches[-1][1], max(book.pk for book in books))
+
+        klass = get_node_class_for_model(Book)
+        for book in books:
+            node = klass.nodes.get(pk=book.pk)
+            self.assertEqual(klass.deflate(node.__properties__), deflate_node_properties(klass, book))
+
+    @flush_nodes()
+    def test_import_relationships(self):
+        book = BookFixture(Book, generate_m2m={'authors': (2, 2)}).create_one()
+        clear_neo4j_model_nodes()
+
+        models = [Author, Book, Publisher]
+        for model in models:
+            list(import_nodes(model.objects.all()))
+        for model in models:
+            list(import_relationships(model.objects.all(), imported_models=models))
+
+        node = get_node_class_for_model(Book).nodes.get(pk=book.pk)
+        self.assertEqual(set(n.pk for n in node.authors.all()),
+                         set(book.authors.values_list('pk', flat=True)))
+        self.assertEqual([n.pk for n in node.publisher.all()], [book.publisher.pk])
+
+        publisher = get_node_for_object(book.publisher)
+        self.assertEqual([n.pk for n in publisher.book_set.all()], [book.pk])
+
+        # Importing again does not duplicate any relationships.
+        list(import_relationships(Book.objects.all(), imported_models=models))
+        self.assertEqual(len(node.authors.all()), 2)
+
+    @flush_nodes()
+    def test_delete_stale_nodes(self):
+        books = BookFixture(Book).create(count=3, commit=True)
+        klass = get_node_class_for_model(Book)
+        db.cypher_query('CREATE (:{label} {{pk: 999999}})'.format(label=klass.__label__))
+
+        self.assertEqual(delete_stale_nodes(Book.objects.all(), chunk_size=2), 1)
+        self.assertIsNone(klass.nodes.get_or_none(pk=999999))
+        self.assertEqual(set(node.pk for node in klass.nodes.all()), set(book.pk for book in books))
+
+
+@override_settings(CHEMTRAILS={'NAMED_RELATIONSHIPS': False})
+class GenericRelationshipTypesTestCase(TestCase):
+    """
+    Several fields relating the same models share the same relationship
+    type when ``NAMED_RELATIONSHIPS`` is disabled.
+    """
+    def setUp(self):
+        # Node classes are created once for each model, so they must be
+        # created again in order to use the generic relationship types.
+        caches = (__node_cache__, __meta_cache__, __reverse_cache__)
+        saved = [dict(cache) for cache in caches]
+        for cache in caches:
+            cache.clear()
+
+        def restore():
+            for cache, items in zip(caches, saved):
+                cache.clear()
+                cache.update(items)
+        self.addCleanup(restore)
+
+    def get_connected_pks(self, instance, attr):
+        klass = get_node_class_for_model(type(instance))
+        relation = getattr(klass, attr)
+        query = ('MATCH (n:{label} {{pk: $pk}})-[:{type} {{remote_field: $remote_field}}]->(m) '
+                 'RETURN m.pk'.format(label=klass.__label__, type=relation.definition['relation_type']))
+        results, _ = db.cypher_query(query, {'pk': instance.pk, 'remote_field': get_remote_field(relation)})
+        return set(row[0] for row in results)
+
+    @flush_nodes()
+    def test_store_fields(self):
+        store = StoreFixture(Store, generate_m2m={'books': (2, 2)}).create_one()
+        Store.objects.filter(pk=store.pk).update(bestseller=store.books.first())
+        klass = get_node_class_for_model(Store)
+        self.assertEqual(klass.books.definition['relation_type'], klass.bestseller.definition['relation_type'])
+
+        for _ in range(2):
+            bulk_sync(Store.objects.filter(pk=store.pk))
+            self.assertEqual(self.get_connected_pks(store, 'books'),
+                             set(store.books.values_list('pk', flat=True)))
+            self.assertEqual(self.get_connected_pks(store, 'bestseller'), {store.books.first().pk})
+
+    @flush_nodes()
+    def test_guild_fields(self):
+        contact, member = AuthorFixture(Author).create(count=2, commit=True)
+        guild = Guild.objects.create(name='guild', contact=contact)
+        guild.members.add(member)
+
+        for _ in range(2):
+            bulk_sync(Guild.objects.filter(pk=guild.pk))
+            self.assertEqual(self.get_connected_pks(guild, 'contact'), {contact.pk})
+            self.assertEqual(self.get_connected_pks(guild, 'members'), {member.pk})
+
+    @flush_nodes()
+    def test_generic_foreign_key(self):
+        book = BookFixture(Book).create_one()
+        tag = book.tags.get()
+
+        for _ in range(2):
+            bulk_sync(book.tags.all())
+            self.assertEqual(self.get_connected_pks(tag, 'content_object'), {book.pk})
+            self.assertEqual(self.get_connected_pks(tag, 'content_type'), {tag.content_type_id})
@@ -353,14 +353,30 @@ class GraphMapperTestCase(TestCase):
             NotImplementedError, 'Unsupported field. Field CustomField is currently not supported.',
             klass.get_property_class_for_field, CustomField)
 
+    def test_get_reverse_relationship(self):
+        book_class = get_node_class_for_model(Book)
+        publisher_class = get_node_class_for_model(Publisher)
+        store_class = get_node_class_for_model(Store)
+        tag_class = get_node_class_for_model(Tag)
+
+        self.assertIs(book_class.get_reverse_relationship('publisher', publisher_class), publisher_class.book_set)
+        self.assertIs(publisher_class.get_reverse_relationship('book_set', book_class), book_class.publisher)
+        self.assertIs(store_class.get_reverse_relationship('bestseller', book_class), book_class.bestseller_stores)
+        self.assertIs(store_class.get_reverse_relationship('books', book_class), book_class.store_set)
+        self.assertIs(book_class.get_reverse_relationship('tags', tag_class), tag_class.content_object)
+        self.assertIs(tag_class.get_reverse_relationship('content_object', book_class), book_class.tags)
+        self.assertIsNone(book_class.get_reverse_relationship('publisher', store_class))
+
     @flush_nodes()
     def test_update_raw_node_property(self):
         group = Group.objects.create(name='group')
         node = get_node_for_object(group)
 
-        # Set a custom attribute on the node and make sure it's saved on the node
+        # Set a custom attribute on the node and make sure it's saved on the node.
+        # Also mark the node as written using an outdated schema.
         result, _ = list(flatten(db.cypher_query('MATCH (n) WHERE ID(n) = %d '
-                                                 'SET n.foo = "bar", n.baz = "qux" RETURN n' % node.id)))
+                                                 'SET n.foo = "bar", n.baz = "qux", '
+                                                 'n._schema_fingerprint = "stale" RETURN n' % node.id)))
         self.assertTrue(all(i in result.properties for i in ('foo', 'baz')))
         self.assertEqual(result.properties['foo'], 'bar')
         self.assertEqual(result.properties['baz'], 'qux')
@@ -387,6 +403,7 @@ class GraphMapperTestCase(TestCase):
         self.assertEqual(len(results), 2)
         self.assertTrue(all([r.type == 'RELATION' for r in results]))
 
+        db.cypher_query('MATCH (n) WHERE ID(n) = %d SET n._schema_fingerprint = "stale"' % node1.id)
         node1.__update_raw_node__()
 
         # Make sure custom relationship is deleted
@@ -398,6 +415,51 @@ class GraphMapperTestCase(TestCase):
         results = list(flatten(results))
         self.assertEqual(len(results), 1)
 
+    @flush_nodes()
+    def test_update_raw_node_skipped_for_current_schema(self):
+        group = Group.objects.create(name='group')
+        node = get_node_for_object(group)
+
+        result, _ = list(flatten(db.cypher_query('MATCH (n) WHERE ID(n) = %d SET n.foo = "bar" RETURN n' % node.id)))
+        self.assertEqual(result.properties['_schema_fingerprint'], node.__schema_fingerprint__)
+        node.__update_raw_node__()
+
+        # The node has the current schema fingerprint, so no cleanup is done.
+        result, _ = list(flatten(db.cypher_query('MATCH (n) WHERE ID(n) = %d RETURN n' % node.id)))
+        self.assertEqual(result.properties['foo'], 'bar')
+
+    @flush_nodes()
+    def test_sync_cleans_node_without_schema_fingerprint(self):
+        group = Group.objects.create(name='group')
+        node = get_node_for_object(group)
+        db.cypher_query('MATCH (n) WHERE ID(n) = %d SET n.foo = "bar" REMOVE n._schema_fingerprint' % node.id)
+
+        self.assertEqual(get_node_class_for_model(Group).nodes.get(pk=group.pk)._schema_fingerprint, '')
+        get_node_for_object(group, bind=False).sync()
+
+        result, _ = list(flatten(db.cypher_query('MATCH (n) WHERE ID(n) = %d RETURN n' % node.id)))
+        self.assertNotIn('foo', result.properties)
+        self.assertEqual(result.properties['_schema_fingerprint'], node.__schema_fingerprint__)
+
+    @flush_nodes()
+    @override_settings(CHEMTRAILS={'CLEAN_NODES_ON_SYNC': False})
+    def test_sync_bound_node_keeps_schema_fingerprint(self):
+        group = Group.objects.create(name='group')
+        node = get_node_for_object(group)
+        db.cypher_query('MATCH (n) WHERE ID(n) = %d SET n.foo = "bar", n._schema_fingerprint = "stale"' % node.id)
+
+        get_node_for_object(group).sync()
+
+        result, _ = list(flatten(db.cypher_query('MATCH (n) WHERE ID(n) = %d RETURN n' % node.id)))
+        self.assertEqual(result.properties['foo'], 'bar')
+        self.assertEqual(result.properties['_schema_fingerprint'], 'stale')
+
+    def test_schema_fingerprint(self):
+        klass = get_node_class_for_model(Book)
+        self.assertEqual(klass.__schema_fingerprint__, klass.get_schema_fingerprint())
+        self.assertEqual(klass._schema_fingerprint.default, klass.__schema_fingerprint__)
+        self.assertNotEqual(klass.__schema_fingerprint__, get_node_class_for_model(Store).__schema_fingerprint__)
+
     @override_settings(CHEMTRAILS={
         'IGNORE_MODELS': ['auth']
     })
@@ -530,3 +592,25 @@ class GraphMapperTestCase(TestCase):
         finally:
             post_save.connect(post_save_handler, dispatch_uid='chemtrails.signals.handlers.post_save_handler')
             m2m_changed.connect(m2m_changed_handler, dispatch_uid='chemtrails.signals.handlers.m2m_changed_handler')
+
+    @flush_nodes()
+    def test_recursive_connect_removes_stale_relationships(self):
+        post_save.disconnect(post_save_handler, dispatch_uid='chemtrails.signals.handlers.post_save_handler')
+        m2m_changed.disconnect(m2m_changed_handler, dispatch_uid='chemtrails.signals.handlers.m2m_changed_handler')
+        try:
+            book = BookFixture(Book, generate_m2m={'authors': (2, 2)}).create_one()
+            book_node = get_node_for_object(book).save()
+            book_node.recursive_connect(1)
+            self.assertEqual(len(book_node.authors.all()), 2)
+
+            removed = book.authors.first()
+            book.authors.remove(removed)
+            book_node.recursive_connect(1)
+
+            self.assertEqual([n.pk for n in book_node.authors.all()],
+                             list(book.authors.values_list('pk', flat=True)))
+            author_node = get_node_class_for_model(Author).nodes.get(pk=removed.pk)
+            self.assertEqual(len(author_node.book_set.all()), 0)
+        finally:
+            post_save.connect(post_save_handler, dispatch_uid='chemtrails.signals.handlers.post_save_handler')
+            m2m_changed.connect(m2m_changed_handler, dispatch_uid='chemtrails.signals.handlers.m2m_changed_handler')
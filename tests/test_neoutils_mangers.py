@@ -25,20 +25,37 @@ class PathManagerTestCase(TestCase):
 
     def test_path_manager_build_path_query(self):
         user = get_user_model().objects.latest('pk')
-        query = self.node.paths.add('AUTHORS').add('USER', target_props={
+        manager = self.node.paths.add('AUTHORS').add('USER', target_props={
             'pk': user.pk,
             'username': user.username,
             'is_active': user.is_active
-        }).get_path()
-        result, meta = db.cypher_query(query)
+        })
+        result, meta = db.cypher_query(manager.get_path(), manager.params)
         self.assertTrue(len(result))
         self.assertEqual(meta, ('path',))
 
     def test_path_manager_build_match_query(self):
-        query = self.node.paths.add('AUTHORS').add('USER').get_match()
-        result, meta = db.cypher_query(query)
+        manager = self.node.paths.add('AUTHORS').add('USER')
+        result, meta = db.cypher_query(manager.get_match(), manager.params)
         self.assertTrue(len(result))
 
+    def test_path_manager_parameterized_query(self):
+        other = get_node_for_object(BookFixture(Book).create_one())
+        user = get_user_model().objects.latest('pk')
+
+        manager1 = self.node.paths.add('AUTHORS').add('USER', target_props={'username': user.username})
+        manager2 = other.paths.add('AUTHORS').add('USER', target_props={'username': 'someone else'})
+
+        # Paths with the same shape produce identical statements.
+        self.assertEqual(manager1.get_path(), manager2.get_path())
+        self.assertNotIn(user.username, manager1.get_path())
+        self.assertIn('{pk: $source0_pk}', manager1.get_path())
+
+        self.assertEqual(manager1.params['source0_pk'], self.node.pk)
+        self.assertEqual(manager1.params['target1_username'], user.username)
+        self.assertEqual(manager2.params['source0_pk'], other.pk)
+        self.assertEqual(manager2.params['target1_username'], 'someone else')
+
     def test_path_manager_build_query_with_invalid_relationship(self):
         node = get_node_for_object(BookFixture(Book).create_one())
         self.assertRaisesMessage(
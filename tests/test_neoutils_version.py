@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from chemtrails.neoutils import bump_graph_version, get_graph_version
+from chemtrails.neoutils.version import GRAPH_VERSION_KEY
+
+from tests.utils import flush_nodes
+
+
+@override_settings(CHEMTRAILS={'CACHE_PERMISSIONS': True})
+class GraphVersionTestCase(TestCase):
+
+    def setUp(self):
+        cache.delete(GRAPH_VERSION_KEY)
+
+    def test_bump_graph_version(self):
+        version = get_graph_version()
+        self.assertIsInstance(version, int)
+        self.assertEqual(get_graph_version(), version)
+
+        bump_graph_version()
+        self.assertEqual(get_graph_version(), version + 1)
+
+    def test_bump_missing_graph_version(self):
+        bump_graph_version()
+        self.assertIsNotNone(get_graph_version())
+
+    @override_settings(CHEMTRAILS={'CACHE_PERMISSIONS': False})
+    def test_bump_graph_version_without_cache_permissions(self):
+        version = get_graph_version()
+        bump_graph_version()
+        Group.objects.create(name='group')
+        self.assertEqual(get_graph_version(), version)
+
+    @override_settings(CHEMTRAILS={'CACHE_ALIAS': None, 'CACHE_PERMISSIONS': True})
+    def test_graph_version_without_cache(self):
+        bump_graph_version()
+        self.assertIsNone(get_graph_version())
+
+    @flush_nodes()
+    def test_signal_handlers_bump_graph_version(self):
+        version = get_graph_version()
+        group = Group.objects.create(name='group')
+        self.assertGreater(get_graph_version(), version)
+
+        version = get_graph_version()
+        group.delete()
+        self.assertGreater(get_graph_version(), version)
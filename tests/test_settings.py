@@ -11,7 +11,16 @@ class SettingsTestCase(TestCase):
         self.assertEqual(settings.MAX_CONNECTION_DEPTH, 1)
         self.assertEqual(settings.NAMED_RELATIONSHIPS, True)
         self.assertEqual(settings.CONNECT_META_NODES, False)
-        self.assertEqual(settings.IGNORE_MODELS, ['admin.logentry', 'migrations.migration'])
+        self.assertEqual(settings.SYNC_MODE, 'inline')
+        self.assertEqual(settings.SYNC_CHUNK_SIZE, 500)
+        self.assertEqual(settings.CLEAN_NODES_ON_SYNC, True)
+        self.assertEqual(settings.CACHE_ALIAS, 'default')
+        self.assertEqual(settings.CACHE_REGISTRIES, False)
+        self.assertEqual(settings.CACHE_PERMISSIONS, False)
+        self.assertEqual(settings.RULE_EVALUATION, 'sequential')
+        self.assertEqual(settings.RULE_EVALUATION_WORKERS, 4)
+        self.assertEqual(settings.RULE_STATISTICS_INTERVAL, 60)
+        self.assertEqual(settings.IGNORE_MODELS, ['admin.logentry', 'chemtrails.*', 'migrations.migration'])
 
     @override_settings(CHEMTRAILS={
         'ENABLED': False,
@@ -25,6 +34,15 @@ class SettingsTestCase(TestCase):
         self.assertEqual(settings.ENABLED, False)
         self.assertEqual(settings.NAMED_RELATIONSHIPS, False)
         self.assertEqual(settings.CONNECT_META_NODES, False)
+        self.assertEqual(settings.SYNC_MODE, 'inline')
+        self.assertEqual(settings.SYNC_CHUNK_SIZE, 500)
+        self.assertEqual(settings.CLEAN_NODES_ON_SYNC, True)
+        self.assertEqual(settings.CACHE_ALIAS, 'default')
+        self.assertEqual(settings.CACHE_REGISTRIES, False)
+        self.assertEqual(settings.CACHE_PERMISSIONS, False)
+        self.assertEqual(settings.RULE_EVALUATION, 'sequential')
+        self.assertEqual(settings.RULE_EVALUATION_WORKERS, 4)
+        self.assertEqual(settings.RULE_STATISTICS_INTERVAL, 60)
         self.assertEqual(settings.IGNORE_MODELS, ['auth.user'])
 
     def test_getting_invalid_setting(self):
@@ -39,3 +57,4 @@ class SettingsTestCase(TestCase):
             raise NotImplementedError
         except NotImplementedError as e:
             self.assertIsInstance(e, NotImplementedError)
+
@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 
+from unittest import mock
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
 from django.db.models.signals import post_save, pre_delete, m2m_changed
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils.six import StringIO
 
+from chemtrails.models import OutboxEntry
 from chemtrails.neoutils import get_node_class_for_model
 from chemtrails.signals.handlers import post_save_handler, pre_delete_handler, m2m_changed_handler
+from chemtrails.signals.queue import sync_queue
 
 from tests.testapp.autofixtures import Author, AuthorFixture, Book, BookFixture, Store, StoreFixture
+from tests.testapp.models import Publisher
 from tests.utils import flush_nodes
 
 
@@ -156,3 +165,116 @@ class PostSaveHandlerTestCase(TestCase):
         finally:
             m2m_changed.connect(m2m_changed_handler, dispatch_uid='chemtrails.signals.handlers.m2m_changed_handler')
             m2m_changed.disconnect(m2m_changed_handler, dispatch_uid='m2m_changed_handler.test')
+
+
+@override_settings(CHEMTRAILS={'SYNC_MODE': 'deferred'})
+class DeferredSyncTestCase(TestCase):
+    """
+    ``TestCase`` never commits, so the queue is flushed manually.
+    """
+    def tearDown(self):
+        sync_queue.clear()
+
+    @flush_nodes()
+    def test_post_save_is_deferred(self):
+        publisher = Publisher.objects.create(name='publisher', num_awards=1)
+        klass = get_node_class_for_model(Publisher)
+
+        self.assertIsNone(klass.nodes.get_or_none(pk=publisher.pk))
+        self.assertIn((Publisher, publisher.pk), sync_queue.pending())
+
+        sync_queue.flush()
+        self.assertEqual(publisher.pk, klass.nodes.get(pk=publisher.pk).pk)
+        self.assertEqual(sync_queue.pending(), [])
+
+    @flush_nodes()
+    def test_duplicate_saves_are_collapsed(self):
+        publisher = Publisher.objects.create(name='publisher', num_awards=1)
+        publisher.num_awards = 2
+        publisher.save()
+        publisher.save()
+        self.assertEqual(sync_queue.pending(), [(Publisher, publisher.pk)])
+
+    @flush_nodes()
+    def test_rolled_back_transaction_is_discarded(self):
+        try:
+            with transaction.atomic():
+                Publisher.objects.create(name='discarded', num_awards=1)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+
+        publisher = Publisher.objects.create(name='publisher', num_awards=1)
+        self.assertEqual(sync_queue.pending(), [(Publisher, publisher.pk)])
+
+    @flush_nodes()
+    def test_delete_is_deferred(self):
+        publisher = Publisher.objects.create(name='publisher', num_awards=1)
+        sync_queue.flush()
+
+        klass = get_node_class_for_model(Publisher)
+        pk = publisher.pk
+        publisher.delete()
+        self.assertIsNotNone(klass.nodes.get_or_none(pk=pk))
+
+        sync_queue.flush()
+        self.assertIsNone(klass.nodes.get_or_none(pk=pk))
+
+
+@override_settings(CHEMTRAILS={'SYNC_MODE': 'outbox'})
+class OutboxSyncTestCase(TestCase):
+
+    @flush_nodes()
+    def test_post_save_writes_outbox_entry(self):
+        publisher = Publisher.objects.create(name='publisher', num_awards=1)
+        klass = get_node_class_for_model(Publisher)
+
+        self.assertIsNone(klass.nodes.get_or_none(pk=publisher.pk))
+        self.assertTrue(OutboxEntry.objects.filter(content_type=ContentType.objects.get_for_model(Publisher),
+                                                   object_pk=str(publisher.pk)).exists())
+
+    @flush_nodes()
+    def test_worker_drains_outbox(self):
+        publisher = Publisher.objects.create(name='publisher', num_awards=1)
+        publisher.save()
+        self.assertEqual(OutboxEntry.objects.count(), 2)
+
+        call_command('chemtrails_worker', once=True, stdout=StringIO())
+        self.assertEqual(OutboxEntry.objects.count(), 0)
+        self.assertEqual(publisher.pk, get_node_class_for_model(Publisher).nodes.get(pk=publisher.pk).pk)
+
+    @flush_nodes()
+    def test_worker_deletes_removed_objects(self):
+        publisher = Publisher.objects.create(name='publisher', num_awards=1)
+        call_command('chemtrails_worker', once=True, stdout=StringIO())
+
+        pk = publisher.pk
+        publisher.delete()
+        call_command('chemtrails_worker', once=True, stdout=StringIO())
+        self.assertIsNone(get_node_class_for_model(Publisher).nodes.get_or_none(pk=pk))
+
+    @flush_nodes()
+    def test_worker_records_database_errors(self):
+        Publisher.objects.create(name='publisher', num_awards=1)
+
+        def sync_objects(*args, **kwargs):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT * FROM chemtrails_missing_table')
+
+        with mock.patch('chemtrails.management.commands.chemtrails_worker.sync_objects', sync_objects):
+            call_command('chemtrails_worker', once=True, stdout=StringIO())
+
+        entry = OutboxEntry.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn('chemtrails_missing_table', entry.last_error)
+
+    @flush_nodes()
+    @override_settings(CHEMTRAILS={'SYNC_MODE': 'outbox', 'IGNORE_MODELS': []})
+    def test_outbox_entries_are_not_queued(self):
+        Publisher.objects.create(name='publisher', num_awards=1)
+        entry = OutboxEntry.objects.get()
+        entry.save()
+        self.assertEqual(OutboxEntry.objects.count(), 1)
+
+        call_command('chemtrails_worker', once=True, stdout=StringIO())
+        self.assertEqual(OutboxEntry.objects.count(), 0)
@@ -34,3 +34,7 @@ class UtilsTestCase(TestCase):
 
     def test_get_environment_variable_float(self):
         self.assertEqual(utils.get_environment_variable('1.0'), 1.0)
+
+    def test_chunked(self):
+        self.assertEqual(list(utils.chunked(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(utils.chunked(iter([]), 2)), [])
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.2 on 2017-07-03 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('testapp', '0007_delete_jsonmodel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Award',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100)),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='awards', to='testapp.Author')),
+            ],
+        ),
+    ]
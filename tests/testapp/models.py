@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+import uuid
+
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
@@ -72,3 +74,12 @@ class Guild(models.Model):
     name = models.CharField(max_length=100)
     contact = models.ForeignKey(Author, related_name='guild_contacts')
     members = models.ManyToManyField(Author, verbose_name='members', related_name='guild_set')
+
+
+class Award(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=100)
+    author = models.ForeignKey(Author, related_name='awards')
+
+    def __str__(self):
+        return self.name